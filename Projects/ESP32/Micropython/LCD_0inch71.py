@@ -6,42 +6,103 @@ import framebuf
 LCD_WIDTH  = 160
 LCD_HEIGHT = 160
 
+# Bytes per spi.write when sending the framebuffer. The whole buffer goes in
+# one write by default; set this lower (e.g. 4096) if a port's SPI driver
+# cannot take a 51,200-byte transfer.
+SHOW_CHUNK = LCD_WIDTH * LCD_HEIGHT * 2
+
+# Panel commands used outside the init table
+CASET = 0x2A # Column Address Set
+RASET = 0x2B # Row Address Set
+RAMWR = 0x2C # Memory Write
+
+# Initialization Sequence for GC9D01 / 0.71"
+# Each entry is: command, count, then `count` data bytes. If bit 7 of the count
+# is set, one more byte follows: milliseconds to wait after the command.
+DELAY = 0x80
+INIT_SEQUENCE = bytes((
+    0xFE, 0,
+    0xEF, 0,
+    0x80, 1, 0xFF,
+    0x81, 1, 0xFF,
+    0x82, 1, 0xFF,
+    0x83, 1, 0xFF,
+    0x84, 1, 0xFF,
+    0x89, 1, 0x03,
+    0x8D, 1, 0x03,
+    0x8E, 1, 0x03,
+    0x8F, 1, 0x03,
+    0x36, 1, 0x00,                          # Memory Access Control: 0x00 = RGB, 0xC0 = BGR (Try changing this if colors are swapped)
+    0x3A, 1, 0x05,                          # Pixel Format: 16-bit color
+    0xC0, 1, 0x70,
+    0xC3, 1, 0x04,
+    0xC4, 1, 0x0C,
+    0xCB, 1, 0x00,
+    0xE4, 1, 0x60,                          # Frame Rate
+    0xF0, 6, 0x45, 0x09, 0x08, 0x08, 0x26, 0x2A, # Gamma 1
+    0xF1, 6, 0x43, 0x70, 0x72, 0x36, 0x37, 0x6F, # Gamma 2
+    0xF2, 6, 0x45, 0x09, 0x08, 0x08, 0x26, 0x2A, # Gamma 3
+    0xF3, 6, 0x43, 0x70, 0x72, 0x36, 0x37, 0x6F, # Gamma 4
+    0x21, 0,                                # Display Inversion ON (IPS screens usually need this)
+    0x11, DELAY, 120,                       # Sleep Out
+    0x29, 0,                                # Display ON
+))
+
 class LCD_0inch71(framebuf.FrameBuffer):
     def __init__(self, dc, cs, rst, clk, mosi, bl=None):
         self.width = LCD_WIDTH
         self.height = LCD_HEIGHT
-        
+
         self.cs = cs
         self.dc = dc
         self.rst = rst
         self.bl = bl
-        
+
         self.cs.init(self.cs.OUT, value=1)
         self.dc.init(self.dc.OUT, value=0)
         self.rst.init(self.rst.OUT, value=1)
-        
+
         # Initialize SPI
         # baudrate=40000000 (40MHz) is standard for these screens
         self.spi = SPI(1, baudrate=40000000, polarity=0, phase=0, sck=clk, mosi=mosi)
-        
+
         # Initialize Buffer (16-bit color, RGB565)
         # 160 * 160 * 2 bytes = 51,200 bytes (Fits in ESP32-C3 RAM)
         self.buffer = bytearray(self.height * self.width * 2)
         super().__init__(self.buffer, self.width, self.height, framebuf.RGB565)
-        
+
+        # Preallocated, so sending a frame allocates nothing: the buffer
+        # itself, or memoryview slices of it made once here
+        if SHOW_CHUNK >= len(self.buffer):
+            self._chunks = (self.buffer,)
+        else:
+            mv = memoryview(self.buffer)
+            self._chunks = tuple(mv[i:i + SHOW_CHUNK] for i in range(0, len(mv), SHOW_CHUNK))
+        self._cmd = bytearray(1)
+        self._window = bytearray(4)
+
         # Start Init Sequence
         self.init_display()
 
-    def write_cmd(self, cmd):
+    def write_cmd(self, cmd, data=None):
+        # One CS-low transaction: the command byte, then its data (if any)
+        self._cmd[0] = cmd
         self.cs(0)
         self.dc(0)
-        self.spi.write(bytearray([cmd]))
+        self.spi.write(self._cmd)
+        if data:
+            self.dc(1)
+            self.spi.write(data)
         self.cs(1)
 
     def write_data(self, buf):
+        # Takes a single byte value or a buffer
+        if isinstance(buf, int):
+            self._cmd[0] = buf
+            buf = self._cmd
         self.cs(0)
         self.dc(1)
-        self.spi.write(bytearray([buf]))
+        self.spi.write(buf)
         self.cs(1)
 
     def init_display(self):
@@ -52,107 +113,41 @@ class LCD_0inch71(framebuf.FrameBuffer):
         time.sleep(0.1)
         self.rst(1)
         time.sleep(0.1)
-        
-        # Initialization Sequence for GC9D01 / 0.71" 
-        self.write_cmd(0xFE)
-        self.write_cmd(0xEF)
-        
-        self.write_cmd(0x80)
-        self.write_data(0xFF)
-        
-        self.write_cmd(0x81)
-        self.write_data(0xFF)
-        
-        self.write_cmd(0x82)
-        self.write_data(0xFF)
-        
-        self.write_cmd(0x83)
-        self.write_data(0xFF)
-        
-        self.write_cmd(0x84)
-        self.write_data(0xFF)
-
-        self.write_cmd(0x89)
-        self.write_data(0x03)
-        
-        self.write_cmd(0x8D)
-        self.write_data(0x03) 
-        
-        self.write_cmd(0x8E)
-        self.write_data(0x03) 
-        
-        self.write_cmd(0x8F)
-        self.write_data(0x03) 
-        
-        self.write_cmd(0x36) # Memory Access Control
-        self.write_data(0x00) # 0x00 = RGB, 0xC0 = BGR (Try changing this if colors are swapped)
-        
-        self.write_cmd(0x3A) # Pixel Format
-        self.write_data(0x05) # 16-bit color
-        
-        self.write_cmd(0xC0) 
-        self.write_data(0x70) 
-        
-        self.write_cmd(0xC3) 
-        self.write_data(0x04) 
-        
-        self.write_cmd(0xC4) 
-        self.write_data(0x0C) 
-        
-        self.write_cmd(0xCB) 
-        self.write_data(0x00) 
-        
-        self.write_cmd(0xE4) # Frame Rate
-        self.write_data(0x60) 
-        
-        self.write_cmd(0xF0) # Gamma 1
-        self.write_data(0x45)
-        self.write_data(0x09)
-        self.write_data(0x08)
-        self.write_data(0x08)
-        self.write_data(0x26)
-        self.write_data(0x2A) 
-        
-        self.write_cmd(0xF1) # Gamma 2
-        self.write_data(0x43)
-        self.write_data(0x70)
-        self.write_data(0x72)
-        self.write_data(0x36)
-        self.write_data(0x37)
-        self.write_data(0x6F) 
-
-        self.write_cmd(0xF2) # Gamma 3
-        self.write_data(0x45)
-        self.write_data(0x09)
-        self.write_data(0x08)
-        self.write_data(0x08)
-        self.write_data(0x26)
-        self.write_data(0x2A) 
-
-        self.write_cmd(0xF3) # Gamma 4
-        self.write_data(0x43)
-        self.write_data(0x70)
-        self.write_data(0x72)
-        self.write_data(0x36)
-        self.write_data(0x37)
-        self.write_data(0x6F) 
-        
-        self.write_cmd(0x21) # Display Inversion ON (IPS screens usually need this)
-        
-        self.write_cmd(0x11) # Sleep Out
-        time.sleep(0.12)
-        self.write_cmd(0x29) # Display ON
+
+        table = memoryview(INIT_SEQUENCE)
+        i = 0
+        while i < len(table):
+            cmd, count = table[i], table[i + 1]
+            n = count & ~DELAY
+            self.write_cmd(cmd, table[i + 2:i + 2 + n])
+            i += 2 + n
+            if count & DELAY:
+                time.sleep(table[i] / 1000)
+                i += 1
+
+    def set_window(self, x0, y0, x1, y1):
+        # Inclusive bounds; the panel's writes then fill this rectangle
+        w = self._window
+        w[0] = x0 >> 8
+        w[1] = x0 & 0xFF
+        w[2] = x1 >> 8
+        w[3] = x1 & 0xFF
+        self.write_cmd(CASET, w)
+        w[0] = y0 >> 8
+        w[1] = y0 & 0xFF
+        w[2] = y1 >> 8
+        w[3] = y1 & 0xFF
+        self.write_cmd(RASET, w)
 
     def show(self):
-        # Set Window to 0,0 -> 160,160
-        self.write_cmd(0x2A) # Column Addr
-        self.write_data(0x00)
-        self.write_data(0x00)
-        self.write_data(0x00)
-        self.write_data(LCD_WIDTH - 1)
-        
-        self.write_cmd(0x2B) # Row Addr
-        self.write_data(0x00)
-        self.write_data(0x00)
-        self.write_data(0x00)
-        self.write_data
\ No newline at end of file
+        # Set Window to 0,0 -> 159,159, then send the whole framebuffer in
+        # one transaction: CS held low, DC high, one write per chunk
+        self.set_window(0, 0, LCD_WIDTH - 1, LCD_HEIGHT - 1)
+        self._cmd[0] = RAMWR
+        self.cs(0)
+        self.dc(0)
+        self.spi.write(self._cmd)
+        self.dc(1)
+        for chunk in self._chunks:
+            self.spi.write(chunk)
+        self.cs(1)
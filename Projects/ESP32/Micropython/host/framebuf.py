@@ -0,0 +1,57 @@
+# Stand-in for MicroPython's `framebuf` module, for running the drivers on
+# a PC. Only RGB565 is implemented, with the same little-endian byte order.
+
+MONO_VLSB = 0
+RGB565 = 1
+
+
+class FrameBuffer:
+    def __init__(self, buffer, width, height, format, stride=None):
+        if format != RGB565:
+            raise ValueError("only RGB565 is implemented")
+        self._buf = memoryview(buffer).cast('H')
+        self._width = width
+        self._height = height
+        self._stride = stride or width
+
+    def pixel(self, x, y, c=None):
+        if not (0 <= x < self._width and 0 <= y < self._height):
+            return None
+        i = y * self._stride + x
+        if c is None:
+            return self._buf[i]
+        self._buf[i] = c
+
+    def fill_rect(self, x, y, w, h, c):
+        x0, x1 = max(x, 0), min(x + w, self._width)
+        if x0 >= x1:
+            return
+        row = bytes((c & 0xFF, c >> 8 & 0xFF)) * (x1 - x0)
+        data = self._buf.cast('B')
+        for yy in range(max(y, 0), min(y + h, self._height)):
+            start = 2 * (yy * self._stride + x0)
+            data[start:start + len(row)] = row
+
+    def fill(self, c):
+        self.fill_rect(0, 0, self._width, self._height, c)
+
+    def hline(self, x, y, w, c):
+        self.fill_rect(x, y, w, 1, c)
+
+    def vline(self, x, y, h, c):
+        self.fill_rect(x, y, 1, h, c)
+
+    def rect(self, x, y, w, h, c, f=False):
+        if f:
+            self.fill_rect(x, y, w, h, c)
+            return
+        self.hline(x, y, w, c)
+        self.hline(x, y + h - 1, w, c)
+        self.vline(x, y, h, c)
+        self.vline(x + w - 1, y, h, c)
+
+    def text(self, s, x, y, c=1):
+        # No font here: each character is drawn as a filled 8x8 cell
+        for i in range(len(s)):
+            if s[i] != ' ':
+                self.fill_rect(x + 8 * i, y, 8, 8, c)
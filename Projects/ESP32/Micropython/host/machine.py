@@ -0,0 +1,74 @@
+# Stand-in for MicroPython's `machine` module, for running the drivers on a
+# PC. Pins record every change of level and SPI every write, with the CS
+# and DC levels at the time, in one log in order, so the traffic can be
+# checked and the time it would take on the bus worked out.
+
+class Pin:
+    IN = 0
+    OUT = 1
+
+    def __init__(self, id, mode=-1, value=None):
+        self.id = id
+        self.mode = mode
+        self._value = 0 if value is None else value
+
+    def init(self, mode=-1, value=None):
+        self.mode = mode
+        if value is not None:
+            self.value(value)
+
+    def value(self, v=None):
+        if v is None:
+            return self._value
+        v = 1 if v else 0
+        if v != self._value and SPI.record:
+            SPI.log.append(('pin', self.id, v))
+        self._value = v
+
+    def __call__(self, v=None):
+        return self.value(v)
+
+
+class SPI:
+    # Every SPI instance and Pin writes to this one log, so a test can read
+    # it without reaching into the driver: ('pin', id, level) for a change of
+    # level, ('spi', cs, dc, bytes) for a write. Set `cs` and `dc` to the
+    # driver's pins before creating it to have their levels on the writes.
+    log = []
+    record = True   # False keeps the counters but not the bytes
+    cs = None
+    dc = None
+
+    def __init__(self, id, baudrate=1000000, polarity=0, phase=0, sck=None, mosi=None, miso=None):
+        self.id = id
+        self.baudrate = baudrate
+        self.writes = 0
+        self.bytes = 0
+
+    def write(self, buf):
+        self.writes += 1
+        self.bytes += len(buf)
+        if SPI.record:
+            SPI.log.append(('spi', self.cs() if self.cs else None,
+                            self.dc() if self.dc else None, bytes(buf)))
+
+    def bus_seconds(self):
+        """Time the bytes written so far would take at `baudrate`."""
+        return self.bytes * 8 / self.baudrate
+
+
+class PWM:
+    def __init__(self, pin, freq=0, duty_u16=0):
+        self.pin = pin
+        self._freq = freq
+        self._duty = duty_u16
+
+    def freq(self, f=None):
+        if f is None:
+            return self._freq
+        self._freq = f
+
+    def duty_u16(self, d=None):
+        if d is None:
+            return self._duty
+        self._duty = d
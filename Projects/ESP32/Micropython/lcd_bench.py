@@ -0,0 +1,159 @@
+# Measures how many frames per second LCD_0inch71.show() can send.
+#
+# On the board: copy this next to LCD_0inch71.py and run it.
+# On a PC: `python lcd_bench.py` runs the driver against the stand-ins in
+# host/, checks the SPI traffic it produces and works out the frame rate
+# the bytes would allow at the SPI clock.
+import sys
+import time
+
+ON_HOST = sys.implementation.name != 'micropython'
+if ON_HOST:
+    import os
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'host'))
+
+from machine import Pin, SPI
+import LCD_0inch71
+
+# --- PIN DEFINITIONS (Waveshare ESP32-C3-0.71) ---
+PIN_DC   = 4
+PIN_CS   = 5
+PIN_CLK  = 6
+PIN_MOSI = 7
+PIN_RST  = 8
+
+FRAMES = 50          # Frames timed
+LEGACY_ROWS = 2      # Rows sent a byte at a time, for the old path's rate
+
+
+def ticks_us():
+    if hasattr(time, 'ticks_us'):
+        return time.ticks_us()
+    return int(time.perf_counter() * 1000000)
+
+
+def elapsed_us(start):
+    if hasattr(time, 'ticks_diff'):
+        return time.ticks_diff(time.ticks_us(), start)
+    return ticks_us() - start
+
+
+def cs_periods(log, cs_pin=PIN_CS):
+    """Splits the logged traffic at the CS edges: one list of (dc, bytes)
+    writes per time CS went low, checking that nothing is written while
+    CS is high."""
+    periods, current = [], None
+    for entry in log:
+        if entry[0] == 'pin':
+            if entry[1] == cs_pin:
+                current = [] if entry[2] == 0 else None
+                if current is not None:
+                    periods.append(current)
+        elif current is None:
+            raise AssertionError("SPI write with CS high")
+        else:
+            current.append((entry[2], entry[3]))
+    return periods
+
+
+def transactions(periods):
+    """(command, data) pairs from CS-low periods."""
+    found = []
+    for writes in periods:
+        for dc, data in writes:
+            if dc == 0:
+                for cmd in data:
+                    found.append((cmd, bytearray()))
+            else:
+                found[-1][1].extend(data)
+    return found
+
+
+def expected_init():
+    table = LCD_0inch71.INIT_SEQUENCE
+    found = []
+    i = 0
+    while i < len(table):
+        n = table[i + 1] & ~LCD_0inch71.DELAY
+        found.append((table[i], bytearray(table[i + 2:i + 2 + n])))
+        i += 2 + n + (1 if table[i + 1] & LCD_0inch71.DELAY else 0)
+    return found
+
+
+def check(name, ok):
+    print(('  ok    ' if ok else '  FAIL  ') + name)
+    return ok
+
+
+def run_checks(lcd):
+    """Host only: the traffic from init and from one show()."""
+    ok = check("init sends the command table",
+               transactions(cs_periods(SPI.log)) == expected_init())
+    del SPI.log[:]
+    writes = lcd.spi.writes
+    lcd.fill(0xF800)
+    lcd.text("MicroPython", 35, 60, 0xFFFF)
+    lcd.show()
+    periods = cs_periods(SPI.log)
+    sent = transactions(periods)
+    last = LCD_0inch71.LCD_WIDTH - 1
+    window = bytearray((0, 0, last >> 8, last & 0xFF))
+    ok &= check("show sets the full window", sent[:2] == [(LCD_0inch71.CASET, window),
+                                                         (LCD_0inch71.RASET, window)])
+    ok &= check("show sends the framebuffer after RAMWR",
+                len(sent) == 3 and sent[2][0] == LCD_0inch71.RAMWR and sent[2][1] == lcd.buffer)
+    # One CS-low period per command: a driver that toggled CS per chunk
+    # would show more than three, and CS must end high.
+    cs_edges = [e[2] for e in SPI.log if e[0] == 'pin' and e[1] == PIN_CS]
+    ok &= check("show pulls CS low once and raises it once for the frame",
+                len(periods) == 3 and cs_edges == [0, 1] * 3)
+    per_frame = lcd.spi.writes - writes
+    ok &= check("show uses %d SPI writes" % per_frame,
+                per_frame == 6 + (len(lcd.buffer) - 1) // LCD_0inch71.SHOW_CHUNK)
+    del SPI.log[:]
+    return ok
+
+
+def run_bench():
+    ok = True
+    if ON_HOST:
+        SPI.cs = cs = Pin(PIN_CS)
+        SPI.dc = dc = Pin(PIN_DC)
+    else:
+        cs, dc = Pin(PIN_CS), Pin(PIN_DC)
+    lcd = LCD_0inch71.LCD_0inch71(dc=dc, cs=cs, rst=Pin(PIN_RST), clk=Pin(PIN_CLK),
+                                  mosi=Pin(PIN_MOSI))
+    if ON_HOST:
+        ok = run_checks(lcd)
+        SPI.record = False
+
+    frame_bytes = len(lcd.buffer)
+    start = ticks_us()
+    for i in range(FRAMES):
+        lcd.show()
+    us = elapsed_us(start)
+    print("show(): %.1f frames/s (%d us per frame, %d bytes)"
+          % (FRAMES * 1e6 / us, us // FRAMES, frame_bytes))
+
+    # The old path: one write_data() call, with its own CS toggle, per byte.
+    row = lcd.width * 2
+    start = ticks_us()
+    for i in range(LEGACY_ROWS * row):
+        lcd.write_data(lcd.buffer[i])
+    us = elapsed_us(start) * frame_bytes / (LEGACY_ROWS * row)
+    print("byte at a time: %.2f frames/s (%d us per frame, extrapolated from %d rows)"
+          % (1e6 / us, us, LEGACY_ROWS))
+
+    if ON_HOST:
+        # On a PC the Python time says little; the bus time is the limit.
+        bus = frame_bytes * 8 / lcd.spi.baudrate
+        print("SPI at %d MHz: %.1f frames/s at most (%.2f ms per frame)"
+              % (lcd.spi.baudrate // 1000000, 1 / bus, bus * 1000))
+    print('PASS' if ok else 'FAIL')
+    return ok
+
+
+if __name__ == '__main__':
+    ok = run_bench()
+    if ON_HOST:
+        raise SystemExit(0 if ok else 1)
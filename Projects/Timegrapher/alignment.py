@@ -0,0 +1,305 @@
+# alignment.py
+import argparse
+import time
+import numpy as np
+
+# --- Configuration ---
+SAMPLE_SIZE = 4
+BLOCK_SAMPLES = 4096        # Alignment is re-checked once per block
+LOCK_SAMPLES = 256          # Samples needed before the first lock
+LOCK_LIMIT_SAMPLES = 65536  # Lock on the best guess after this much ambiguous data
+LOCK_THRESHOLD = 0.95       # Fraction of samples that must look right
+LOCK_MARGIN = 0.01          # ...and by how much better than the next best offset
+MIN_SLIP_GAIN = 16          # Samples a slip must explain before we believe it
+
+# --- Benchmark Configuration ---
+BENCH_INPUT_FILENAME = 'raw_audio_misaligned.bin'
+BENCH_SLIPS = 50
+SLIP_LOSS_SAMPLES = 2       # Samples next to a dropped byte's that a slip may also cost
+
+
+# The device sends 24-bit samples in 32-bit little-endian words, so the top
+# byte of every word is the sign extension of bit 23: 0x00 if that bit is
+# clear, 0xFF if it is set. At the right byte offset this holds for every
+# sample; at a wrong one it holds only by coincidence. Checking it needs a
+# couple of vectorised byte compares and nothing but the data itself.
+
+def sign_matches(data):
+    """match[i] is True where byte i+1 is the sign extension of byte i."""
+    b = np.frombuffer(data, dtype=np.uint8)
+    extension = (b[:-1].view(np.int8) >> 7).view(np.uint8)
+    return b[1:] == extension
+
+
+def phase_matches(data, count=None):
+    """(4, n) bool array: whether sample j looks valid at byte offset q.
+
+    Sample j at offset q is bytes q+4j .. q+4j+3, so its top byte is checked
+    by sign_matches at index q+4j+2.
+    """
+    matches = sign_matches(data)
+    if count is None:
+        count = (len(matches) - 2 - (SAMPLE_SIZE - 1)) // SAMPLE_SIZE + 1
+    count = max(count, 0)
+    out = np.zeros((SAMPLE_SIZE, count), dtype=bool)
+    for q in range(SAMPLE_SIZE):
+        column = matches[q + 2::SAMPLE_SIZE][:count]
+        out[q, :len(column)] = column
+    return out
+
+
+def phase_scores(data):
+    """Fraction of samples that look valid at each of the four byte offsets."""
+    m = phase_matches(data)
+    return m.mean(axis=1) if m.shape[1] else np.zeros(SAMPLE_SIZE)
+
+
+def find_offset(data, threshold=LOCK_THRESHOLD, margin=LOCK_MARGIN):
+    """The byte offset of the first whole sample in `data`, or None if the
+    data does not decide it yet (too short, silent, or no offset fits)."""
+    scores = phase_scores(data)
+    order = np.argsort(scores)[::-1]
+    best, second = scores[order[0]], scores[order[1]]
+    if best >= threshold and best - second >= margin:
+        return int(order[0])
+    return None
+
+
+def _decode(raw):
+    samples = np.frombuffer(raw, dtype='<i4').copy()
+    samples <<= 8
+    samples >>= 8
+    return samples
+
+
+class Aligner:
+    """Turns an unframed byte stream into sign-extended int32 samples and
+    keeps it aligned.
+
+    Locks on from the first LOCK_SAMPLES samples, then checks every block.
+    If the stream has slipped (a byte was dropped or inserted), it finds the
+    exact sample where the old offset stopped fitting and the new one
+    started, re-locks there and records the slip in `slips` as
+    (byte position in the input, bytes skipped to re-align).
+    """
+
+    def __init__(self, block_samples=BLOCK_SAMPLES, verbose=True):
+        self.block_samples = block_samples
+        self.verbose = verbose
+        self.locked = False
+        self.slips = []
+        self.bytes_in = 0
+        self.samples_out = 0
+        self.skipped_bytes = 0
+        self._pending = bytearray()
+        self._start = 0     # Consumed bytes at the front of _pending
+        self._position = 0  # Input byte position of _pending[_start]
+
+    def _consume(self, n):
+        self._start += n
+        self._position += n
+
+    def _skip(self, n):
+        self._consume(n)
+        self.skipped_bytes += n
+
+    def _lock(self, final):
+        available = (len(self._pending) - self._start) // SAMPLE_SIZE - 1
+        if available < LOCK_SAMPLES and not final:
+            return False
+        offset = find_offset(self._pending[self._start:])
+        if offset is None:
+            if available < LOCK_LIMIT_SAMPLES and not final:
+                return False
+            # Silence or garbage for a long time: go with the best guess, the
+            # per-block check will correct it once there is real signal.
+            offset = int(np.argmax(phase_scores(self._pending[self._start:])))
+        self._skip(offset)
+        self.locked = True
+        if self.verbose:
+            print(f"Alignment: locked at byte {self._position} (offset {offset}).")
+        return True
+
+    def _find_slip(self, matches):
+        """Best split point and new offset, if switching explains the block
+        better than the current offset does."""
+        current = matches[0]
+        if current.all():
+            return None
+        kept = np.concatenate(([0], np.cumsum(current)))
+        best = (int(kept[-1]) + MIN_SLIP_GAIN - 1, None, None)
+        for q in range(1, SAMPLE_SIZE):
+            after = np.concatenate((np.cumsum(matches[q][::-1])[::-1], [0]))
+            scores = kept + after
+            k = int(np.argmax(scores))
+            if scores[k] > best[0]:
+                best = (int(scores[k]), k, q)
+        return None if best[1] is None else best[1:]
+
+    def _process_block(self, count):
+        """Emits up to `count` samples from the (aligned) start of _pending."""
+        nbytes = count * SAMPLE_SIZE
+        block = memoryview(self._pending)[self._start:self._start + nbytes + SAMPLE_SIZE]
+        # Look one sample ahead so every offset can be scored on `count` samples.
+        matches = phase_matches(block, count)
+        slip = self._find_slip(matches)
+        # Two slips close together can look like one bigger slip at the
+        # second; take the earliest one and let the next block find the rest.
+        while slip is not None:
+            earlier = self._find_slip(matches[:, :slip[0]])
+            if earlier is None:
+                break
+            slip = earlier
+        if slip is None:
+            samples = _decode(block[:nbytes])
+            block.release()
+            self._consume(nbytes)
+            return samples
+        k, q = slip
+        samples = _decode(block[:k * SAMPLE_SIZE])
+        block.release()
+        self._consume(k * SAMPLE_SIZE)
+        self.slips.append((self._position, q))
+        if self.verbose:
+            print(f"Alignment: slip at byte {self._position}, skipping {q} bytes to re-lock.")
+        self._skip(q)
+        return samples
+
+    def feed(self, data, final=False):
+        """Adds bytes and returns all the samples that are now certain."""
+        self._pending += memoryview(data).cast('B')
+        self.bytes_in += len(data)
+        if not self.locked and not self._lock(final):
+            return np.empty(0, dtype=np.int32)
+
+        out = []
+        # Keep one sample back for look-ahead, unless this is the end.
+        while True:
+            whole = (len(self._pending) - self._start) // SAMPLE_SIZE - (0 if final else 1)
+            if whole <= 0 or (whole < self.block_samples and not final):
+                break
+            out.append(self._process_block(min(whole, self.block_samples)))
+        del self._pending[:self._start]
+        self._start = 0
+        samples = np.concatenate(out) if out else np.empty(0, dtype=np.int32)
+        self.samples_out += len(samples)
+        return samples
+
+    def flush(self):
+        """Returns whatever samples are left at the end of the stream."""
+        return self.feed(b'', final=True)
+
+    def stats(self):
+        return {
+            'locked': self.locked,
+            'bytes_in': self.bytes_in,
+            'samples_out': self.samples_out,
+            'slips': len(self.slips),
+            'skipped_bytes': self.skipped_bytes,
+        }
+
+    def report(self):
+        s = self.stats()
+        state = 'locked' if s['locked'] else 'searching'
+        return (f"{state}, {s['samples_out']} samples from {s['bytes_in']} bytes, "
+                f"{s['slips']} slips, {s['skipped_bytes']} bytes skipped")
+
+
+# --- Self-check and Benchmark ---
+
+def _capture_samples(filename=BENCH_INPUT_FILENAME):
+    """Decoded samples of the sample capture (which is SOF-framed)."""
+    from framing import capture_payloads, decode_samples
+    with open(filename, 'rb') as f:
+        return decode_samples(capture_payloads(f.read()))
+
+
+def _in_order(got, samples, damaged, loss=SLIP_LOSS_SAMPLES):
+    """Checks `got` against `samples` with the samples at indices `damaged`
+    hit by a dropped byte. Each run of samples between two damaged ones must
+    come out whole and in order, except that at most `loss` samples next to
+    each damaged one may be lost too; the output may hold one garbled sample
+    in place of each lost one. Returns (samples in place, the most samples
+    lost next to one slip, or None if a run is out of order or missing)."""
+    starts = [0] + [j + 1 for j in damaged]
+    ends = list(damaged) + [len(samples)]
+    pos = exact = worst = 0
+    trailing = 0    # Samples missing from the end of the previous run
+    for start, end in zip(starts, ends):
+        run = samples[start:end]
+        best = None
+        for skipped in range(loss + 2):         # Garbled samples in the output
+            for missing in range(loss + 1):     # Samples of the run not there
+                n = min(len(run) - missing, len(got) - pos - skipped)
+                if n <= 0:
+                    continue
+                differ = np.flatnonzero(got[pos + skipped:pos + skipped + n] != run[missing:missing + n])
+                matched = int(differ[0]) if len(differ) else n
+                if best is None or matched > best[0]:
+                    best = (matched, skipped, missing)
+        if best is None:
+            return exact, None
+        matched, skipped, missing = best
+        lost = trailing + missing
+        if lost > loss or skipped > lost + 1:
+            return exact, None
+        trailing = len(run) - missing - matched
+        worst = max(worst, lost)
+        exact += matched
+        pos += skipped + matched
+    if trailing > loss or len(got) - pos > loss + 1:
+        return exact, None
+    return exact, worst
+
+
+def run_selfcheck(slips=BENCH_SLIPS, seed=0):
+    """Drops single bytes at random places in the capture's samples and
+    checks that every slip is found within one block and the output
+    realigns exactly."""
+    rng = np.random.default_rng(seed)
+    samples = _capture_samples()
+    clean = samples.astype('<i4').tobytes()
+    cuts = np.sort(rng.choice(np.arange(1, len(samples) - 1), size=slips, replace=False)) * SAMPLE_SIZE
+    cuts += rng.integers(0, SAMPLE_SIZE, size=slips)
+    damaged = bytearray()
+    last = 0
+    for cut in cuts:
+        damaged += clean[last:cut]
+        last = cut + 1  # Drop one byte
+    damaged += clean[last:]
+    damaged = b'\x12\x34\x56' + bytes(damaged)  # Start misaligned too
+
+    aligner = Aligner(verbose=False)
+    start = time.perf_counter()
+    out = [aligner.feed(damaged[i:i + 65536]) for i in range(0, len(damaged), 65536)]
+    out.append(aligner.flush())
+    elapsed = time.perf_counter() - start
+    got = np.concatenate(out)
+
+    # Each dropped byte corrupts the sample it was in, and the slip is found
+    # at most one block late; everything else must come out exact and in
+    # order.
+    in_place, worst_loss = _in_order(got, samples, cuts // SAMPLE_SIZE)
+    exact = in_place / len(samples)
+    found = len(aligner.slips)
+    late = [pos - (cut - i + 3) for i, (cut, (pos, _)) in enumerate(zip(cuts, aligner.slips))]
+    print(f"Self-check: {slips} dropped bytes in {len(damaged)} bytes")
+    print(f"  {aligner.report()}")
+    print(f"  {found} slips found, worst {max(late) // SAMPLE_SIZE if late else 0} samples late, "
+          f"{exact:.4%} of input samples out exact and in order, "
+          f"{'out of order' if worst_loss is None else f'at most {worst_loss} lost per slip'}")
+    print(f"  {len(damaged) / elapsed / 1e6:.0f} MB/s")
+    ok = (found == slips and max(late) < BLOCK_SAMPLES * SAMPLE_SIZE
+          and worst_loss is not None and exact > 0.999)
+    print("PASS" if ok else "FAIL")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Byte alignment of the unframed sample stream.")
+    parser.add_argument('--selfcheck', action='store_true',
+                        help="drop random bytes from the sample capture and check re-locking")
+    args = parser.parse_args()
+    if args.selfcheck:
+        raise SystemExit(0 if run_selfcheck() else 1)
+    parser.print_help()
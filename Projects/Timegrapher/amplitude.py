@@ -0,0 +1,204 @@
+# amplitude.py
+import argparse
+import collections
+import math
+import time
+import numpy as np
+from beat_detector import BeatDetector, BeatWindows, ENVELOPE_SAMPLES
+from rate_estimator import read_recording
+from synthetic_watch import WatchSignal, STANDARD_BPH
+
+# --- Configuration ---
+SAMPLE_RATE = 32000
+LIFT_ANGLE = 52.0           # Degrees; from the movement's data sheet (often 50-53)
+AVERAGE_BEATS = 16          # Rolling window the reading is taken over
+
+# --- Sub-event Search ---
+# Each beat is examined from PRE_SECONDS before its onset to the longest
+# lift time possible at MIN_AMPLITUDE. The unlock is the envelope peak just
+# after the onset; the drop is the loudest peak at least MIN_SEPARATION
+# after it.
+PRE_SECONDS = 0.0005
+UNLOCK_SEARCH_SECONDS = 0.0015
+MIN_SEPARATION_SECONDS = 0.0015
+MIN_AMPLITUDE = 120.0
+MAX_AMPLITUDE = 360.0
+
+# --- Self-check Configuration ---
+SELFCHECK_SECONDS = 30
+MAX_ERROR_DEGREES = 3.0
+BLOCK_SAMPLES = 1024
+
+
+def amplitude_from_lift(lift_seconds, bph, lift_angle=LIFT_ANGLE):
+    """Balance amplitude (degrees) from the unlock-to-drop time.
+
+    The balance swings sinusoidally with a period of two beats, so it
+    sweeps the lift angle (centred on its rest point) in
+    P/pi * asin(lift / 2A) seconds; this solves that for A.
+    """
+    period = 2 * 3600.0 / bph
+    return lift_angle / (2 * np.sin(np.pi * np.asarray(lift_seconds) / period))
+
+
+def amplitude_lift_seconds(bph, amplitude, lift_angle=LIFT_ANGLE):
+    """The inverse of amplitude_from_lift: the lift time at an amplitude."""
+    period = 2 * 3600.0 / bph
+    return period / math.pi * math.asin(min(1.0, lift_angle / (2 * amplitude)))
+
+
+def _peak(envelope, rows, cols):
+    """Sub-sample position of the peaks at (rows, cols) by fitting a parabola
+    through each peak and its neighbours."""
+    cols = np.clip(cols, 1, envelope.shape[1] - 2)
+    left, mid, right = (envelope[rows, cols - 1], envelope[rows, cols], envelope[rows, cols + 1])
+    curve = left - 2 * mid + right
+    with np.errstate(divide='ignore', invalid='ignore'):
+        offset = np.where(curve < 0, 0.5 * (left - right) / curve, 0.0)
+    return cols + offset
+
+
+class AmplitudeMeter:
+    """Measures balance amplitude from the beats a BeatDetector finds.
+
+    Feed it the same blocks as the detector, with the beats the detector
+    returned for each. It keeps just enough audio to see each beat's whole
+    lift; when a call completes the window of several beats they are
+    measured together, as rows of one 2-D array, so the work per beat is
+    fixed and vectorised.
+    """
+
+    def __init__(self, bph=None, lift_angle=LIFT_ANGLE, sample_rate=SAMPLE_RATE,
+                 average_beats=AVERAGE_BEATS):
+        self.bph = bph
+        self.lift_angle = lift_angle
+        self.sample_rate = sample_rate
+        self.pre = int(PRE_SECONDS * sample_rate)
+        # Long enough for the slowest rate at the lowest amplitude.
+        self.length = self.pre + int(math.ceil(
+            amplitude_lift_seconds(min(STANDARD_BPH), MIN_AMPLITUDE, lift_angle) * sample_rate)) \
+            + 2 * ENVELOPE_SAMPLES
+        self._windows = BeatWindows(self.pre, self.length)
+
+        self.recent = collections.deque(maxlen=average_beats)
+        self.measured = 0
+        self.rejected = 0
+        self.busy_seconds = 0.0
+
+    @property
+    def amplitude(self):
+        """Median amplitude (degrees) over the last `average_beats` beats."""
+        return float(np.median(self.recent)) if self.recent else None
+
+    @property
+    def samples_seen(self):
+        return self._windows.samples_seen
+
+    def process(self, samples, beats):
+        """Consumes a block and the beats found in it. Returns (beat, lift
+        seconds, amplitude) for each beat measured by this call."""
+        start_time = time.perf_counter()
+        ready, segments = self._windows.feed(samples, beats)
+        results = self._measure(ready, segments) if ready and self.bph else []
+        self.busy_seconds += time.perf_counter() - start_time
+        return results
+
+    def _measure(self, beats, segments):
+        rows = np.arange(len(beats))
+        segments -= segments.mean(axis=1, keepdims=True)
+        segments *= segments
+        sums = np.cumsum(segments, axis=1)
+        w = ENVELOPE_SAMPLES
+        envelope = sums[:, w - 1:].copy()
+        envelope[:, 1:] -= sums[:, :-w]
+
+        # Columns are relative to each segment start; the onset is at `pre`
+        # plus its fraction of a sample.
+        onsets = np.array([b.sample for b in beats])
+        onset_cols = self.pre + onsets - np.floor(onsets)
+        unlock_end = self.pre + int(UNLOCK_SEARCH_SECONDS * self.sample_rate)
+        unlock = _peak(envelope, rows, np.argmax(envelope[:, :unlock_end], axis=1))
+
+        cols = np.arange(envelope.shape[1])
+        max_lift = amplitude_lift_seconds(self.bph, MIN_AMPLITUDE, self.lift_angle)
+        earliest = unlock + MIN_SEPARATION_SECONDS * self.sample_rate
+        latest = onset_cols + max_lift * self.sample_rate + w
+        masked = np.where((cols >= earliest[:, None]) & (cols <= latest[:, None]), envelope, -1.0)
+        drop = _peak(envelope, rows, np.argmax(masked, axis=1))
+
+        lift = (drop - unlock) / self.sample_rate
+        with np.errstate(invalid='ignore', divide='ignore'):
+            amplitude = amplitude_from_lift(lift, self.bph, self.lift_angle)
+        good = (amplitude >= MIN_AMPLITUDE) & (amplitude <= MAX_AMPLITUDE)
+        self.rejected += int((~good).sum())
+        self.measured += int(good.sum())
+        self.recent.extend(amplitude[good].tolist())
+        return [(beats[i], float(lift[i]), float(amplitude[i])) for i in np.flatnonzero(good)]
+
+    def report(self):
+        seconds = self.samples_seen / self.sample_rate
+        cost = self.busy_seconds / max(1, self.measured + self.rejected) * 1e6
+        reading = f"{self.amplitude:.0f} deg" if self.recent else "no reading"
+        return (f"amplitude {reading} (lift angle {self.lift_angle:g}, median of "
+                f"{len(self.recent)}), {self.measured} beats measured, {self.rejected} rejected, "
+                f"{cost:.0f} us/beat, "
+                f"{seconds / self.busy_seconds if self.busy_seconds else 0:.0f}x real time")
+
+
+# --- Offline analysis ---
+
+def analyze_file(filename, lift_angle=LIFT_ANGLE, bph=None):
+    """Prints the running amplitude of a WAV from process_to_wav.py or a
+    capture file."""
+    detector = meter = None
+    for sample_rate, samples in read_recording(filename):
+        if detector is None:
+            detector = BeatDetector(sample_rate, bph=bph)
+            meter = AmplitudeMeter(lift_angle=lift_angle, sample_rate=sample_rate)
+        beats = detector.process(samples)
+        meter.bph = detector.bph
+        meter.process(samples, beats)
+    print(f"Detector: {detector.report()}")
+    print(f"Result: {meter.report()}")
+    return meter
+
+
+# --- Self-check ---
+
+def run_selfcheck(seconds=SELFCHECK_SECONDS):
+    """Measures synthetic watches of known amplitude at several rates."""
+    ok = True
+    for bph, amplitude in ((18000, 220.0), (21600, 300.0), (28800, 270.0),
+                           (28800, 160.0), (36000, 250.0)):
+        watch = WatchSignal(bph=bph, amplitude=amplitude, beat_error=0.5, noise=0.03, seed=bph)
+        detector = BeatDetector(bph=bph)
+        meter = AmplitudeMeter(bph, lift_angle=watch.lift_angle)
+        count = int(seconds * watch.sample_rate)
+        amplitudes = []
+        for start in range(0, count, BLOCK_SAMPLES):
+            block = watch.render(start, min(BLOCK_SAMPLES, count - start))
+            amplitudes += [a for _, _, a in meter.process(block, detector.process(block))]
+        error = meter.amplitude - amplitude
+        passed = abs(error) < MAX_ERROR_DEGREES and meter.rejected <= 0.02 * meter.measured
+        ok &= passed
+        print(f"  {bph} bph at {amplitude:.0f} deg: per beat {np.mean(amplitudes):.1f} "
+              f"+- {np.std(amplitudes):.1f}; {meter.report()}  {'ok' if passed else 'FAIL'}")
+    print("PASS" if ok else "FAIL")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Balance amplitude from lift timing.")
+    parser.add_argument('input', nargs='?',
+                        help="WAV from process_to_wav.py, or a capture file (.tgc)")
+    parser.add_argument('--lift-angle', type=float, default=LIFT_ANGLE)
+    parser.add_argument('--bph', type=int, choices=STANDARD_BPH,
+                        help="beat rate, if not to be detected")
+    parser.add_argument('--selfcheck', action='store_true',
+                        help="measure synthetic watches of known amplitude")
+    args = parser.parse_args()
+    if args.selfcheck:
+        raise SystemExit(0 if run_selfcheck() else 1)
+    if not args.input:
+        parser.error("an input file is required")
+    analyze_file(args.input, args.lift_angle, args.bph)
@@ -0,0 +1,195 @@
+# analysis.py
+import argparse
+import queue
+import time
+import numpy as np
+from amplitude import AmplitudeMeter
+from beat_detector import BeatDetector
+from beat_trace import BeatTrace
+from history_store import HistoryStore
+from rate_estimator import RateEstimator
+from spectrogram import Spectrogram
+
+# --- Configuration ---
+SAMPLE_RATE = 32000
+BLOCK_SAMPLES = 1024          # Up to 32 ms of audio per detector call
+LIFT_ANGLE = 52               # Degrees, for the amplitude; see the movement's data sheet
+STATS_INTERVAL_SECONDS = 10   # How often the readings are printed
+
+# --- Self-check Configuration ---
+SELFCHECK_SECONDS = 10
+SELFCHECK_SOURCE = 'synth:bph=28800,rate=12,format=seq'
+SELFCHECK_RATE = 12.0         # s/day, as the source above runs
+MAX_RATE_ERROR = 2.0          # s/day
+MIN_BEATS_FRACTION = 0.8      # Of the beats in the samples analyzed
+
+
+class BeatAnalysis:
+    """The beat detector and everything fed from it: rate and beat error,
+    amplitude, the averaged tick and tock, the spectrogram and (with
+    `history_directory`) the run's history.
+
+    `process` takes a block of decoded samples and returns what the display
+    needs of it as messages, plain tuples that can cross a process boundary:
+
+    ('beats', beats, bph, reading)    beats found, for the paper strip;
+                                      reading is (rate s/day, beat error ms,
+                                      amplitude deg), each None until known
+    ('trace', average, counts)        the averaged tick and tock, when changed
+    ('spectrogram', columns)          new spectrogram columns (frames x bins)
+
+    The display applies them to its own BeatTrace and Spectrogram with
+    `BeatTrace.load` and `Spectrogram.add_columns`.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE, lift_angle=LIFT_ANGLE, history_directory=None):
+        self.sample_rate = sample_rate
+        self.detector = BeatDetector(sample_rate)
+        self.estimator = None
+        self.meter = AmplitudeMeter(lift_angle=lift_angle, sample_rate=sample_rate)
+        self.trace = BeatTrace(sample_rate)
+        self.spectrogram = Spectrogram(sample_rate)
+        self.history = HistoryStore(history_directory) if history_directory else None
+        self._origin = None  # Wall-clock time of the first sample
+        self._trace_version = self.trace.version
+
+    def process(self, samples):
+        """Consumes a block; returns the messages for the display."""
+        detector = self.detector
+        beats = detector.process(samples)
+        if detector.bph and (self.estimator is None or self.estimator.bph != detector.bph):
+            self.estimator = RateEstimator(detector.bph)
+        if self.estimator is not None:
+            self.estimator.extend(b.time for b in beats)
+        self.meter.bph = detector.bph
+        self.meter.process(samples, beats)
+        self.trace.process(samples, beats)
+        columns = self.spectrogram.process(samples)
+
+        messages = []
+        if beats:
+            window = self.estimator.window() if self.estimator is not None else None
+            reading = (window and window.rate, window and window.beat_error, self.meter.amplitude)
+            messages.append(('beats', beats, detector.bph, reading))
+            if self.history is not None:
+                if self._origin is None:
+                    self._origin = time.time() - detector.samples_seen / self.sample_rate
+                for b in beats:
+                    self.history.add(self._origin + b.time, rate=reading[0],
+                                     beat_error=reading[1], amplitude=reading[2], level=b.level)
+        if self.trace.version != self._trace_version:
+            self._trace_version = self.trace.version
+            messages.append(('trace', self.trace.average.copy(), list(self.trace.counts)))
+        if len(columns):
+            messages.append(('spectrogram', columns.copy()))
+        return messages
+
+    def report(self):
+        """The readings and their cost, one line per part."""
+        lines = [f"Beats: {self.detector.report()}"]
+        if self.estimator is not None:
+            lines.append(f"Rate: {self.estimator.report()}")
+        lines.append(f"Amplitude: {self.meter.report()}")
+        lines.append(f"Spectrogram: {self.spectrogram.report()}")
+        if self.history is not None:
+            lines.append(f"History: {self.history.report()}")
+        return "\n".join(lines)
+
+    def close(self):
+        if self.history is not None:
+            self.history.close()
+
+
+def run_analysis(ring, results, stopped, block_samples=BLOCK_SAMPLES,
+                 stats_interval=STATS_INTERVAL_SECONDS, **options):
+    """Runs a BeatAnalysis (`options`) on the samples of `ring` until
+    `stopped()`, putting its messages on the `results` queue and printing
+    its report now and then. A message the queue has no room for is dropped
+    rather than holding up the analysis; returns how many were."""
+    analysis = BeatAnalysis(**options)
+    block = np.empty(block_samples, dtype=np.int32)
+    dropped = 0
+    last_report = time.monotonic()
+    try:
+        while not stopped():
+            n = ring.read_available(block)
+            if n == 0:
+                time.sleep(block_samples / analysis.sample_rate / 2)
+                continue
+            for message in analysis.process(block[:n]):
+                try:
+                    results.put_nowait(message)
+                except queue.Full:
+                    dropped += 1
+            now = time.monotonic()
+            if now - last_report >= stats_interval:
+                last_report = now
+                print(analysis.report())
+    finally:
+        analysis.close()
+        print(analysis.report())
+        if dropped:
+            print(f"Analysis: {dropped} messages dropped (display not keeping up)")
+    return dropped
+
+
+# --- Self-check ---
+
+def run_selfcheck(seconds=SELFCHECK_SECONDS):
+    """Runs the analysis in its own pipeline process on a synthetic watch and
+    checks that beats, readings, the trace and the spectrogram all reach
+    this process, the way live_graph's display receives them."""
+    from pipeline import Pipeline
+    from sources import open_source
+    import functools
+
+    print(f"Self-check: {seconds}s of '{SELFCHECK_SOURCE}' through the analysis process...")
+    beats, readings, traces, columns = 0, [], 0, 0
+    with Pipeline(functools.partial(open_source, SELFCHECK_SOURCE), consumers=(),
+                  analysis={'stats_interval': seconds * 2}) as pipeline:
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            try:
+                kind, *data = pipeline.results.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if kind == 'beats':
+                beats += len(data[0])
+                readings.append(data[2])
+            elif kind == 'trace':
+                traces += 1
+            elif kind == 'spectrogram':
+                columns += len(data[0])
+        print(f"  {pipeline.report()}")
+        # What reached the analysis, not the wall-clock time: starting the
+        # processes takes a moment.
+        analyzed = pipeline.rings['analysis'].consumed / SAMPLE_RATE
+
+    ok = True
+    expected = 28800 / 3600 * analyzed
+    rates = [rate for rate, _, _ in readings if rate is not None]
+    amplitudes = [amplitude for _, _, amplitude in readings if amplitude is not None]
+    checks = [
+        (f"{beats} beats received (~{expected:.0f} in {analyzed:.1f}s analyzed)", beats >= MIN_BEATS_FRACTION * expected),
+        (f"rate {rates[-1] if rates else float('nan'):+.1f} s/day (source {SELFCHECK_RATE:+.1f})",
+         bool(rates) and abs(rates[-1] - SELFCHECK_RATE) < MAX_RATE_ERROR),
+        (f"amplitude {amplitudes[-1] if amplitudes else float('nan'):.0f} deg", bool(amplitudes)),
+        (f"{traces} trace updates", traces > 0),
+        (f"{columns} spectrogram columns", columns > 0),
+    ]
+    for text, good in checks:
+        print(f"  {'ok  ' if good else 'FAIL'} {text}")
+        ok &= good
+    print("PASS" if ok else "FAIL")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Beat analysis for the live display.")
+    parser.add_argument('--selfcheck', action='store_true',
+                        help="run the analysis process on a synthetic watch and check its output")
+    parser.add_argument('--seconds', type=float, default=SELFCHECK_SECONDS)
+    args = parser.parse_args()
+    if args.selfcheck:
+        raise SystemExit(0 if run_selfcheck(args.seconds) else 1)
+    parser.print_help()
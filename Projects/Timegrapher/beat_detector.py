@@ -0,0 +1,345 @@
+# beat_detector.py
+import argparse
+import collections
+import time
+import numpy as np
+from synthetic_watch import WatchSignal, STANDARD_BPH
+
+# --- Configuration ---
+SAMPLE_RATE = 32000
+BPH_TOLERANCE = 0.02  # How close a measured rate must be to snap to a standard one
+
+# --- Envelope ---
+ENVELOPE_SAMPLES = 16       # Moving average of x^2, 0.5 ms (whole cycles of a 5 kHz ring)
+DC_BLOCK_ALPHA = 0.05       # Per-block weight of the DC (offset) estimate
+
+# --- Threshold ---
+# The threshold is a few times the noise floor, and never below a small
+# fraction of the recent beat peaks: low enough to catch the quiet unlock
+# rather than the loud drop that follows it.
+NOISE_FACTOR = 4.0
+THRESHOLD_FRACTION = 0.02
+# A crossing counts only if the envelope then reaches CONFIRM_FACTOR times
+# the threshold within CONFIRM_SECONDS.
+CONFIRM_FACTOR = 2.0
+CONFIRM_SECONDS = 0.001
+NOISE_ALPHA = 0.1           # Per-block weight of the noise floor estimate
+PEAK_DECAY_SECONDS = 2.0    # Peak hold time constant
+WARMUP_SECONDS = 0.5        # Learn the levels before reporting anything
+
+# --- Beat Timing ---
+MIN_HOLDOFF_SECONDS = 0.04  # Ignores the later bursts of the same beat (< 1/2 beat at 36000 bph)
+HOLDOFF_FRACTION = 0.6      # Of the beat period, once the rate is known
+RATE_HISTORY = 16           # Onsets used to find the beat rate
+RATE_MIN_BEATS = 8
+RATE_CHANGE_BEATS = 16      # A new rate must hold this many beats before it replaces the old
+
+# --- Self-check Configuration ---
+SELFCHECK_SECONDS = 60
+MAX_JITTER_SECONDS = 20e-6  # RMS onset scatter allowed at 5% noise
+OUTLIER_SECONDS = 100e-6
+MAX_OUTLIERS = 0.01         # Fraction of beats timed on the wrong burst
+BLOCK_SAMPLES = 1024
+
+
+Beat = collections.namedtuple('Beat', 'sample time level kind')
+Beat.__doc__ = """One tick or tock.
+
+`sample` is the onset as a fractional sample index since the detector
+started, `time` the same in seconds, `level` the RMS level of its first
+burst (in sample units) and `kind` 'tick' or 'tock' (which is which is arbitrary, but
+consistent).
+"""
+
+
+def snap_bph(bph, tolerance=BPH_TOLERANCE):
+    """The standard beat rate closest to `bph`, or None if none is close."""
+    standard = min(STANDARD_BPH, key=lambda s: abs(s - bph))
+    return standard if abs(standard - bph) <= tolerance * standard else None
+
+
+class BeatDetector:
+    """Finds tick and tock onsets in a stream of int32 sample blocks.
+
+    Each block is handled with a few vectorised passes: DC removal,
+    squaring and a moving-average energy envelope (a cumulative sum, with
+    the last few samples carried over so blocks join seamlessly). An onset
+    is where the envelope rises through an adaptive threshold, interpolated
+    linearly between the two samples around the crossing. The beat rate is found from the onset intervals
+    and snapped to the nearest standard rate.
+
+    Blocks can be any size; filter state is carried across them, and only
+    the slow level estimates are updated per block.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE, bph=None, envelope_samples=ENVELOPE_SAMPLES):
+        self.sample_rate = sample_rate
+        self.bph = bph
+        self.fixed_bph = bph is not None
+        self.envelope_samples = envelope_samples
+
+        # --- Carried filter state ---
+        self._tail = np.zeros(envelope_samples - 1)  # Last squared samples
+        self.confirm_samples = int(CONFIRM_SECONDS * sample_rate)
+        # Envelope not yet searched for onsets (plus the sample before it).
+        self._held = np.zeros(self.confirm_samples + 1)
+        self._dc = None
+        self._noise = None
+        self._peak = 0.0
+        self._holdoff_until = -np.inf
+        self.samples_seen = 0
+
+        # --- Beats ---
+        self.beats = 0
+        self._onsets = collections.deque(maxlen=RATE_HISTORY)
+        self._first_onset = None
+        self._new_bph, self._new_bph_beats = None, 0
+
+        # --- Statistics ---
+        self.blocks = 0
+        self.busy_seconds = 0.0
+        self.max_block_seconds = 0.0
+
+    @property
+    def beat_period(self):
+        """Nominal seconds between beats, or None until the rate is known."""
+        return 3600.0 / self.bph if self.bph else None
+
+    @property
+    def threshold(self):
+        noise = self._noise or 0.0
+        return max(NOISE_FACTOR * noise, noise + THRESHOLD_FRACTION * (self._peak - noise))
+
+    def _envelope(self, samples):
+        x = samples.astype(np.float64)
+        block_mean = x.mean()
+        self._dc = block_mean if self._dc is None else self._dc + DC_BLOCK_ALPHA * (block_mean - self._dc)
+        x -= self._dc
+        x *= x
+
+        energy = np.concatenate((self._tail, x))
+        self._tail = energy[len(energy) - len(self._tail):].copy()
+        sums = np.cumsum(energy)
+        w = self.envelope_samples
+        envelope = sums[w - 1:].copy()
+        envelope[1:] -= sums[:-w]
+        envelope /= w
+        return envelope
+
+    def _update_levels(self, envelope):
+        n = len(envelope)
+        # Median of every 4th sample: plenty for a level, and far cheaper.
+        sparse = envelope[::4]
+        noise = float(np.partition(sparse, len(sparse) // 2)[len(sparse) // 2])
+        self._noise = noise if self._noise is None else self._noise + NOISE_ALPHA * (noise - self._noise)
+        decay = np.exp(-n / (PEAK_DECAY_SECONDS * self.sample_rate))
+        self._peak = max(self._peak * decay, float(envelope.max()))
+
+    def process(self, samples):
+        """Consumes one block of int32 samples; returns the Beats found in it.
+
+        A crossing is only reported once the envelope after it is known,
+        so beats come out up to CONFIRM_SECONDS late, possibly in the next
+        block.
+        """
+        start_time = time.perf_counter()
+        n = len(samples)
+        if n == 0:
+            return []
+        envelope = np.concatenate((self._held, self._envelope(samples)))
+        first = self.samples_seen - (len(self._held) - 1)  # Sample index of envelope[1]
+        threshold = self.threshold
+        confirm = self.confirm_samples
+
+        found = []
+        if self.samples_seen >= WARMUP_SECONDS * self.sample_rate:
+            end = len(envelope) - confirm
+            before, after = envelope[:end - 1], envelope[1:end]
+            for i in np.flatnonzero((before <= threshold) & (after > threshold)):
+                if first + i < self._holdoff_until:
+                    continue
+                # A click rises well clear of the threshold; noise barely crosses it.
+                peak = float(envelope[i + 1:i + 1 + confirm].max())
+                if peak < CONFIRM_FACTOR * threshold:
+                    continue
+                fraction = (threshold - before[i]) / (after[i] - before[i])
+                found.append(self._new_beat(float(first + i - 1 + fraction), peak))
+
+        self._update_levels(envelope[len(self._held):])
+        self._held = envelope[len(envelope) - confirm - 1:].copy()
+        self.samples_seen += n
+
+        elapsed = time.perf_counter() - start_time
+        self.blocks += 1
+        self.busy_seconds += elapsed
+        self.max_block_seconds = max(self.max_block_seconds, elapsed)
+        return found
+
+    def _new_beat(self, onset, peak):
+        holdoff = MIN_HOLDOFF_SECONDS
+        if self.beat_period:
+            holdoff = max(holdoff, HOLDOFF_FRACTION * self.beat_period)
+        self._holdoff_until = onset + holdoff * self.sample_rate
+
+        beat = Beat(onset, onset / self.sample_rate, float(np.sqrt(peak)), self._kind(onset))
+        self.beats += 1
+        self._onsets.append(onset)
+        if not self.fixed_bph and len(self._onsets) >= RATE_MIN_BEATS:
+            self._update_rate()
+        return beat
+
+    def _kind(self, onset):
+        # Once the rate is known, parity comes from the time since the first
+        # beat, so a missed beat does not swap ticks and tocks.
+        if self._first_onset is None:
+            self._first_onset = onset
+            self._count_parity = 0
+            return 'tick'
+        if self.beat_period:
+            k = round((onset - self._first_onset) / (self.beat_period * self.sample_rate))
+        else:
+            self._count_parity += 1
+            k = self._count_parity
+        return 'tick' if k % 2 == 0 else 'tock'
+
+    def _update_rate(self):
+        intervals = np.diff(np.asarray(self._onsets)) / self.sample_rate
+        # Tick-tock and tock-tick differ by the beat error; pairs do not.
+        pairs = intervals[:-1] + intervals[1:]
+        bph = snap_bph(7200.0 / float(np.median(pairs)))
+        if not bph or bph == self.bph:
+            self._new_bph_beats = 0
+            return
+        if self.bph:
+            # A few mistimed beats in a noisy recording can pull the median
+            # over; only a rate that persists is a real change.
+            if bph != self._new_bph:
+                self._new_bph, self._new_bph_beats = bph, 0
+            self._new_bph_beats += 1
+            if self._new_bph_beats < RATE_CHANGE_BEATS:
+                return
+            print(f"Beat detector: rate changed from {self.bph} to {bph} bph")
+        self.bph = bph
+        self._new_bph_beats = 0
+        self._first_onset = self._onsets[-1]  # Restart tick/tock parity
+
+    def stats(self):
+        seconds = self.samples_seen / self.sample_rate
+        return {
+            'bph': self.bph,
+            'beats': self.beats,
+            'blocks': self.blocks,
+            'us_per_block': self.busy_seconds / max(self.blocks, 1) * 1e6,
+            'max_us_per_block': self.max_block_seconds * 1e6,
+            'realtime_factor': seconds / self.busy_seconds if self.busy_seconds else 0.0,
+        }
+
+    def report(self):
+        s = self.stats()
+        rate = f"{s['bph']} bph" if s['bph'] else "rate unknown"
+        return (f"{rate}, {s['beats']} beats, {s['us_per_block']:.0f} us/block "
+                f"(max {s['max_us_per_block']:.0f}), {s['realtime_factor']:.0f}x real time")
+
+
+class BeatWindows:
+    """Cuts a fixed window of samples around each beat out of a stream.
+
+    `feed` takes each block with the beats found in it and returns the
+    beats whose window is now complete, with their windows as rows of one
+    array: `pre` samples before the onset, `length` in all. With
+    `interpolate` the rows are shifted by the onset's fraction of a sample
+    (linearly), so they line up exactly; otherwise row i starts at
+    int(onset) - pre. Only the audio pending beats still need is kept.
+    """
+
+    def __init__(self, pre, length, interpolate=False):
+        self.pre = pre
+        self.length = length
+        self.interpolate = interpolate
+        self._buffer = np.zeros(0)
+        self._buffer_start = 0  # Sample index of _buffer[0]
+        self._pending = []
+        self.samples_seen = 0
+
+    def feed(self, samples, beats):
+        self._buffer = np.concatenate((self._buffer, samples.astype(np.float64)))
+        self.samples_seen += len(samples)
+        self._pending.extend(beats)
+        # One more sample than the window, for interpolation.
+        end = self.samples_seen - 1
+        ready = [b for b in self._pending
+                 if int(b.sample) - self.pre + self.length <= end
+                 and int(b.sample) - self.pre >= self._buffer_start]
+        self._pending = [b for b in self._pending
+                         if int(b.sample) - self.pre + self.length > end]
+
+        rows = np.zeros((len(ready), self.length))
+        if ready:
+            onsets = np.array([b.sample for b in ready])
+            starts = np.floor(onsets).astype(np.int64) - self.pre - self._buffer_start
+            index = starts[:, None] + np.arange(self.length)
+            rows = self._buffer[index]
+            if self.interpolate:
+                fraction = (onsets - np.floor(onsets))[:, None]
+                rows += fraction * (self._buffer[index + 1] - rows)
+
+        # Keep what the pending beats (and onsets reported late) still need.
+        keep_from = self.samples_seen - self.length - self.pre
+        if self._pending:
+            keep_from = min(keep_from, int(self._pending[0].sample) - self.pre)
+        drop = keep_from - self._buffer_start
+        if drop > 0:
+            self._buffer = self._buffer[drop:]
+            self._buffer_start += drop
+        return ready, rows
+
+
+# --- Self-check ---
+
+def run_selfcheck(seconds=SELFCHECK_SECONDS, block=BLOCK_SAMPLES):
+    """Runs the detector on synthetic watches with known rate and beat error.
+
+    Checks the detected rate, that no beat is missed or doubled, and how
+    far the onsets scatter around the true beat times.
+    """
+    ok = True
+    for bph in STANDARD_BPH:
+        watch = WatchSignal(bph=bph, rate_error=5.0, beat_error=0.4, noise=0.05, seed=bph)
+        detector = BeatDetector()
+        beats = []
+        count = int(seconds * SAMPLE_RATE)
+        for start in range(0, count, block):
+            beats += detector.process(watch.render(start, min(block, count - start)))
+
+        times = np.array([b.time for b in beats])
+        k = np.round((times - times[0]) / watch.beat_period).astype(int)
+        truth = watch.beat_time(k + int(round(times[0] / watch.beat_period)))
+        residual = times - truth
+        # The onset sits a fixed distance after the unlock; take that out per parity.
+        for parity in (0, 1):
+            residual[k % 2 == parity] -= np.median(residual[k % 2 == parity])
+        # Now and then noise hides the unlock and a later burst is timed instead.
+        outliers = np.abs(residual) > OUTLIER_SECONDS
+        jitter = residual[~outliers].std()
+        expected = int((seconds - WARMUP_SECONDS) / watch.beat_period)
+        missed = expected - len(beats)
+        doubled = len(k) - len(np.unique(k))
+        passed = detector.bph == bph and abs(missed) <= 2 and doubled == 0 \
+            and jitter < MAX_JITTER_SECONDS and outliers.mean() < MAX_OUTLIERS
+        ok &= passed
+        print(f"  {bph} bph: detected {detector.bph}, {len(beats)} beats ({missed:+d} vs expected), "
+              f"onset jitter {jitter * 1e6:.1f} us rms, {outliers.sum()} outliers; "
+              f"{detector.report()}  {'ok' if passed else 'FAIL'}")
+    print("PASS" if ok else "FAIL")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tick/tock onset detector.")
+    parser.add_argument('--selfcheck', action='store_true',
+                        help="check rate detection and onset timing on synthetic watches")
+    parser.add_argument('--seconds', type=float, default=SELFCHECK_SECONDS)
+    args = parser.parse_args()
+    if args.selfcheck:
+        raise SystemExit(0 if run_selfcheck(args.seconds) else 1)
+    parser.print_help()
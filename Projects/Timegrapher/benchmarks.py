@@ -0,0 +1,279 @@
+# benchmarks.py
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import time
+import numpy as np
+from alignment import Aligner, find_offset
+from beat_detector import BeatDetector
+from dsp import DSPChain, Gain
+from framing import FrameSync, build_benchmark_stream, capture_payloads, decode_samples, PAYLOAD_SIZE
+from jitter_buffer import JitterBuffer
+from sample_ring import SampleRing
+from synthetic_watch import WatchSignal
+
+# --- Configuration ---
+HERE = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_FILENAME = os.path.join(HERE, 'raw_audio_misaligned.bin')  # SOF-framed capture
+BASELINE_FILENAME = os.path.join(HERE, 'benchmark_baseline.json')
+RUNS = 5                    # Each case is run this often; the best run counts
+THROUGHPUT_TOLERANCE = 0.25 # A case fails if its throughput drops by more than this
+LATENCY_TOLERANCE = 0.5     # ...or its p99 call time grows by more than this
+LATENCY_FLOOR_US = 20.0     # p99 differences smaller than this never fail
+
+# --- Case Sizes ---
+SERIAL_READ_BYTES = 4096    # What a serial read returns at 2 Mbaud and ~2 ms per poll
+DECODE_FRAMES = 32          # Payloads per decode call
+ALIGN_CHUNK_BYTES = 65536
+ALIGN_SLIPS = 50
+CALLBACK_FRAMES = (256, 512, 1024)  # sounddevice block sizes
+CALLBACK_SECONDS = 20
+DSP_BLOCK = 512
+DETECTOR_BLOCK = 1024
+DETECTOR_SECONDS = 30
+AMPLIFICATION_FACTOR = 5
+
+
+def _percentiles(seconds):
+    us = np.asarray(seconds) * 1e6
+    return {f'p{q}_us': float(np.percentile(us, q)) for q in (50, 90, 99)} | \
+        {'max_us': float(us.max()), 'calls': len(us)}
+
+
+def _timed(calls):
+    """Runs each (callable, units) in turn; returns the per-call seconds
+    and units processed."""
+    durations = np.empty(len(calls))
+    units = 0
+    for i, (call, n) in enumerate(calls):
+        start = time.perf_counter()
+        call()
+        durations[i] = time.perf_counter() - start
+        units += n
+    return durations, units
+
+
+# --- Fixtures ---
+
+def load_fixture(filename=FIXTURE_FILENAME):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+
+def misaligned_stream(raw, slips=ALIGN_SLIPS, seed=0):
+    """The capture's samples as an unframed stream, starting off by 3 bytes
+    and with single bytes dropped at random places."""
+    rng = np.random.default_rng(seed)
+    clean = decode_samples(capture_payloads(raw)).astype('<i4').tobytes()
+    cuts = np.sort(rng.choice(np.arange(4, len(clean) - 4), size=slips, replace=False))
+    parts, last = [b'\x12\x34\x56'], 0
+    for cut in cuts:
+        parts.append(clean[last:cut])
+        last = cut + 1
+    parts.append(clean[last:])
+    return b''.join(parts)
+
+
+# --- Cases ---
+# Each returns (per-call seconds, units processed, unit name).
+
+def case_frame_sync(raw):
+    stream, _ = build_benchmark_stream(raw)
+    port = io.BytesIO(stream)
+    sync = FrameSync()
+    reads = [(lambda: sync.read_from(port, SERIAL_READ_BYTES), SERIAL_READ_BYTES)
+             for _ in range(len(stream) // SERIAL_READ_BYTES)]
+    durations, units = _timed(reads)
+    return durations, units, 'B'
+
+
+def case_decode_24bit(raw):
+    payloads = capture_payloads(raw)
+    blocks = [payloads[i:i + DECODE_FRAMES] for i in range(0, len(payloads) - DECODE_FRAMES,
+                                                            DECODE_FRAMES)]
+    samples = DECODE_FRAMES * PAYLOAD_SIZE // 4
+    durations, units = _timed([(lambda b=b: decode_samples(b), samples) for b in blocks] * 4)
+    return durations, units, 'samples'
+
+
+def case_alignment(raw):
+    stream = misaligned_stream(raw)
+    aligner = Aligner(verbose=False)
+    chunks = [stream[i:i + ALIGN_CHUNK_BYTES] for i in range(0, len(stream), ALIGN_CHUNK_BYTES)]
+    durations, units = _timed([(lambda c=c: aligner.feed(c), len(c)) for c in chunks])
+    return durations, units, 'B'
+
+
+def case_find_offset(raw):
+    stream = misaligned_stream(raw, slips=0)
+    windows = [stream[i:i + 4096 * 4] for i in range(0, len(stream) - 4096 * 4, 4096 * 4)]
+    durations, units = _timed([(lambda w=w: find_offset(w), len(w)) for w in windows])
+    return durations, units, 'B'
+
+
+def make_callback_case(frames):
+    def case(raw):
+        """live_graph's audio callback: jitter buffer and the volume chain,
+        with the ring kept topped up as the processor thread would."""
+        samples = decode_samples(capture_payloads(raw))
+        ring = SampleRing(65536)
+        playback = JitterBuffer(ring)
+        volume = DSPChain([Gain(AMPLIFICATION_FACTOR)])
+        outdata = np.zeros((frames, 1), dtype=np.int32)
+        position = [0]
+
+        def callback():
+            playback.fill(outdata[:, 0])
+            outdata[:, 0] = volume.process(outdata[:, 0])
+
+        count = int(CALLBACK_SECONDS * 32000 / frames)
+        durations = np.empty(count)
+        for i in range(count):
+            # Producer side, outside the timing: keep ~40 ms queued.
+            while ring.occupancy() < 1280 + frames:
+                start = position[0] % (len(samples) - 512)
+                ring.write(samples[start:start + 512])
+                position[0] += 512
+            t = time.perf_counter()
+            callback()
+            durations[i] = time.perf_counter() - t
+        return durations, count * frames, 'samples'
+    case.__name__ = f'case_callback_{frames}'
+    return case
+
+
+def case_dsp_chain(raw):
+    samples = decode_samples(capture_payloads(raw))
+    chain = DSPChain('dc,highpass=200,bandpass=1000-10000,gate,gain=2')
+    blocks = [samples[i:i + DSP_BLOCK] for i in range(0, len(samples) - DSP_BLOCK, DSP_BLOCK)]
+    durations, units = _timed([(lambda b=b: chain.process(b), DSP_BLOCK) for b in blocks])
+    return durations, units, 'samples'
+
+
+def case_beat_detector(raw):
+    watch = WatchSignal(bph=28800, noise=0.05)
+    audio = watch.render(0, DETECTOR_SECONDS * 32000)
+    detector = BeatDetector(bph=28800)
+    blocks = [audio[i:i + DETECTOR_BLOCK] for i in range(0, len(audio), DETECTOR_BLOCK)]
+    durations, units = _timed([(lambda b=b: detector.process(b), len(b)) for b in blocks])
+    return durations, units, 'samples'
+
+
+CASES = {
+    'frame_sync': case_frame_sync,
+    'decode_24bit': case_decode_24bit,
+    'alignment': case_alignment,
+    'find_offset': case_find_offset,
+    **{f'callback_{frames}': make_callback_case(frames) for frames in CALLBACK_FRAMES},
+    'dsp_chain': case_dsp_chain,
+    'beat_detector': case_beat_detector,
+}
+
+
+# --- Running and comparing ---
+
+def run_case(name, raw, runs=RUNS):
+    """Best of `runs`: the whole result of the run with the highest throughput."""
+    best = None
+    for _ in range(runs):
+        durations, units, unit = CASES[name](raw)
+        # Throughput from the total time: a case's slow calls (a resync, a
+        # slip recovered) are part of what it costs.
+        result = {'unit': f'{unit}/s', 'throughput': units / durations.sum()} | _percentiles(durations)
+        if best is None or result['throughput'] > best['throughput']:
+            best = result
+    return best
+
+
+def environment():
+    return {'python': platform.python_version(), 'numpy': np.__version__,
+            'machine': platform.machine(), 'processor': platform.processor() or platform.node(),
+            'system': platform.system()}
+
+
+def compare(result, baseline, throughput_tolerance, latency_tolerance):
+    """Returns a list of what regressed, empty if nothing did."""
+    problems = []
+    if result['throughput'] < baseline['throughput'] * (1 - throughput_tolerance):
+        problems.append(f"throughput {result['throughput'] / baseline['throughput'] - 1:+.0%}")
+    allowed = max(baseline['p99_us'] * (1 + latency_tolerance),
+                  baseline['p99_us'] + LATENCY_FLOOR_US)
+    if result['p99_us'] > allowed:
+        problems.append(f"p99 {result['p99_us']:.0f} us vs {baseline['p99_us']:.0f} us")
+    return problems
+
+
+def _format_rate(value, unit):
+    for scale, prefix in ((1e9, 'G'), (1e6, 'M'), (1e3, 'k')):
+        if value >= scale:
+            return f"{value / scale:.1f} {prefix}{unit}"
+    return f"{value:.0f} {unit}"
+
+
+def run_suite(names, baseline_file=BASELINE_FILENAME, save=False,
+              throughput_tolerance=THROUGHPUT_TOLERANCE, latency_tolerance=LATENCY_TOLERANCE):
+    raw = load_fixture()
+    baseline = None
+    if not save and os.path.exists(baseline_file):
+        with open(baseline_file) as f:
+            baseline = json.load(f)
+        if baseline.get('environment') != environment():
+            print(f"Note: baseline recorded on {baseline.get('environment')}; comparisons "
+                  "across machines are only a rough guide.")
+    results = {}
+    failed = []
+    for name in names:
+        result = results[name] = run_case(name, raw)
+        line = (f"  {name:16s} {_format_rate(result['throughput'], result['unit']):>16s}  "
+                f"p50 {result['p50_us']:7.1f} us  p99 {result['p99_us']:7.1f} us  "
+                f"max {result['max_us']:8.1f} us")
+        if baseline and name in baseline['cases']:
+            problems = compare(result, baseline['cases'][name],
+                               throughput_tolerance, latency_tolerance)
+            ratio = result['throughput'] / baseline['cases'][name]['throughput']
+            line += f"  {ratio:5.2f}x baseline"
+            if problems:
+                failed.append(name)
+                line += "  REGRESSED: " + ", ".join(problems)
+        print(line)
+
+    if save:
+        existing = {}
+        if os.path.exists(baseline_file):
+            with open(baseline_file) as f:
+                existing = json.load(f).get('cases', {})
+        existing.update(results)
+        with open(baseline_file, 'w') as f:
+            json.dump({'environment': environment(), 'recorded': time.strftime('%Y-%m-%d'),
+                       'cases': existing}, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Baseline saved to '{baseline_file}'.")
+    elif baseline is None:
+        print(f"No baseline at '{baseline_file}'; run with --save to record one.")
+    if failed:
+        print(f"FAIL: {', '.join(failed)} regressed beyond tolerance "
+              f"(throughput -{throughput_tolerance:.0%}, p99 +{latency_tolerance:.0%}).")
+    return not failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Timegrapher pipeline benchmarks, compared against a JSON baseline.")
+    parser.add_argument('cases', nargs='*', metavar='CASE', help=f"cases to run (default all): {', '.join(CASES)}")
+    parser.add_argument('--save', action='store_true',
+                        help="record the results as the new baseline")
+    parser.add_argument('--baseline', default=BASELINE_FILENAME, help="baseline JSON file")
+    parser.add_argument('--tolerance', type=float, default=THROUGHPUT_TOLERANCE,
+                        help="allowed fractional drop in throughput")
+    parser.add_argument('--latency-tolerance', type=float, default=LATENCY_TOLERANCE,
+                        help="allowed fractional growth of the p99 call time")
+    args = parser.parse_args()
+    unknown = [name for name in args.cases if name not in CASES]
+    if unknown:
+        parser.error(f"unknown case(s): {', '.join(unknown)}")
+    ok = run_suite(args.cases or list(CASES), args.baseline, args.save,
+                   args.tolerance, args.latency_tolerance)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,362 @@
+# broker.py
+import argparse
+import collections
+import multiprocessing as mp
+import os
+import socket
+import threading
+import time
+import numpy as np
+from framing import FrameDecoder, decode_samples, PROTOCOL_AUTO, PROTOCOL_RAW
+from sample_ring import HistoryRing
+from sources import (open_source, parse_address, BROKER_ADDRESS, POLICY_BLOCK,
+                     POLICY_DROP_OLDEST)
+
+# --- Configuration ---
+SERIAL_PORT = '/dev/ttyUSB0'
+BAUD_RATE = 2000000
+SAMPLE_RATE = 32000
+INPUT_FORMAT = 'framed'  # 'framed' (SOF frames, see framing.py) or 'raw' (bare 4-byte samples)
+
+# --- Broker Configuration ---
+HISTORY_SECONDS = 10            # How far back a late joiner can ask to start
+SUBSCRIBER_QUEUE_SECONDS = 2    # Per-subscriber buffer before its policy kicks in
+BLOCKING_QUEUE_SECONDS = 30     # Larger buffer for subscribers that must not lose data
+STATS_INTERVAL_SECONDS = 10
+
+# --- Benchmark Configuration ---
+BENCH_SECONDS = 3
+BENCH_SUBSCRIBERS = (1, 2, 4, 8)
+
+
+class Subscriber:
+    """One connected client with its own queue, sender thread and policy.
+
+    'drop-oldest' throws away the oldest queued blocks when the client falls
+    behind (right for a plot). 'block' makes the broker wait instead (right
+    for a recorder); the serial port then buffers until the client catches up.
+    """
+
+    def __init__(self, sock, policy, max_bytes, name):
+        self.sock = sock
+        self.policy = policy
+        self.max_bytes = max_bytes
+        self.name = name
+        self.alive = True
+        self._queue = collections.deque()
+        self._queued_bytes = 0
+        self._cond = threading.Condition()
+
+        # --- Statistics ---
+        self.sent_bytes = 0
+        self.dropped_bytes = 0
+        self.blocked_seconds = 0.0
+
+        self._thread = threading.Thread(target=self._run, name=f"subscriber-{name}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def offer(self, block):
+        """Queues one block of sample bytes. Shared, never copied."""
+        with self._cond:
+            if self.policy == POLICY_BLOCK:
+                if self._queued_bytes + len(block) > self.max_bytes:
+                    start = time.perf_counter()
+                    while self.alive and self._queued_bytes + len(block) > self.max_bytes:
+                        self._cond.wait(0.1)
+                    self.blocked_seconds += time.perf_counter() - start
+            else:
+                while self._queue and self._queued_bytes + len(block) > self.max_bytes:
+                    self._queued_bytes -= len(self._queue[0])
+                    self.dropped_bytes += len(self._queue.popleft())
+            if not self.alive:
+                return
+            self._queue.append(block)
+            self._queued_bytes += len(block)
+            self._cond.notify_all()
+
+    def _run(self):
+        try:
+            while self.alive:
+                with self._cond:
+                    while self.alive and not self._queue:
+                        self._cond.wait(0.5)
+                    if not self.alive:
+                        break
+                    block = self._queue.popleft()
+                    self._queued_bytes -= len(block)
+                    self._cond.notify_all()
+                self.sock.sendall(block)
+                self.sent_bytes += len(block)
+        except OSError:
+            pass
+        self.close()
+
+    def close(self):
+        with self._cond:
+            self.alive = False
+            self._cond.notify_all()
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    def report(self):
+        return (f"{self.name} [{self.policy}] sent {self.sent_bytes / 1e6:.1f} MB, "
+                f"dropped {self.dropped_bytes / 1e6:.1f} MB, blocked {self.blocked_seconds:.1f}s")
+
+
+class Broker:
+    """Owns the serial port, decodes once and fans the samples out.
+
+    Subscribers connect to a Unix socket (or localhost TCP port), send one
+    line `SUBSCRIBE <policy> <backlog_seconds>`, get one line back
+    describing the stream, and then receive little-endian int32 samples.
+    A late joiner first gets up to `backlog_seconds` from the history, then
+    the live stream, without gap or overlap.
+    """
+
+    def __init__(self, open_port, input_format=INPUT_FORMAT, address=BROKER_ADDRESS,
+                 sample_rate=SAMPLE_RATE, history_seconds=HISTORY_SECONDS):
+        self.open_port = open_port
+        self.input_format = input_format
+        self.address = address
+        self.sample_rate = sample_rate
+        self.history = HistoryRing(int(history_seconds * sample_rate), dtype='<i4')
+        self.subscribers = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._server = None
+        self._next_id = 1
+
+        # --- Statistics ---
+        self.published_samples = 0
+        self.publish_seconds = 0.0
+
+    # --- Subscribers ---
+
+    def _listen(self):
+        family, addr = parse_address(self.address)
+        if family == socket.AF_UNIX and os.path.exists(addr):
+            os.unlink(addr)
+        self._server = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(addr)
+        self._server.listen()
+        self._server.settimeout(0.5)
+
+    def _accept_loop(self):
+        while not self._stop.is_set():
+            try:
+                sock, _ = self._server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            threading.Thread(target=self._handshake, args=(sock,), daemon=True).start()
+
+    def _handshake(self, sock):
+        try:
+            sock.settimeout(5)
+            request = bytearray()
+            while not request.endswith(b'\n') and len(request) < 256:
+                byte = sock.recv(1)
+                if not byte:
+                    raise ConnectionError("closed during handshake")
+                request += byte
+            words = request.decode().split()
+            policy = words[1] if len(words) > 1 else POLICY_DROP_OLDEST
+            backlog_seconds = float(words[2]) if len(words) > 2 else 0.0
+            if words[0] != 'SUBSCRIBE' or policy not in (POLICY_DROP_OLDEST, POLICY_BLOCK):
+                raise ValueError(f"bad request {request!r}")
+            sock.sendall(f"OK rate={self.sample_rate} format=<i4\n".encode())
+            sock.settimeout(None)
+        except (OSError, ValueError, IndexError) as e:
+            print(f"Broker: rejected a subscriber ({e})")
+            sock.close()
+            return
+
+        seconds = BLOCKING_QUEUE_SECONDS if policy == POLICY_BLOCK else SUBSCRIBER_QUEUE_SECONDS
+        max_bytes = int(seconds * self.sample_rate * 4)
+        with self._lock:
+            subscriber = Subscriber(sock, policy, max_bytes, f"#{self._next_id}")
+            self._next_id += 1
+            # Taken under the publish lock, so the backlog ends exactly where
+            # the live stream for this subscriber begins.
+            backlog = self.history.latest(int(backlog_seconds * self.sample_rate))
+            if len(backlog):
+                subscriber.offer(backlog.tobytes())
+            self.subscribers.append(subscriber)
+        subscriber.start()
+        print(f"Broker: subscriber {subscriber.name} joined ({policy}, "
+              f"{len(backlog) / self.sample_rate:.1f}s backlog).")
+
+    # --- Publishing ---
+
+    def publish(self, samples):
+        """Sends one block of decoded samples to every subscriber."""
+        start = time.perf_counter()
+        block = samples.astype('<i4', copy=False).tobytes()  # One copy, shared by all
+        with self._lock:
+            self.history.extend(samples)
+            subscribers = [s for s in self.subscribers if s.alive]
+            self.subscribers = subscribers
+        for subscriber in subscribers:
+            subscriber.offer(block)
+        self.published_samples += len(samples)
+        self.publish_seconds += time.perf_counter() - start
+
+    def _ingest(self, port):
+        """Reads the port and publishes decoded samples until stopped."""
+        decoder = FrameDecoder(PROTOCOL_AUTO if self.input_format == 'framed' else PROTOCOL_RAW)
+        while not self._stop.is_set():
+            payloads = decoder.read_from(port, max(port.in_waiting, decoder.frame_size))
+            if len(payloads):
+                self.publish(decode_samples(payloads))
+        print(f"Broker: {decoder.report()}")
+
+    def serve_forever(self, stats_interval=STATS_INTERVAL_SECONDS):
+        self._listen()
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        if stats_interval:
+            threading.Thread(target=self._report_loop, args=(stats_interval,), daemon=True).start()
+        print(f"Broker listening on {self.address}.")
+        try:
+            with self.open_port() as port:
+                if hasattr(port, 'reset_input_buffer'):
+                    port.reset_input_buffer()
+                self._ingest(port)
+        finally:
+            self.stop()
+
+    def stop(self):
+        self._stop.set()
+        if self._server is not None:
+            self._server.close()
+            family, addr = parse_address(self.address)
+            if family == socket.AF_UNIX and os.path.exists(addr):
+                os.unlink(addr)
+            self._server = None
+        with self._lock:
+            for subscriber in self.subscribers:
+                subscriber.close()
+
+    def _report_loop(self, interval):
+        while not self._stop.wait(interval):
+            print(f"Broker: {self.report()}")
+
+    def report(self):
+        lines = [f"{self.published_samples} samples published, "
+                 f"{len(self.subscribers)} subscribers"]
+        lines += [f"  {s.report()}" for s in self.subscribers]
+        return "\n".join(lines)
+
+
+# --- Fan-out Benchmark ---
+
+class _BenchPort:
+    """Endless stream of bare 4-byte samples, as fast as it is read."""
+
+    def __init__(self):
+        self._block = (np.arange(4096, dtype='<i4') & 0x7FFFFF).tobytes()
+        self.in_waiting = len(self._block)
+
+    def readinto(self, buf):
+        n = min(len(buf), len(self._block))
+        buf[:n] = self._block[:n]
+        return n
+
+    def reset_input_buffer(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+def _bench_reader(address, result_queue):
+    from sources import BrokerSource
+    source = BrokerSource(address, POLICY_BLOCK)
+    buf = bytearray(1 << 16)
+    total = 0
+    while True:
+        n = source.readinto(buf)
+        if n == 0:
+            break
+        total += n
+    result_queue.put(total)
+
+
+def run_benchmark(subscriber_counts=BENCH_SUBSCRIBERS, seconds=BENCH_SECONDS):
+    """Measures broker CPU time per published MB with 1..N subscribers.
+
+    Subscribers run in separate processes so the broker's own CPU time
+    (`time.process_time` of this process) only covers the fan-out.
+    """
+    results = []
+    for count in subscriber_counts:
+        address = f"/tmp/timegrapher-bench-{os.getpid()}.sock"
+        broker = Broker(_BenchPort, input_format='raw', address=address)
+        result_queue = mp.Queue()
+        server = threading.Thread(target=broker.serve_forever, kwargs={'stats_interval': 0},
+                                  daemon=True)
+        server.start()
+        while not os.path.exists(address):
+            time.sleep(0.01)
+        readers = [mp.Process(target=_bench_reader, args=(address, result_queue))
+                   for _ in range(count)]
+        for reader in readers:
+            reader.start()
+        while len(broker.subscribers) < count:
+            time.sleep(0.01)
+
+        cpu_start, wall_start = time.process_time(), time.perf_counter()
+        published_start = broker.published_samples
+        time.sleep(seconds)
+        cpu, wall = time.process_time() - cpu_start, time.perf_counter() - wall_start
+        published_mb = (broker.published_samples - published_start) * 4 / 1e6
+        broker.stop()
+        server.join(timeout=5)
+        delivered = sum(result_queue.get(timeout=5) for _ in readers)
+        for reader in readers:
+            reader.join(timeout=5)
+
+        cpu_per_mb = cpu / published_mb * 1000 if published_mb else float('inf')
+        results.append((count, published_mb / wall, cpu_per_mb))
+        print(f"  {count} subscribers: {published_mb / wall:.1f} MB/s published, "
+              f"{delivered / 1e6 / wall:.1f} MB/s delivered, {cpu_per_mb:.2f} ms CPU per MB")
+
+    if len(results) > 1:
+        counts = np.array([r[0] for r in results], dtype=float)
+        cost = np.array([r[2] for r in results])
+        slope = np.polyfit(counts, cost, 1)[0]
+        # One second of 32 kHz audio is 0.128 MB.
+        print(f"Each extra subscriber costs ~{slope:.2f} ms CPU per MB "
+              f"(~{slope * 0.128 / 10:.3f}% of a core at 32 kHz).")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Share one Timegrapher serial port between many clients.")
+    parser.add_argument('--source', default=f'serial:{SERIAL_PORT}',
+                        help="where the broker reads from (see sources.open_source)")
+    parser.add_argument('--input', choices=('framed', 'raw'), default=INPUT_FORMAT,
+                        help="'framed' for SOF frames, 'raw' for bare 4-byte samples")
+    parser.add_argument('--address', default=BROKER_ADDRESS,
+                        help="Unix socket path or host:port to listen on")
+    parser.add_argument('--bench', action='store_true', help="measure fan-out cost and exit")
+    args = parser.parse_args()
+
+    if args.bench:
+        print("Fan-out benchmark:")
+        run_benchmark()
+    else:
+        broker = Broker(lambda: open_source(args.source, baud_rate=BAUD_RATE), args.input, args.address)
+        try:
+            broker.serve_forever()
+        except KeyboardInterrupt:
+            print(f"\nBroker stopped.\n{broker.report()}")
@@ -1,42 +1,431 @@
-
 # capture_continuous.py
-import serial
-import time
+import argparse
+import collections
+import os
+import queue
+import signal
 import sys
+import threading
+import time
+import capture_format
+from alignment import Aligner
+from framing import FrameDecoder, decode_samples, PAYLOAD_SIZE, PROTOCOL_AUTO
+from sources import open_source, POLICY_BLOCK
 
 # --- Configuration ---
 SERIAL_PORT = '/dev/ttyUSB0'
 BAUD_RATE = 2000000
-DURATION_SECONDS = 30
+DURATION_SECONDS = None  # None = run until stopped
 OUTPUT_FILENAME = 'raw_audio_misaligned.bin'
+# 'serial' for the port above, or 'broker' to record from a running broker.py
+# alongside the player and the graph (see sources.open_source).
+SOURCE = 'serial'
+
+# 'bin' keeps the bytes exactly as received; 'tgc' stores decoded samples in
+# compressed, indexed capture files (capture_format.py). INPUT_FORMAT says
+# how to decode: 'framed' (SOF frames) or 'raw' (bare 4-byte samples).
+FILE_FORMAT = 'bin'
+INPUT_FORMAT = 'framed'
+
+# --- Buffering ---
+# The reader fills preallocated buffers and hands each full one to the
+# writer thread, so a slow disk never stalls the serial port. At 2 Mbaud a
+# buffer fills in about 0.3 s and the pool holds about 20 s of data.
+BUFFER_BYTES = 65536
+POOL_BUFFERS = 64
+HANDOFF_SECONDS = 0.5  # Hand over partly filled buffers too, so files stay current
+
+# --- Rotation ---
+OUTPUT_DIRECTORY = 'captures'
+OUTPUT_PREFIX = 'capture'
+ROTATE_BYTES = 1 << 30
+ROTATE_SECONDS = 3600
+
+# --- Pre-trigger ---
+PRETRIGGER_SECONDS = 30
+POSTTRIGGER_SECONDS = 30
+
+STATS_INTERVAL_SECONDS = 5
+
+
+class BufferPool:
+    """A fixed set of preallocated buffers, passed between reader and writer."""
+
+    def __init__(self, count=POOL_BUFFERS, size=BUFFER_BYTES):
+        self.count = count
+        self.size = size
+        self._free = queue.SimpleQueue()
+        for _ in range(count):
+            self._free.put(bytearray(size))
+
+    def get(self):
+        """A free buffer, or None if the writer still holds all of them."""
+        try:
+            return self._free.get_nowait()
+        except queue.Empty:
+            return None
+
+    def put(self, buf):
+        self._free.put(buf)
+
+    def in_use(self):
+        return self.count - self._free.qsize()
+
+
+class RotatingWriter:
+    """Writes buffers to a series of files, starting a new one by size or age.
+
+    With neither limit set, everything goes to `filename` (or the first name
+    `new_filename` gives).
+    """
+
+    extension = '.bin'
+
+    def __init__(self, directory=OUTPUT_DIRECTORY, prefix=OUTPUT_PREFIX, rotate_bytes=ROTATE_BYTES,
+                 rotate_seconds=ROTATE_SECONDS, filename=None):
+        self.directory = directory
+        self.prefix = prefix
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.filename = filename
+        self.files = []
+        self._f = None
+        self._file_bytes = 0
+        self._file_started = 0.0
+
+    def new_filename(self, timestamp, suffix=''):
+        if self.filename and not self.files:
+            return self.filename
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(timestamp))
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{self.prefix}_{stamp}{suffix}{self.extension}")
+        count = 1
+        while os.path.exists(path):  # Several files in one second
+            count += 1
+            path = os.path.join(self.directory, f"{self.prefix}_{stamp}{suffix}-{count}{self.extension}")
+        return path
+
+    def open(self, timestamp, suffix=''):
+        self.close()
+        path = self.new_filename(timestamp, suffix)
+        self._f = open(path, 'wb')
+        self._file_bytes = 0
+        self._file_started = timestamp
+        self.files.append(path)
+        print(f"\nWriting to '{path}'")
+
+    def _due(self, timestamp, n):
+        if self._f is None:
+            return True
+        if self.rotate_bytes and self._file_bytes + n > self.rotate_bytes:
+            return True
+        return bool(self.rotate_seconds) and timestamp - self._file_started >= self.rotate_seconds
+
+    def write(self, data, timestamp):
+        if self._due(timestamp, len(data)):
+            self.open(timestamp)
+        self.append(data, timestamp)
+
+    def append(self, data, timestamp=None):
+        """Writes to the current file, without rotating."""
+        self._f.write(data)
+        self._file_bytes += len(data)
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+
+class ContainerWriter(RotatingWriter):
+    """Rotating writer that decodes the stream and stores capture files
+    (see capture_format): 24-bit, compressed, indexed and timestamped.
+
+    `input_format` is 'framed' for the SOF-framed stream or 'raw' for bare
+    4-byte samples (the unframed firmware, or a broker). Rotation counts
+    input bytes, like the .bin writer, so both rotate at the same points.
+    """
+
+    extension = capture_format.EXTENSION
+
+    def __init__(self, *args, input_format='framed', codec=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.input_format = input_format
+        self.codec = codec
+        self._capture = None
+        # One decoder for the whole run: a gap (between pre-trigger events)
+        # is just a resync to it.
+        if input_format == 'raw':
+            self._decoder = Aligner(verbose=False)
+        else:
+            self._decoder = FrameDecoder(PROTOCOL_AUTO, payload_size=PAYLOAD_SIZE)
+
+    def _decode(self, data):
+        if self.input_format == 'raw':
+            return self._decoder.feed(data)
+        payloads = self._decoder.feed(data)
+        return decode_samples(payloads) if len(payloads) else payloads
+
+    def open(self, timestamp, suffix=''):
+        self.close()
+        path = self.new_filename(timestamp, suffix)
+        self._capture = capture_format.CaptureWriter(path, codec=self.codec, start_time=timestamp)
+        self._f = self._capture  # Marks the file as open for rotation
+        self._file_bytes = 0
+        self._file_started = timestamp
+        self.files.append(path)
+        print(f"\nWriting to '{path}'")
+
+    def append(self, data, timestamp=None):
+        samples = self._decode(data)
+        if len(samples):
+            # The decoder may hold back part of a frame, so the timestamp of
+            # the first byte is only good to about a frame (4 ms).
+            self._capture.write(samples, timestamp)
+        self._file_bytes += len(data)
+
+    def close(self):
+        if self._capture is not None:
+            self._capture.close()
+            self._capture = self._f = None
+
+
+class CaptureService:
+    """Records a source to disk without losing data.
+
+    The reader (the thread that calls `run`) reads straight into pooled
+    buffers and queues each one for the writer thread, with the wall-clock
+    time of its first byte. If the writer falls so far behind that the pool
+    runs dry, new data is read into a scratch buffer and counted in
+    `dropped_bytes`.
+
+    In continuous mode every buffer goes to a `RotatingWriter`. In
+    pre-trigger mode (`pretrigger_seconds` set) the last that many seconds
+    stay in memory and are only written out, followed by
+    `posttrigger_seconds` more, when `trigger` is called.
+    """
+
+    def __init__(self, source=SOURCE, writer=None, pretrigger_seconds=None,
+                 posttrigger_seconds=POSTTRIGGER_SECONDS, buffer_bytes=BUFFER_BYTES,
+                 buffers=POOL_BUFFERS):
+        self.source = source
+        self.writer = writer or RotatingWriter()
+        self.pretrigger_seconds = pretrigger_seconds
+        self.posttrigger_seconds = posttrigger_seconds
+        if pretrigger_seconds:
+            # Room for the whole pre-trigger window on top of the usual slack.
+            # Buffers are handed over when full or every HANDOFF_SECONDS.
+            per_second = max(BAUD_RATE / 10 / buffer_bytes, 1 / HANDOFF_SECONDS)
+            buffers += int(pretrigger_seconds * per_second) + 1
+        self.pool = BufferPool(buffers, buffer_bytes)
+
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.dropped_bytes = 0
+        self.events = []
+        self._full = queue.SimpleQueue()
+        self._stop = threading.Event()
+        self._trigger = queue.SimpleQueue()
+        self._started = None
+        self._last_stats = None
+
+    # --- Control ---
+
+    def trigger(self, reason='manual'):
+        """Saves the pre-trigger window and what follows (thread-safe)."""
+        self._trigger.put((time.time(), reason))
+
+    def stop(self):
+        self._stop.set()
+
+    # --- Reader ---
+
+    def run(self, duration=DURATION_SECONDS, stats_interval=STATS_INTERVAL_SECONDS):
+        writer_thread = threading.Thread(target=self._write_loop, name='capture-writer', daemon=True)
+        writer_thread.start()
+        scratch = memoryview(bytearray(self.pool.size))
+        self._started = time.monotonic()
+        self._last_stats = (self._started, time.process_time(), 0)
+        next_stats = self._started + stats_interval
+        end = None if duration is None else self._started + duration
+        try:
+            # A recorder must not lose data, so it asks the broker to block rather than drop.
+            with open_source(self.source, SERIAL_PORT, BAUD_RATE, policy=POLICY_BLOCK) as ser:
+                buf, fill, first_byte_time, handoff = None, 0, 0.0, 0.0
+                while not self._stop.is_set():
+                    now = time.monotonic()
+                    if end is not None and now >= end:
+                        break
+                    if now >= next_stats:
+                        print(f"\r{self.report()}", end='', flush=True)
+                        next_stats = now + stats_interval
+                    if buf is None:
+                        buf = self.pool.get()
+                        view = memoryview(buf) if buf is not None else None
+                        fill = 0
+                    if buf is None:
+                        # Pool exhausted: keep draining the port, but the data is lost.
+                        self.dropped_bytes += ser.readinto(scratch) or 0
+                        continue
+
+                    # Ask for what is waiting (at least one byte, so the read
+                    # blocks in the driver instead of spinning here).
+                    want = max(1, min(ser.in_waiting, len(buf) - fill))
+                    n = ser.readinto(view[fill:fill + want]) or 0
+                    if n == 0 and getattr(ser, 'exhausted', False):
+                        break  # End of a replayed capture
+                    if n and fill == 0:
+                        first_byte_time = time.time()
+                        handoff = now + HANDOFF_SECONDS
+                    fill += n
+                    self.bytes_read += n
+                    if fill == len(buf) or (fill and now >= handoff):
+                        view.release()
+                        self._full.put((buf, fill, first_byte_time))
+                        buf = None
+                if buf is not None and fill:
+                    view.release()
+                    self._full.put((buf, fill, first_byte_time))
+        except KeyboardInterrupt:
+            pass
+        except Exception as e:
+            print(f"\nAn error occurred: {e}")
+        finally:
+            self._full.put(None)
+            writer_thread.join()
+            print(f"\n{self.report(final=True)}")
+
+    # --- Writer ---
+
+    def _write_loop(self):
+        window = collections.deque()  # Pre-trigger buffers, oldest first
+        recording_until = None
+        while True:
+            item = self._full.get()
+            if item is None:
+                break
+            buf, n, timestamp = item
+            data = memoryview(buf)[:n]
+
+            if not self.pretrigger_seconds:
+                self.writer.write(data, timestamp)
+                self.bytes_written += n
+                data.release()
+                self.pool.put(buf)
+                continue
+
+            # Pre-trigger mode: start (or extend) an event when triggered.
+            while not self._trigger.empty():
+                trigger_time, reason = self._trigger.get()
+                if recording_until is None:
+                    self.events.append((trigger_time, reason))
+                    print(f"\nTriggered ({reason}), saving {self.pretrigger_seconds}s before "
+                          f"and {self.posttrigger_seconds}s after.")
+                    self.writer.open(trigger_time, suffix=f"_{reason}")
+                    for old_buf, old_n, old_time in window:
+                        self.writer.append(memoryview(old_buf)[:old_n], old_time)
+                        self.bytes_written += old_n
+                        self.pool.put(old_buf)
+                    window.clear()
+                recording_until = trigger_time + self.posttrigger_seconds
+
+            if recording_until is not None and timestamp >= recording_until:
+                self.writer.close()
+                recording_until = None
+
+            if recording_until is not None:
+                self.writer.append(data, timestamp)
+                self.bytes_written += n
+                data.release()
+                self.pool.put(buf)
+                continue
+
+            data.release()
+            window.append((buf, n, timestamp))
+            while len(window) > 1 and timestamp - window[1][2] >= self.pretrigger_seconds:
+                self.pool.put(window.popleft()[0])
+        for old_buf, _, _ in window:
+            self.pool.put(old_buf)
+        self.writer.close()
+
+    # --- Statistics ---
+
+    def stats(self):
+        now, cpu = time.monotonic(), time.process_time()
+        then, cpu_then, bytes_then = self._last_stats
+        self._last_stats = (now, cpu, self.bytes_read)
+        elapsed = max(now - then, 1e-9)
+        total = max(now - self._started, 1e-9)
+        return {
+            'mb_per_s': (self.bytes_read - bytes_then) / elapsed / 1e6,
+            'sustained_mb_per_s': self.bytes_read / total / 1e6,
+            'cpu_percent': (cpu - cpu_then) / elapsed * 100,
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'dropped_bytes': self.dropped_bytes,
+            'buffers_in_use': self.pool.in_use(),
+            'buffers': self.pool.count,
+            'files': len(self.writer.files),
+            'events': len(self.events),
+        }
+
+    def report(self, final=False):
+        s = self.stats()
+        rate = '' if final else f"{s['mb_per_s']:.3f} MB/s now, "
+        return (f"{rate}{s['sustained_mb_per_s']:.3f} MB/s sustained, CPU {s['cpu_percent']:.1f}%, "
+                f"{s['bytes_written']} bytes written, {s['dropped_bytes']} dropped, "
+                f"buffers {s['buffers_in_use']}/{s['buffers']}, {s['files']} files"
+                + (f", {s['events']} events" if self.pretrigger_seconds else ""))
+
+
+def capture_raw_audio(source=SOURCE, duration=DURATION_SECONDS, output=None, pretrigger_seconds=None,
+                      file_format=FILE_FORMAT, input_format=INPUT_FORMAT):
+    """Opens the data source and saves all incoming data.
+
+    Runs for `duration` seconds, or until Ctrl-C if None. With `output` all
+    data goes to that one file; otherwise files rotate in OUTPUT_DIRECTORY.
+    `file_format` 'bin' stores the bytes as received, 'tgc' decodes them
+    into capture files (see capture_format).
+    """
+    print(f"Capturing from {source} (serial port {SERIAL_PORT})...")
+    options = {'rotate_bytes': None, 'rotate_seconds': None, 'filename': output} if output else {}
+    if file_format == 'tgc':
+        if source.startswith('broker'):
+            input_format = 'raw'  # The broker sends decoded samples
+        writer = ContainerWriter(input_format=input_format, **options)
+    else:
+        writer = RotatingWriter(**options)
+    service = CaptureService(source, writer, pretrigger_seconds=pretrigger_seconds)
+
+    if pretrigger_seconds:
+        # Enter or SIGUSR1 saves the last `pretrigger_seconds` and what follows.
+        signal.signal(signal.SIGUSR1, lambda *_: service.trigger('signal'))
+
+        def watch_stdin():
+            for _ in sys.stdin:
+                service.trigger('manual')
+        threading.Thread(target=watch_stdin, daemon=True).start()
+        print(f"Keeping the last {pretrigger_seconds}s in memory. Press Enter "
+              f"(or send SIGUSR1 to {os.getpid()}) to save an event.")
+
+    service.run(duration)
+    return service
 
-def capture_raw_audio():
-    """Opens the serial port and saves all incoming data for a set duration."""
-    print(f"Attempting to open serial port {SERIAL_PORT}...")
-    try:
-        with serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1) as ser, open(OUTPUT_FILENAME, 'wb') as f:
-            print(f"Serial port opened. Capturing {DURATION_SECONDS} seconds of raw data...")
-            start_time = time.time()
-            last_update_time = start_time
-
-            while (time.time() - start_time) < DURATION_SECONDS:
-                if ser.in_waiting > 0:
-                    chunk = ser.read(ser.in_waiting)
-                    f.write(chunk)
-                
-                # Progress update
-                if (time.time() - last_update_time) > 1.0:
-                    progress = ((time.time() - start_time) / DURATION_SECONDS) * 100
-                    sys.stdout.write(f"\rProgress: {progress:.1f}%...")
-                    sys.stdout.flush()
-                    last_update_time = time.time()
-
-    except Exception as e:
-        print(f"\nAn error occurred: {e}")
-        return
-
-    print(f"\nRaw data capture complete. Misaligned data saved to '{OUTPUT_FILENAME}'.")
 
 if __name__ == "__main__":
-    input("Press Enter to start capturing...")
-    capture_raw_audio()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Capture raw audio to disk.")
+    parser.add_argument('--source', default=SOURCE, help="'serial', 'serial:/dev/...', 'broker', 'broker:ADDRESS', "
+                                                         "'replay:FILE' or 'synth:...'")
+    parser.add_argument('--duration', type=float, default=DURATION_SECONDS,
+                        help="seconds to capture (default: until Ctrl-C)")
+    parser.add_argument('--output', help="write one file instead of rotating files in "
+                                         f"'{OUTPUT_DIRECTORY}/', e.g. {OUTPUT_FILENAME}")
+    parser.add_argument('--pretrigger', type=float, nargs='?', const=PRETRIGGER_SECONDS,
+                        help="only keep the last N seconds in memory and save them on a trigger")
+    parser.add_argument('--format', choices=('bin', 'tgc'), default=FILE_FORMAT,
+                        help="raw bytes, or compressed indexed capture files")
+    parser.add_argument('--input', choices=('framed', 'raw'), default=INPUT_FORMAT,
+                        help="how to decode the stream for --format tgc")
+    args = parser.parse_args()
+
+    capture_raw_audio(args.source, args.duration, args.output, args.pretrigger, args.format, args.input)
@@ -0,0 +1,377 @@
+# capture_format.py
+import argparse
+import mmap
+import os
+import struct
+import tempfile
+import time
+import zlib
+import numpy as np
+from framing import pack_int24, unpack_int24
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# --- Configuration ---
+SAMPLE_RATE = 32000
+BITS_PER_SAMPLE = 24
+CHUNK_SAMPLES = 32768  # ~1 s per chunk: the unit of compression and of random access
+EXTENSION = '.tgc'
+
+# --- Codecs ---
+# zlib is always there; lz4 and zstandard are used when installed.
+CODEC_NONE, CODEC_ZLIB, CODEC_LZ4, CODEC_ZSTD = 0, 1, 2, 3
+CODEC_NAMES = {'none': CODEC_NONE, 'zlib': CODEC_ZLIB, 'lz4': CODEC_LZ4, 'zstd': CODEC_ZSTD}
+ZLIB_LEVEL = 1
+ZSTD_LEVEL = 3
+
+# --- Layout ---
+# File:  header | chunk | chunk | ... | index
+# Chunk: chunk header | compressed payload
+# The index repeats what the chunk headers say, so it can be rebuilt by
+# walking the chunks if the writer never got to close the file.
+FILE_MAGIC = b'TGCAP\x01'
+HEADER = struct.Struct('<6sHIHHBBIdQQ')  # magic, version, rate, bits, channels, codec, flags,
+HEADER_SIZE = 64                          # chunk samples, start time, index offset, total samples
+VERSION = 1
+CHUNK_MAGIC = b'CK'
+CHUNK_HEADER = struct.Struct('<2sBBIIQdI')  # magic, codec, flags, samples, payload bytes,
+                                            # first sample, timestamp, CRC-32 of payload
+INDEX_MAGIC = b'IX'
+INDEX_HEADER = struct.Struct('<2sQ')
+INDEX_DTYPE = np.dtype([('offset', '<u8'), ('first', '<u8'), ('count', '<u4'), ('timestamp', '<f8')])
+
+# --- Chunk flags ---
+FLAG_DELTA = 1    # Samples stored as differences, modulo 2**24
+FLAG_SHUFFLE = 2  # Low, middle and high bytes stored as three separate planes
+DEFAULT_FLAGS = FLAG_DELTA | FLAG_SHUFFLE
+
+# --- Benchmark Configuration ---
+BENCH_INPUT_FILENAME = 'raw_audio_misaligned.bin'
+
+
+def default_codec():
+    return CODEC_ZSTD if zstandard is not None else CODEC_ZLIB
+
+
+def _compress(codec, data):
+    if codec == CODEC_NONE:
+        return bytes(data)
+    if codec == CODEC_ZLIB:
+        return zlib.compress(data, ZLIB_LEVEL)
+    if codec == CODEC_LZ4 and lz4 is not None:
+        return lz4.frame.compress(data)
+    if codec == CODEC_ZSTD and zstandard is not None:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    raise ValueError(f"Codec {codec} is not available (is the module installed?)")
+
+
+def _decompress(codec, data, size):
+    if codec == CODEC_NONE:
+        return data
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(data, bufsize=size)
+    if codec == CODEC_LZ4 and lz4 is not None:
+        return lz4.frame.decompress(data)
+    if codec == CODEC_ZSTD and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompress(data, max_output_size=size)
+    raise ValueError(f"Codec {codec} is not available (is the module installed?)")
+
+
+def encode_chunk(samples, codec, flags=DEFAULT_FLAGS):
+    """Compresses int32 24-bit samples into a self-contained payload."""
+    samples = np.asarray(samples, dtype='<i4')
+    if flags & FLAG_DELTA:
+        values = np.empty_like(samples)
+        values[:1] = samples[:1]
+        # Packing keeps the low 24 bits, so the differences wrap exactly.
+        np.subtract(samples[1:], samples[:-1], out=values[1:])
+    else:
+        values = samples
+    packed = pack_int24(values)
+    if flags & FLAG_SHUFFLE:
+        packed = np.ascontiguousarray(packed.reshape(-1, 3).T)
+    return _compress(codec, memoryview(packed).cast('B'))
+
+
+def decode_chunk(payload, count, codec, flags):
+    """Inverse of `encode_chunk`."""
+    packed = np.frombuffer(_decompress(codec, payload, count * 3), dtype=np.uint8)
+    if flags & FLAG_SHUFFLE:
+        packed = np.ascontiguousarray(packed.reshape(3, count).T)
+    samples = unpack_int24(packed)
+    if flags & FLAG_DELTA:
+        np.cumsum(samples, out=samples)
+        samples <<= 8  # Back to 24 bits, sign-extended
+        samples >>= 8
+    return samples
+
+
+class CaptureWriter:
+    """Writes samples into a chunked, compressed, indexed capture file.
+
+    `write(samples, timestamp)` takes any number of int32 samples and the
+    wall-clock time (time.time()) of the first one, if known; chunks get
+    their timestamp from it, or from the previous chunk and the sample rate.
+    The index and sample count are written by `close`.
+    """
+
+    def __init__(self, filename, sample_rate=SAMPLE_RATE, codec=None, chunk_samples=CHUNK_SAMPLES,
+                 flags=DEFAULT_FLAGS, start_time=None):
+        self.filename = filename
+        self.sample_rate = sample_rate
+        self.codec = default_codec() if codec is None else codec
+        self.chunk_samples = chunk_samples
+        self.flags = flags
+        self.start_time = time.time() if start_time is None else start_time
+        self.total_samples = 0
+        self.bytes_written = HEADER_SIZE
+        self._chunk = np.empty(chunk_samples, dtype='<i4')
+        self._fill = 0
+        self._chunk_time = None
+        self._index = []
+        self._f = open(filename, 'wb')
+        self._f.write(self._header(0))
+
+    def _header(self, index_offset):
+        header = HEADER.pack(FILE_MAGIC, VERSION, self.sample_rate, BITS_PER_SAMPLE, 1,
+                             self.codec, self.flags, self.chunk_samples, self.start_time,
+                             index_offset, self.total_samples)
+        return header.ljust(HEADER_SIZE, b'\0')
+
+    def write(self, samples, timestamp=None):
+        pos = 0
+        while pos < len(samples):
+            if self._fill == 0:
+                if timestamp is not None:
+                    self._chunk_time = timestamp + pos / self.sample_rate
+                elif self._chunk_time is None:
+                    self._chunk_time = self.start_time
+            n = min(len(samples) - pos, self.chunk_samples - self._fill)
+            self._chunk[self._fill:self._fill + n] = samples[pos:pos + n]
+            self._fill += n
+            pos += n
+            if self._fill == self.chunk_samples:
+                self._flush_chunk()
+
+    def _flush_chunk(self):
+        if self._fill == 0:
+            return
+        payload = encode_chunk(self._chunk[:self._fill], self.codec, self.flags)
+        offset = self.bytes_written
+        self._f.write(CHUNK_HEADER.pack(CHUNK_MAGIC, self.codec, self.flags, self._fill, len(payload),
+                                        self.total_samples, self._chunk_time,
+                                        zlib.crc32(payload)))
+        self._f.write(payload)
+        self._index.append((offset, self.total_samples, self._fill, self._chunk_time))
+        self.bytes_written += CHUNK_HEADER.size + len(payload)
+        self.total_samples += self._fill
+        self._chunk_time += self._fill / self.sample_rate
+        self._fill = 0
+
+    def close(self):
+        if self._f is None:
+            return
+        self._flush_chunk()
+        index_offset = self.bytes_written
+        index = np.array(self._index, dtype=INDEX_DTYPE)
+        self._f.write(INDEX_HEADER.pack(INDEX_MAGIC, len(index)))
+        self._f.write(index.tobytes())
+        self._f.seek(0)
+        self._f.write(self._header(index_offset))
+        self._f.close()
+        self._f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CaptureReader:
+    """Lazy, memory-mapped reader for capture files.
+
+    Only the header and index are read up front; `read` and `read_seconds`
+    decompress just the chunks they need.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._f = open(filename, 'rb')
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.sample_rate, self.bits, self.channels, self.codec, self.flags,
+         self.chunk_samples, self.start_time, index_offset, total) = HEADER.unpack_from(self._mm)
+        if magic != FILE_MAGIC:
+            raise ValueError(f"'{filename}' is not a capture file")
+        if version > VERSION:
+            raise ValueError(f"'{filename}' is version {version}; this reader knows up to {VERSION}")
+        self.index = self._read_index(index_offset) if index_offset else self._scan_chunks()
+        self.complete = bool(index_offset)
+        self.total_samples = int(self.index['first'][-1] + self.index['count'][-1]) if len(self.index) else 0
+        self._cache = (None, None)
+
+    def _read_index(self, offset):
+        magic, count = INDEX_HEADER.unpack_from(self._mm, offset)
+        if magic != INDEX_MAGIC:
+            return self._scan_chunks()
+        return np.frombuffer(self._mm, dtype=INDEX_DTYPE, count=count,
+                             offset=offset + INDEX_HEADER.size).copy()
+
+    def _scan_chunks(self):
+        """Rebuilds the index of a file whose writer never closed it."""
+        entries, offset = [], HEADER_SIZE
+        while offset + CHUNK_HEADER.size <= len(self._mm):
+            magic, _, _, count, size, first, timestamp, _ = CHUNK_HEADER.unpack_from(self._mm, offset)
+            if magic != CHUNK_MAGIC or offset + CHUNK_HEADER.size + size > len(self._mm):
+                break
+            entries.append((offset, first, count, timestamp))
+            offset += CHUNK_HEADER.size + size
+        return np.array(entries, dtype=INDEX_DTYPE)
+
+    @property
+    def duration(self):
+        return self.total_samples / self.sample_rate
+
+    def __len__(self):
+        return self.total_samples
+
+    def chunk(self, i):
+        """Decoded samples of chunk i (the last one is cached)."""
+        if self._cache[0] == i:
+            return self._cache[1]
+        offset = int(self.index['offset'][i])
+        _, codec, flags, count, size, _, _, crc = CHUNK_HEADER.unpack_from(self._mm, offset)
+        start = offset + CHUNK_HEADER.size
+        payload = self._mm[start:start + size]
+        if zlib.crc32(payload) != crc:
+            raise ValueError(f"Chunk {i} of '{self.filename}' is corrupt")
+        samples = decode_chunk(payload, count, codec, flags)
+        self._cache = (i, samples)
+        return samples
+
+    def iter_chunks(self):
+        """Yields (first sample index, timestamp, samples) for every chunk."""
+        for i in range(len(self.index)):
+            yield int(self.index['first'][i]), float(self.index['timestamp'][i]), self.chunk(i)
+
+    def read(self, start, count):
+        """Samples [start, start + count), clipped to the file."""
+        start, stop = max(start, 0), min(start + count, self.total_samples)
+        out = np.empty(max(stop - start, 0), dtype=np.int32)
+        if len(out) == 0:
+            return out
+        first = int(np.searchsorted(self.index['first'], start, side='right')) - 1
+        pos = start
+        for i in range(first, len(self.index)):
+            chunk_first = int(self.index['first'][i])
+            if chunk_first >= stop:
+                break
+            samples = self.chunk(i)
+            lo, hi = pos - chunk_first, min(stop - chunk_first, len(samples))
+            out[pos - start:pos - start + hi - lo] = samples[lo:hi]
+            pos += hi - lo
+        return out
+
+    def read_seconds(self, t0, t1):
+        """Samples between t0 and t1 seconds from the start of the capture."""
+        start = int(round(t0 * self.sample_rate))
+        return self.read(start, int(round(t1 * self.sample_rate)) - start)
+
+    def sample_at(self, wall_time):
+        """Index of the sample recorded at `wall_time` (time.time() seconds)."""
+        i = max(int(np.searchsorted(self.index['timestamp'], wall_time, side='right')) - 1, 0)
+        offset = int(round((wall_time - self.index['timestamp'][i]) * self.sample_rate))
+        # A time in a gap between chunks (data was lost) maps to the gap.
+        return int(self.index['first'][i]) + min(max(offset, 0), int(self.index['count'][i]))
+
+    def read_wall(self, t0, t1):
+        """Samples recorded between two wall-clock times."""
+        start = self.sample_at(t0)
+        return self.read(start, self.sample_at(t1) - start)
+
+    def close(self):
+        self._cache = (None, None)
+        self._mm.close()
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def is_capture_file(filename):
+    """True if `filename` is in this format (rather than a raw .bin dump)."""
+    try:
+        with open(filename, 'rb') as f:
+            return f.read(len(FILE_MAGIC)) == FILE_MAGIC
+    except OSError:
+        return False
+
+
+# --- Benchmark ---
+
+def run_benchmark(filename=BENCH_INPUT_FILENAME):
+    """Size, encode and decode speed and random access for each codec, on
+    the sample capture."""
+    from framing import capture_payloads, decode_samples
+    with open(filename, 'rb') as f:
+        raw = f.read()
+    samples = decode_samples(capture_payloads(raw))
+    print(f"Input: '{filename}', {len(raw)} bytes, {len(samples)} samples "
+          f"({len(samples) / SAMPLE_RATE:.0f} s)")
+    codecs = [name for name, codec in CODEC_NAMES.items()
+              if codec in (CODEC_NONE, CODEC_ZLIB) or (codec == CODEC_LZ4 and lz4)
+              or (codec == CODEC_ZSTD and zstandard)]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench' + EXTENSION)
+        for name in codecs:
+            for flags in (0, FLAG_DELTA, FLAG_DELTA | FLAG_SHUFFLE):
+                start = time.perf_counter()
+                with CaptureWriter(path, codec=CODEC_NAMES[name], flags=flags) as writer:
+                    writer.write(samples)
+                encode = time.perf_counter() - start
+                size = os.path.getsize(path)
+
+                with CaptureReader(path) as reader:
+                    start = time.perf_counter()
+                    decoded = np.concatenate([s for _, _, s in reader.iter_chunks()])
+                    decode = time.perf_counter() - start
+                    assert np.array_equal(decoded, samples)
+                    start = time.perf_counter()
+                    reader._cache = (None, None)
+                    reader.read_seconds(reader.duration / 2, reader.duration / 2 + 1)
+                    seek = time.perf_counter() - start
+
+                mode = '+'.join(part for bit, part in ((FLAG_DELTA, 'delta'), (FLAG_SHUFFLE, 'shuffle'))
+                                if flags & bit) or 'plain'
+                print(f"  {name:5} {mode:14} {size / len(raw):6.1%} of .bin, "
+                      f"encode {len(raw) / encode / 1e6:6.1f} MB/s, decode {len(raw) / decode / 1e6:6.1f} MB/s, "
+                      f"1 s from the middle in {seek * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chunked, compressed capture files.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    info = sub.add_parser('info', help="show a capture file's header and index")
+    info.add_argument('filename')
+    sub.add_parser('bench', help="compare codecs on the sample capture")
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        run_benchmark()
+    else:
+        with CaptureReader(args.filename) as reader:
+            codec = {v: k for k, v in CODEC_NAMES.items()}.get(reader.codec, reader.codec)
+            print(f"{reader.total_samples} samples at {reader.sample_rate} Hz ({reader.duration:.1f} s), "
+                  f"{reader.bits}-bit, {codec}, {len(reader.index)} chunks"
+                  f"{'' if reader.complete else ' (not closed; index rebuilt)'}")
+            print(f"Recorded from {time.ctime(reader.start_time)}")
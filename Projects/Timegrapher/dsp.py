@@ -0,0 +1,493 @@
+# dsp.py
+import argparse
+import math
+import time
+import numpy as np
+
+# --- Configuration ---
+SAMPLE_RATE = 32000
+FULL_SCALE = 2**23
+CHUNK_SAMPLES = 64          # Biquads run in chunks of this many samples at a time
+GROUP_CHUNKS = 32           # and carry their state across up to this many chunks at once
+DEFAULT_Q = 0.7071          # Butterworth
+
+# --- Defaults for the Stages ---
+DC_POLE = 0.999             # DC blocker pole; -3 dB at ~5 Hz at 32 kHz
+GATE_THRESHOLD_DB = -60.0   # Below full scale
+GATE_FLOOR_DB = -40.0       # Gain while the gate is shut
+GATE_HOLD_SECONDS = 0.05    # Kept open this long after the last loud chunk
+GATE_CHUNK_SAMPLES = 32     # 1 ms: the gate opens and shuts on these boundaries
+CLIP_LIMIT = FULL_SCALE - 1
+
+# --- Benchmark Configuration ---
+BENCH_SECONDS = 10
+BENCH_BLOCKS = (128, 512, 2048)
+MAX_TRANSIENT_BYTES = 4096  # Per block in the self-check; one 8191-sample float32 copy is 32 KB
+
+
+class Biquad:
+    """A second-order IIR section whose state is carried from block to block.
+
+    Written as a state-space system (transposed direct form II), `CHUNK`
+    samples at a time: within a chunk the output is the input convolved
+    with the section's first CHUNK impulse response taps plus the response
+    to the state it started in, and the state at the end is likewise a
+    fixed linear function of both. So a whole block is a few matrix
+    products over its chunks instead of a Python loop over every sample.
+    The state each chunk starts in depends on all the chunks before it in
+    the same way, so it too is one product for a group of chunks.
+    """
+
+    def __init__(self, b, a, chunk=CHUNK_SAMPLES, group=GROUP_CHUNKS, name='biquad'):
+        b0, b1, b2 = (float(v) for v in b)
+        a1, a2 = (float(v) for v in a)  # a0 == 1
+        self.name = name
+        self.b = (b0, b1, b2)
+        self.a = (a1, a2)
+        self.chunk = chunk
+        A = np.array([[-a1, 1.0], [-a2, 0.0]])
+        B = np.array([b1 - a1 * b0, b2 - a2 * b0])
+        # powers[k] = A^k, k = 0..chunk
+        powers = np.empty((chunk + 1, 2, 2))
+        powers[0] = np.eye(2)
+        for k in range(1, chunk + 1):
+            powers[k] = A @ powers[k - 1]
+        self._powers = powers
+        # impulse[k]: output k samples after a unit input (from zero state).
+        impulse = np.empty(chunk)
+        impulse[0] = b0
+        impulse[1:] = powers[:chunk - 1, 0, :] @ B
+        taps = np.arange(chunk)
+        lag = taps[:, None] - taps[None, :]
+        # Transposed, so a row of input times it is a row of output.
+        self._forced = np.where(lag >= 0, impulse[np.clip(lag, 0, None)], 0).T.astype(np.float32)
+        # Output from the state the chunk started in: C A^n, C = [1, 0].
+        self._free = powers[:chunk, 0, :].T.astype(np.float32).copy()        # 2 x chunk
+        # State after the chunk from its input: A^(chunk-1-k) B.
+        self._drive = (powers[chunk - 1::-1] @ B).astype(np.float32).copy()  # chunk x 2
+        # Across a group of chunks: state at the start of chunk k is
+        # A^(chunk k) s0 + sum over j < k of A^(chunk (k-1-j)) d_j, with d_j
+        # the drive of chunk j; as matrices over the flattened states.
+        step = powers[chunk]
+        steps = np.empty((group + 1, 2, 2))
+        steps[0] = np.eye(2)
+        for k in range(1, group + 1):
+            steps[k] = step @ steps[k - 1]
+        carry = np.zeros((group, 2, group, 2))
+        for k in range(group):
+            for j in range(k):
+                carry[k, :, j, :] = steps[k - 1 - j]
+        self._carry = carry.reshape(2 * group, 2 * group).astype(np.float32)
+        self._from_start = steps[:group].reshape(2 * group, 2).astype(np.float32)
+        self._step = step.astype(np.float32)
+        self._powers32 = powers.astype(np.float32)
+        self.group = group
+        self.state = np.zeros(2, dtype=np.float32)
+        # Scratch for the products, so a block allocates no arrays.
+        self._start = np.zeros(2, dtype=np.float32)
+        self._tail_drive = np.zeros(2, dtype=np.float32)
+        self._carried = np.zeros(2 * group, dtype=np.float32)
+        self._tail_forced = np.zeros(chunk, dtype=np.float32)
+        self._tail_free = np.zeros(chunk, dtype=np.float32)
+        self._states = np.zeros((0, 2), dtype=np.float32)
+        self._drives = np.zeros((0, 2), dtype=np.float32)
+        self._forced_out = np.zeros((0, chunk), dtype=np.float32)
+
+    # --- Designs (RBJ audio EQ cookbook) ---
+
+    @classmethod
+    def _design(cls, kind, frequency, sample_rate, q, **kwargs):
+        w = 2 * math.pi * frequency / sample_rate
+        alpha = math.sin(w) / (2 * q)
+        cos = math.cos(w)
+        if kind == 'highpass':
+            b = ((1 + cos) / 2, -(1 + cos), (1 + cos) / 2)
+        elif kind == 'lowpass':
+            b = ((1 - cos) / 2, 1 - cos, (1 - cos) / 2)
+        else:  # bandpass, 0 dB peak gain
+            b = (alpha, 0.0, -alpha)
+        a0 = 1 + alpha
+        return cls([v / a0 for v in b], (-2 * cos / a0, (1 - alpha) / a0),
+                   name=f"{kind} {frequency:g} Hz", **kwargs)
+
+    @classmethod
+    def highpass(cls, frequency, sample_rate=SAMPLE_RATE, q=DEFAULT_Q, **kwargs):
+        return cls._design('highpass', frequency, sample_rate, q, **kwargs)
+
+    @classmethod
+    def lowpass(cls, frequency, sample_rate=SAMPLE_RATE, q=DEFAULT_Q, **kwargs):
+        return cls._design('lowpass', frequency, sample_rate, q, **kwargs)
+
+    @classmethod
+    def bandpass(cls, low, high, sample_rate=SAMPLE_RATE, **kwargs):
+        """Band-pass centred (geometrically) between `low` and `high` Hz."""
+        centre = math.sqrt(low * high)
+        section = cls._design('bandpass', centre, sample_rate, centre / (high - low), **kwargs)
+        section.name = f"bandpass {low:g}-{high:g} Hz"
+        return section
+
+    @classmethod
+    def dc_blocker(cls, pole=DC_POLE, **kwargs):
+        """y[n] = x[n] - x[n-1] + pole * y[n-1]."""
+        return cls((1.0, -1.0, 0.0), (-pole, 0.0), name='dc', **kwargs)
+
+    def reset(self):
+        self.state[:] = 0
+
+    def _reserve(self, chunks):
+        if len(self._states) < chunks:
+            self._states = np.zeros((chunks, 2), dtype=np.float32)
+            self._drives = np.zeros((chunks, 2), dtype=np.float32)
+            self._forced_out = np.zeros((chunks, self.chunk), dtype=np.float32)
+
+    def process(self, x):
+        """Filters float32 samples in place."""
+        L = self.chunk
+        full = len(x) // L
+        if full:
+            self._reserve(full)
+            rows = x[:full * L].reshape(full, L)
+            states = self._states[:full]
+            drives = self._drives[:full]
+            forced = self._forced_out[:full]
+            np.matmul(rows, self._forced, out=forced)
+            np.matmul(rows, self._drive, out=drives)
+            for g in range(0, full, self.group):
+                m = min(self.group, full - g)
+                flat = states[g:g + m].reshape(-1)
+                carried = self._carried[:2 * m]
+                np.matmul(self._carry[:2 * m, :2 * m], drives[g:g + m].reshape(-1), out=flat)
+                np.matmul(self._from_start[:2 * m], self.state, out=carried)
+                flat += carried
+                np.matmul(self._step, states[g + m - 1], out=self.state)
+                self.state += drives[g + m - 1]
+            np.matmul(states, self._free, out=rows)
+            rows += forced
+        rest = len(x) - full * L
+        if rest:
+            tail = x[full * L:]
+            start = self._start
+            np.copyto(start, self.state)
+            np.matmul(self._powers32[rest], start, out=self.state)
+            np.matmul(tail, self._drive[L - rest:], out=self._tail_drive)
+            self.state += self._tail_drive
+            out, free = self._tail_forced[:rest], self._tail_free[:rest]
+            np.matmul(tail, self._forced[:rest, :rest], out=out)
+            np.matmul(start, self._free[:, :rest], out=free)
+            np.add(out, free, out=tail)
+        return x
+
+
+class NoiseGate:
+    """Turns the signal down between beats.
+
+    The block is examined in GATE_CHUNK_SAMPLES chunks; the gate is open
+    for a chunk whose peak reaches the threshold and for `hold_seconds`
+    after it, and otherwise scales the chunk by the floor gain. How long
+    it has been shut is carried across blocks.
+    """
+
+    def __init__(self, threshold_db=GATE_THRESHOLD_DB, floor_db=GATE_FLOOR_DB,
+                 hold_seconds=GATE_HOLD_SECONDS, sample_rate=SAMPLE_RATE,
+                 chunk=GATE_CHUNK_SAMPLES):
+        self.name = f"gate {threshold_db:g} dB"
+        self.threshold = FULL_SCALE * 10 ** (threshold_db / 20)
+        self.floor = 10 ** (floor_db / 20)
+        self.chunk = chunk
+        self.hold = int(hold_seconds * sample_rate / chunk)
+        self._since_open = self.hold + 1  # Chunks since the last loud one
+        self._positions = np.zeros(0, dtype=np.float32)
+        self._scratch = np.zeros(0, dtype=np.float32)
+        self._peak = np.zeros(0, dtype=np.float32)
+        self._trough = np.zeros(0, dtype=np.float32)
+        self._gains = np.zeros((0, chunk), dtype=np.float32)
+        self._open = np.zeros(0, dtype=bool)
+        self.open_chunks = 0
+        self.chunks = 0
+
+    def _reserve(self, chunks):
+        if len(self._positions) < chunks:
+            self._positions = np.arange(chunks, dtype=np.float32)
+            self._scratch = np.zeros(chunks, dtype=np.float32)
+            self._peak = np.zeros(chunks, dtype=np.float32)
+            self._trough = np.zeros(chunks, dtype=np.float32)
+            self._gains = np.zeros((chunks, self.chunk), dtype=np.float32)
+            self._open = np.zeros(chunks, dtype=bool)
+
+    def _gate(self, rows):
+        m = len(rows)
+        peak, trough = self._peak[:m], self._trough[:m]
+        loud, last = self._open[:m], self._scratch[:m]
+        np.max(rows, axis=1, out=peak)
+        np.min(rows, axis=1, out=trough)
+        np.negative(trough, out=trough)
+        np.maximum(peak, trough, out=peak)
+        np.greater_equal(peak, self.threshold, out=loud)
+        # Index of the last loud chunk at or before each one; the one
+        # carried over from earlier blocks counts as -since_open.
+        last.fill(-self._since_open - 1.0)
+        np.copyto(last, self._positions[:m], where=loud)
+        np.maximum.accumulate(last, out=last)
+        np.subtract(self._positions[:m], last, out=last)
+        # Capped: only whether it exceeds the hold matters, and float32
+        # positions stay exact.
+        self._since_open = min(int(last[-1]) + 1, self.hold + 1)
+        # last is now how many chunks back the gate was triggered.
+        np.less_equal(last, self.hold, out=loud)
+        self.open_chunks += int(np.count_nonzero(loud))
+        self.chunks += m
+        np.copyto(last, self.floor)
+        np.copyto(last, 1.0, where=loud)
+        # Spread to one gain per sample first: an in-place multiply by the
+        # broadcast column would make numpy copy the whole block.
+        gains = self._gains[:m, :rows.shape[1]]
+        np.copyto(gains, last[:, None])
+        rows *= gains
+
+    def process(self, x):
+        L = self.chunk
+        full = len(x) // L
+        self._reserve(full + 1)
+        if full:
+            self._gate(x[:full * L].reshape(full, L))
+        if len(x) > full * L:
+            self._gate(x[full * L:].reshape(1, -1))
+        return x
+
+
+class Gain:
+    """Fixed gain, then clipping to the 24-bit range."""
+
+    def __init__(self, gain=1.0, limit=CLIP_LIMIT):
+        self.name = f"gain {gain:g}"
+        self.gain = np.float32(gain)
+        self.limit = limit
+        self._low, self._high = np.float32(-limit), np.float32(limit)
+
+    def process(self, x):
+        if self.gain != 1:
+            x *= self.gain
+        # Two ufuncs rather than np.clip, whose Python wrapper allocates.
+        np.minimum(x, self._high, out=x)
+        np.maximum(x, self._low, out=x)
+        return x
+
+
+def parse_chain(spec, sample_rate=SAMPLE_RATE):
+    """Builds the stages named by `spec`, e.g.
+    'dc,highpass=200,bandpass=1000-8000,gate=-60,gain=2'.
+
+    dc                  DC blocker
+    highpass=HZ         Butterworth high-pass biquad
+    lowpass=HZ          Butterworth low-pass biquad
+    bandpass=LOW-HIGH   band-pass biquad
+    gate=DB             noise gate at DB below full scale
+    gain=G              gain and clipping to 24 bits
+    """
+    stages = []
+    for part in filter(None, (p.strip() for p in spec.split(','))):
+        kind, _, value = part.partition('=')
+        if kind == 'dc':
+            stages.append(Biquad.dc_blocker(float(value) if value else DC_POLE))
+        elif kind in ('highpass', 'lowpass'):
+            stages.append(getattr(Biquad, kind)(float(value), sample_rate))
+        elif kind == 'bandpass':
+            low, high = (float(v) for v in value.split('-'))
+            stages.append(Biquad.bandpass(low, high, sample_rate))
+        elif kind == 'gate':
+            stages.append(NoiseGate(float(value) if value else GATE_THRESHOLD_DB,
+                                    sample_rate=sample_rate))
+        elif kind == 'gain':
+            stages.append(Gain(float(value)))
+        else:
+            raise ValueError(f"Unknown DSP stage '{part}'")
+    return stages
+
+
+class DSPChain:
+    """Runs int32 sample blocks through a list of float32 stages.
+
+    Each block is converted once into a float32 work buffer, every stage
+    works on it in place, and the result is rounded back into an int32
+    output buffer, and the stages write their products into scratch of
+    their own, so no array is allocated per block once the buffers have
+    grown to the largest block seen. The returned array is a view of
+    that buffer, valid until the next call. Time spent in each stage is
+    kept for `report`.
+    """
+
+    def __init__(self, stages=(), sample_rate=SAMPLE_RATE):
+        if isinstance(stages, str):
+            stages = parse_chain(stages, sample_rate)
+        self.stages = list(stages)
+        self.sample_rate = sample_rate
+        self._work = np.zeros(0, dtype=np.float32)
+        self._out = np.zeros(0, dtype=np.int32)
+        self.stage_seconds = [0.0] * len(self.stages)
+        self.busy_seconds = 0.0
+        self.blocks = 0
+        self.samples = 0
+
+    def _reserve(self, n):
+        if len(self._work) < n:
+            self._work = np.zeros(n, dtype=np.float32)
+            self._out = np.zeros(n, dtype=np.int32)
+
+    def process(self, samples):
+        """Filters a block of int32 samples; returns int32 (a reused buffer)."""
+        if not self.stages:
+            return samples
+        start = time.perf_counter()
+        n = len(samples)
+        self._reserve(n)
+        work, out = self._work[:n], self._out[:n]
+        np.copyto(work, samples, casting='unsafe')
+        for i, stage in enumerate(self.stages):
+            t = time.perf_counter()
+            stage.process(work)
+            self.stage_seconds[i] += time.perf_counter() - t
+        np.rint(work, out=work)
+        np.copyto(out, work, casting='unsafe')
+        self.busy_seconds += time.perf_counter() - start
+        self.blocks += 1
+        self.samples += n
+        return out
+
+    def report(self):
+        if not self.stages:
+            return "no stages"
+        blocks = max(1, self.blocks)
+        per_stage = ", ".join(f"{stage.name} {seconds / blocks * 1e6:.0f}"
+                              for stage, seconds in zip(self.stages, self.stage_seconds))
+        seconds = self.samples / self.sample_rate
+        factor = seconds / self.busy_seconds if self.busy_seconds else 0.0
+        return (f"{self.busy_seconds / blocks * 1e6:.0f} us/block of "
+                f"{self.samples / blocks:.0f} ({per_stage}), {factor:.0f}x real time")
+
+
+# --- Self-check and benchmark ---
+
+def _reference(section, x):
+    """Sample-by-sample transposed direct form II in float64."""
+    b0, b1, b2 = section.b
+    a1, a2 = section.a
+    z1 = z2 = 0.0
+    y = np.empty(len(x))
+    for n, v in enumerate(x):
+        out = b0 * v + z1
+        z1 = b1 * v - a1 * out + z2
+        z2 = b2 * v - a2 * out
+        y[n] = out
+    return y
+
+
+def run_selfcheck():
+    """Checks the chunked biquad against a per-sample one over ragged
+    blocks, the filter responses, the gate, and that a chain allocates
+    no arrays per block."""
+    import tracemalloc
+    ok = True
+    rng = np.random.default_rng(0)
+    x = (rng.standard_normal(20000) * 1e6).astype(np.float32)
+    for section in (Biquad.highpass(500), Biquad.lowpass(3000), Biquad.bandpass(1000, 8000),
+                    Biquad.dc_blocker()):
+        expected = _reference(section, x.astype(np.float64))
+        y = x.copy()
+        position = 0
+        while position < len(y):
+            size = int(rng.integers(1, 700))
+            section.process(y[position:position + size])
+            position += size
+        error = np.max(np.abs(y - expected)) / np.max(np.abs(expected))
+        passed = error < 1e-4
+        ok &= passed
+        print(f"  {section.name}: ragged blocks vs per-sample reference, max error "
+              f"{error:.1e} of peak  {'ok' if passed else 'FAIL'}")
+
+    def gain_db(section, frequency):
+        t = np.arange(SAMPLE_RATE) / SAMPLE_RATE
+        tone = np.sin(2 * np.pi * frequency * t).astype(np.float32)
+        section.reset()
+        section.process(tone)
+        return 20 * np.log10(np.abs(tone[SAMPLE_RATE // 2:]).max())
+
+    for section, frequency, low, high in ((Biquad.highpass(500), 500, -3.5, -2.5),
+                                          (Biquad.highpass(500), 50, -45, -35),
+                                          (Biquad.bandpass(1000, 8000), 2828, -0.5, 0.5),
+                                          (Biquad.dc_blocker(), 1000, -0.1, 0.1)):
+        level = gain_db(section, frequency)
+        passed = low <= level <= high
+        ok &= passed
+        print(f"  {section.name} at {frequency} Hz: {level:+.1f} dB  {'ok' if passed else 'FAIL'}")
+
+    # Gate: a burst every 125 ms passes, the quiet between is turned down.
+    gate = NoiseGate(hold_seconds=0.01)
+    signal = np.full(SAMPLE_RATE, 100.0, dtype=np.float32)
+    signal[::4000] = 1e6
+    gate.process(signal)
+    passed = signal[0] == 1e6 and signal[100] == 100.0 and abs(signal[1000] - 1.0) < 1e-3
+    ok &= passed
+    print(f"  gate: {gate.open_chunks} of {gate.chunks} chunks open  {'ok' if passed else 'FAIL'}")
+
+    # After warm-up a block must allocate no arrays: nothing builds up, and
+    # the transient peak (a few view objects) does not grow with the block.
+    for size in (512, 8191):
+        chain = DSPChain('dc,highpass=200,bandpass=1000-10000,gate,gain=2')
+        block = (rng.standard_normal(size) * 1e5).astype(np.int32)
+        for _ in range(3):
+            chain.process(block)
+        tracemalloc.start()
+        chain.process(block)
+        start = tracemalloc.get_traced_memory()[0]
+        transient = 0
+        for _ in range(200):
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            chain.process(block)
+            transient = max(transient, tracemalloc.get_traced_memory()[1] - before)
+        kept = tracemalloc.get_traced_memory()[0] - start
+        tracemalloc.stop()
+        # A few bytes come and go as the counters' int and float objects are
+        # replaced; anything kept per block would be 200 times itself.
+        passed = kept < 1024 and transient < MAX_TRANSIENT_BYTES
+        ok &= passed
+        print(f"  chain on {size}-sample blocks: {kept} bytes kept over 200 blocks, at most "
+              f"{transient} bytes in flight per block  {'ok' if passed else 'FAIL'}")
+    print("PASS" if ok else "FAIL")
+    return ok
+
+
+def run_benchmark(spec, seconds=BENCH_SECONDS):
+    """Per-block cost of a chain on a synthetic watch, at several block sizes,
+    and of a per-sample biquad for comparison."""
+    from synthetic_watch import WatchSignal
+    watch = WatchSignal(bph=28800, noise=0.05)
+    audio = watch.render(0, int(seconds * SAMPLE_RATE))
+    for block in BENCH_BLOCKS:
+        chain = DSPChain(spec)
+        for start in range(0, len(audio), block):
+            chain.process(audio[start:start + block])
+        print(f"  {block:5d}-sample blocks: {chain.report()}")
+    section = Biquad.highpass(200)
+    x = audio[:SAMPLE_RATE].astype(np.float64)
+    start = time.perf_counter()
+    _reference(section, x)
+    elapsed = time.perf_counter() - start
+    print(f"  per-sample Python biquad: {elapsed / (SAMPLE_RATE / 512) * 1e6:.0f} us per "
+          f"512 samples, {1 / elapsed:.0f}x real time")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Block DSP chain for the decoded stream.")
+    parser.add_argument('--chain', default='dc,highpass=200,bandpass=1000-10000,gate,gain=2',
+                        help="stages, e.g. 'dc,highpass=200,gate=-60,gain=2'")
+    parser.add_argument('--selfcheck', action='store_true',
+                        help="check the filters against per-sample references")
+    parser.add_argument('--bench', action='store_true', help="time the chain per block")
+    args = parser.parse_args()
+    if args.selfcheck:
+        raise SystemExit(0 if run_selfcheck() else 1)
+    if args.bench:
+        run_benchmark(args.chain)
+    else:
+        parser.print_help()
@@ -0,0 +1,907 @@
+# framing.py
+import binascii
+import sys
+import time
+import numpy as np
+
+# --- Framing Protocol ---
+SOF_MARKER = b'\xAA\x55'
+PAYLOAD_SIZE = 512
+
+# --- Sequenced Framing Protocol ---
+# [AA 5A] [seq: uint16 LE] [payload: PAYLOAD_SIZE bytes] [crc: uint16 LE]
+# The CRC is CRC-16/CCITT-FALSE (poly 0x1021, init 0xFFFF) over seq + payload,
+# the same as `binascii.crc_hqx(data, 0xFFFF)`.
+SEQ_SOF_MARKER = b'\xAA\x5A'
+SEQ_SIZE = 2
+CRC_SIZE = 2
+CRC_INIT = 0xFFFF
+CRC_POLY = 0x1021
+
+# --- Packed Variants ---
+# The same two layouts, but each sample is sent as 3 bytes (24-bit little
+# endian) instead of 4, so a frame carrying PAYLOAD_SIZE // 4 samples is 25%
+# shorter. The markers tell the variants apart on the wire.
+# [AA 5B] [payload: 3 bytes per sample]
+# [AA 5C] [seq: uint16 LE] [payload: 3 bytes per sample] [crc: uint16 LE]
+PACKED_SOF_MARKER = b'\xAA\x5B'
+SEQ_PACKED_SOF_MARKER = b'\xAA\x5C'
+PACKED_SAMPLE_SIZE = 3
+
+PROTOCOL_BARE = 'bare'              # SOF + payload, what the current firmware sends
+PROTOCOL_SEQ = 'seq'                # SOF + sequence number + payload + CRC
+PROTOCOL_PACKED = 'packed'          # Like bare, 3 bytes per sample
+PROTOCOL_SEQ_PACKED = 'seq-packed'  # Like seq, 3 bytes per sample
+PROTOCOL_AUTO = 'auto'              # Pick whichever of the above we see on the wire
+PROTOCOL_RAW = 'raw'                # Bare 4-byte samples, no framing (unframed firmware, broker)
+RAW_SAMPLE_SIZE = 4
+
+# protocol: (marker, has sequence number and CRC, packed)
+FRAMED_PROTOCOLS = {
+    PROTOCOL_SEQ: (SEQ_SOF_MARKER, True, False),
+    PROTOCOL_SEQ_PACKED: (SEQ_PACKED_SOF_MARKER, True, True),
+    PROTOCOL_PACKED: (PACKED_SOF_MARKER, False, True),
+    PROTOCOL_BARE: (SOF_MARKER, False, False),
+}
+
+# Gaps up to this many frames are filled with silence so the sample clock
+# stays continuous. Anything bigger is treated as a device restart.
+MAX_CONCEALED_FRAMES = 64
+# How many bytes we look at before giving up on auto-detection and falling
+# back to the bare protocol.
+DETECT_LIMIT = 8192
+DETECT_CONFIRMATIONS = 3
+
+# --- Reader Configuration ---
+# How many bytes we ask the port for at most in one call. At 2 Mbaud this is
+# roughly 80ms of data, which keeps the number of Python-level calls tiny.
+READ_SIZE = 16384
+
+# --- Benchmark Configuration ---
+BENCH_INPUT_FILENAME = 'raw_audio_misaligned.bin'
+BENCH_REPEATS = 20
+
+
+def decode_samples(payloads):
+    """Turns a block of raw payload bytes into sign-extended int32 samples.
+
+    The bytes are reinterpreted as little-endian int32 without copying (when
+    the block is contiguous) and the 24-bit sign extension is done in place.
+    """
+    raw_samples = np.ascontiguousarray(payloads).view('<i4').reshape(-1)
+    raw_samples <<= 8
+    raw_samples >>= 8
+    return raw_samples
+
+
+def pack_int24(samples, out=None):
+    """Packs int32 samples into 3 little-endian bytes each (drops the sign byte)."""
+    samples = np.ascontiguousarray(samples, dtype='<i4')
+    if out is None:
+        out = np.empty(len(samples) * 3, dtype=np.uint8)
+    out.reshape(-1, 3)[:] = samples.view(np.uint8).reshape(-1, 4)[:, :3]
+    return out
+
+
+def unpack_int24(data, out=None):
+    """Inverse of `pack_int24`: 3-byte little-endian samples to sign-extended int32.
+
+    Sample i is read as the 4 bytes starting at 3*i through a strided int32
+    view, so the next sample's first byte lands in the top byte; shifting
+    left by 8 and back drops it and sign-extends, in two vectorised passes.
+    """
+    packed = np.frombuffer(data, dtype=np.uint8)
+    count = len(packed) // PACKED_SAMPLE_SIZE
+    if out is None:
+        out = np.empty(count, dtype='<i4')
+    if count == 0:
+        return out
+    if count > 1:
+        windows = np.ndarray((count - 1,), dtype='<i4', buffer=packed, strides=(PACKED_SAMPLE_SIZE,))
+        np.left_shift(windows, 8, out=out[:-1])
+    # The last sample has no byte after it to borrow.
+    last = np.zeros(RAW_SAMPLE_SIZE, dtype=np.uint8)
+    last[1:] = packed[(count - 1) * PACKED_SAMPLE_SIZE:count * PACKED_SAMPLE_SIZE]
+    out[-1:] = last.view('<i4')
+    out >>= 8
+    return out
+
+
+class FrameSync:
+    """Finds SOF-framed payloads in a byte stream, in bulk.
+
+    Data is read into one reusable buffer. While we are in sync every frame
+    boundary in the buffer is checked at once with a strided NumPy view; only
+    after a sync loss do we fall back to `bytearray.find` to hunt for the next
+    marker. A frame is normally accepted once the marker of the *next* frame
+    has been seen at the expected position, so truncated frames are dropped
+    instead of shifting every later sample. When that marker is missing (it
+    was damaged, or junk follows), a frame with an intact marker of its own
+    is still accepted if it stands alone: `body_check` passes it (the CRC,
+    for the sequenced protocols) or, without one, no other marker starts
+    inside it, which would mean it was cut short. Partial frames are carried
+    over to the next read; `flush` returns the last frame at end of input.
+    """
+
+    def __init__(self, read_size=READ_SIZE, sof_marker=SOF_MARKER, payload_size=PAYLOAD_SIZE,
+                 body_check=None):
+        self.sof_marker = bytes(sof_marker)
+        self.payload_size = payload_size
+        self.frame_size = len(self.sof_marker) + payload_size
+        self.read_size = read_size
+        self.body_check = body_check  # (frames, payload_size) rows -> bool per row
+
+        # Room for one full read plus a couple of frames carried over.
+        self._buf = bytearray(read_size + 2 * self.frame_size + len(self.sof_marker))
+        self._view = memoryview(self._buf)
+        self._array = np.frombuffer(self._buf, dtype=np.uint8)
+        self._fill = 0
+        self._locked = False
+
+        # --- Statistics ---
+        self.bytes_in = 0
+        self.frames = 0
+        self.resyncs = 0
+        self.dropped_frames = 0
+        self.discarded_bytes = 0
+        self._start_time = time.perf_counter()
+
+    def read_from(self, port, size=None):
+        """Reads up to `size` bytes from `port` straight into the buffer.
+
+        `port` is anything with a `readinto` method (a `serial.Serial`, a file,
+        a socket file). Returns the complete payloads found, see `_scan`.
+        """
+        size = self.read_size if size is None else min(size, self.read_size)
+        n = port.readinto(self._view[self._fill:self._fill + size])
+        if n:
+            self._fill += n
+            self.bytes_in += n
+        return self._scan()
+
+    def feed(self, data):
+        """Pushes a bytes-like object through the synchroniser.
+
+        Returns the payloads found as a (frames, PAYLOAD_SIZE) uint8 array.
+        """
+        data = memoryview(data).cast('B')
+        found = []
+        while len(data):
+            n = min(len(data), self.read_size)
+            self._view[self._fill:self._fill + n] = data[:n]
+            self._fill += n
+            self.bytes_in += n
+            data = data[n:]
+            payloads = self._scan()
+            if len(payloads):
+                found.append(payloads)
+        if not found:
+            return self._empty()
+        return found[0] if len(found) == 1 else np.concatenate(found)
+
+    def flush(self):
+        """End of input: returns the frames still held back (no marker will
+        follow them now) and empties the buffer."""
+        marker = self.sof_marker
+        marker_len = len(marker)
+        pos = 0
+        found = []
+        while self._fill - pos >= self.frame_size:
+            if self._buf[pos:pos + marker_len] == marker:
+                if self._stands_alone(pos):
+                    found.append(self._array[pos + marker_len:pos + self.frame_size].copy())
+                    self.frames += 1
+                    pos += self.frame_size
+                    continue
+                self.dropped_frames += 1
+            idx = self._buf.find(marker, pos + 1, self._fill)
+            new_pos = self._fill if idx < 0 else idx
+            self.discarded_bytes += new_pos - pos
+            pos = new_pos
+        self.discarded_bytes += self._fill - pos
+        self._fill = 0
+        self._locked = False
+        if not found:
+            return self._empty()
+        return np.stack(found)
+
+    def _empty(self):
+        return np.empty((0, self.payload_size), dtype=np.uint8)
+
+    def _stands_alone(self, pos):
+        """Whether the frame at `pos` (its marker intact, the next one not
+        in place) can be trusted on its own, see the class docstring."""
+        marker_len = len(self.sof_marker)
+        if self.body_check is not None:
+            body = self._array[pos + marker_len:pos + self.frame_size]
+            return bool(self.body_check(body[np.newaxis])[0])
+        end = min(pos + self.frame_size + marker_len - 1, self._fill)
+        return self._buf.find(self.sof_marker, pos + 1, end) < 0
+
+    def _hunt(self, pos):
+        """Searches for a confirmed marker at or after `pos`.
+
+        Returns the new position and whether we are locked. A candidate marker
+        only counts if a second marker follows exactly one frame later, which
+        keeps `\\xAA\\x55` byte pairs inside the audio from locking us.
+        """
+        marker = self.sof_marker
+        marker_len = len(marker)
+        while True:
+            idx = self._buf.find(marker, pos, self._fill)
+            if idx < 0:
+                # Keep a trailing byte that could be the start of a marker.
+                keep = marker_len - 1
+                new_pos = max(pos, self._fill - keep)
+                self.discarded_bytes += new_pos - pos
+                return new_pos, False
+            self.discarded_bytes += idx - pos
+            pos = idx
+            confirm = pos + self.frame_size
+            if confirm + marker_len > self._fill:
+                return pos, False  # Need more data to confirm this candidate.
+            if self._buf[confirm:confirm + marker_len] == marker or self._stands_alone(pos):
+                self.resyncs += 1
+                return pos, True
+            pos += 1
+            self.discarded_bytes += 1
+
+    def _scan(self):
+        """Extracts every confirmed frame currently in the buffer."""
+        frame_size = self.frame_size
+        marker_len = len(self.sof_marker)
+        pos = 0
+        found = []
+
+        while self._fill - pos >= frame_size:
+            if not self._locked:
+                pos, self._locked = self._hunt(pos)
+                if not self._locked:
+                    break
+
+            # --- Bulk path: check every frame boundary in one go ---
+            n = (self._fill - pos) // frame_size
+            frames = self._array[pos:pos + n * frame_size].reshape(n, frame_size)
+            marker_ok = np.ones(n, dtype=bool)
+            for i, value in enumerate(self.sof_marker):
+                marker_ok &= frames[:, i] == value
+
+            # Frame i is confirmed if its own marker and the next one are in
+            # place. The marker following the last whole frame may already be
+            # in the buffer as well.
+            tail = pos + n * frame_size
+            if tail + marker_len <= self._fill:
+                next_ok = self._buf[tail:tail + marker_len] == self.sof_marker
+                confirmed = marker_ok & np.append(marker_ok[1:], next_ok)
+            else:
+                confirmed = marker_ok[:-1] & marker_ok[1:]
+
+            bad = np.flatnonzero(~confirmed)
+            good = len(confirmed) if len(bad) == 0 else int(bad[0])
+            lost = good < len(confirmed)
+            alone = lost and marker_ok[good] and self._stands_alone(pos + good * frame_size)
+            if alone:
+                good += 1  # The damage is after this frame, not in it.
+            if good:
+                found.append(frames[:good, marker_len:].copy())
+                self.frames += good
+                pos += good * frame_size
+
+            if alone:
+                self._locked = False
+                continue
+            if lost:
+                # Sync lost: the frame at `pos` is truncated or corrupt.
+                self.dropped_frames += 1
+                self.discarded_bytes += marker_len
+                pos += marker_len
+                self._locked = False
+                continue
+            break  # Waiting for the marker that confirms the last frame.
+
+        # Carry the unprocessed tail over to the next read.
+        if pos:
+            remaining = self._fill - pos
+            self._buf[:remaining] = self._buf[pos:self._fill]
+            self._fill = remaining
+
+        if not found:
+            return self._empty()
+        return found[0] if len(found) == 1 else np.concatenate(found)
+
+    def frames_per_second(self):
+        elapsed = time.perf_counter() - self._start_time
+        return self.frames / elapsed if elapsed > 0 else 0.0
+
+    def stats(self):
+        """Returns a snapshot of the counters as a plain dict."""
+        return {
+            'bytes_in': self.bytes_in,
+            'frames': self.frames,
+            'frames_per_second': self.frames_per_second(),
+            'resyncs': self.resyncs,
+            'dropped_frames': self.dropped_frames,
+            'discarded_bytes': self.discarded_bytes,
+        }
+
+    def report(self):
+        s = self.stats()
+        return (f"{s['frames']} frames ({s['frames_per_second']:.0f} frames/s), "
+                f"{s['resyncs']} resyncs, {s['dropped_frames']} dropped, "
+                f"{s['discarded_bytes']} bytes discarded")
+
+
+def capture_payloads(data, **kwargs):
+    """Every payload of a complete SOF-framed capture, the last one included.
+
+    `kwargs` go to FrameSync.
+    """
+    sync = FrameSync(**kwargs)
+    payloads = sync.feed(data)
+    last = sync.flush()
+    return np.concatenate((payloads, last)) if len(last) else payloads
+
+
+class RawSampleSync:
+    """Stand-in for FrameSync on unframed streams of 4-byte samples.
+
+    Returns whole samples as (samples, 4) uint8 rows and carries an
+    incomplete sample over to the next read. There is nothing to resync:
+    the stream is assumed to start on a sample boundary.
+    """
+
+    def __init__(self, read_size=READ_SIZE, sample_size=RAW_SAMPLE_SIZE):
+        self.frame_size = self.payload_size = sample_size
+        self.read_size = read_size
+        self._buf = bytearray(read_size + sample_size)
+        self._view = memoryview(self._buf)
+        self._array = np.frombuffer(self._buf, dtype=np.uint8)
+        self._fill = 0
+
+        # --- Statistics ---
+        self.bytes_in = 0
+        self.frames = 0
+        self._start_time = time.perf_counter()
+
+    def read_from(self, port, size=None):
+        size = self.read_size if size is None else min(size, self.read_size)
+        n = port.readinto(self._view[self._fill:self._fill + size])
+        if n:
+            self._fill += n
+            self.bytes_in += n
+        return self._scan()
+
+    def feed(self, data):
+        data = memoryview(data).cast('B')
+        found = []
+        while len(data):
+            n = min(len(data), self.read_size)
+            self._view[self._fill:self._fill + n] = data[:n]
+            self._fill += n
+            self.bytes_in += n
+            data = data[n:]
+            found.append(self._scan())
+        if not found:
+            return np.empty((0, self.frame_size), dtype=np.uint8)
+        return found[0] if len(found) == 1 else np.concatenate(found)
+
+    def flush(self):
+        """End of input: an incomplete last sample is dropped."""
+        self._fill = 0
+        return np.empty((0, self.frame_size), dtype=np.uint8)
+
+    def _scan(self):
+        n = self._fill // self.frame_size
+        end = n * self.frame_size
+        samples = self._array[:end].reshape(n, self.frame_size).copy()
+        self._buf[:self._fill - end] = self._buf[end:self._fill]
+        self._fill -= end
+        self.frames += n
+        return samples
+
+    def frames_per_second(self):
+        elapsed = time.perf_counter() - self._start_time
+        return self.frames / elapsed if elapsed > 0 else 0.0
+
+    def stats(self):
+        return {'bytes_in': self.bytes_in, 'frames': self.frames,
+                'frames_per_second': self.frames_per_second()}
+
+    def report(self):
+        return f"{self.frames} samples ({self.frames_per_second():.0f} samples/s)"
+
+
+# --- Sequence Numbers and CRC ---
+
+_crc_tables = {}
+
+def _positional_crc_table(length):
+    """Returns a (length, 256) table of per-position CRC contributions.
+
+    The CRC is linear over GF(2), so for messages of a fixed length it is the
+    XOR of one table entry per byte plus the contribution of the init value.
+    That lets us check a whole block of frames with one gather and one reduce
+    instead of a Python loop over frames or bytes.
+    """
+    if length in _crc_tables:
+        return _crc_tables[length]
+
+    byte_table = np.zeros(256, dtype=np.uint16)
+    for value in range(256):
+        crc = value << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ CRC_POLY) if crc & 0x8000 else (crc << 1)
+        byte_table[value] = crc & 0xFFFF
+
+    def shift_zero_byte(crc):
+        return ((crc << 8) & 0xFFFF) ^ byte_table[crc >> 8]
+
+    table = np.empty((length, 256), dtype=np.uint16)
+    table[length - 1] = byte_table
+    for position in range(length - 2, -1, -1):
+        table[position] = shift_zero_byte(table[position + 1])
+
+    # Contribution of the init value after `length` zero bytes.
+    init = np.array([CRC_INIT], dtype=np.uint16)
+    for _ in range(length):
+        init = shift_zero_byte(init)
+
+    _crc_tables[length] = (table, int(init[0]))
+    return _crc_tables[length]
+
+
+def crc16_rows(rows):
+    """CRC-16/CCITT-FALSE of every row of a 2-D uint8 array, vectorized."""
+    table, init = _positional_crc_table(rows.shape[1])
+    contributions = table[np.arange(rows.shape[1]), rows]
+    return np.bitwise_xor.reduce(contributions, axis=1) ^ np.uint16(init)
+
+
+def crc_ok(bodies):
+    """Per row of sequenced frame bodies (seq + payload + CRC): does the CRC match?"""
+    return crc16_rows(bodies[:, :-CRC_SIZE]) == (
+        bodies[:, -2].astype(np.uint16) | (bodies[:, -1].astype(np.uint16) << 8))
+
+
+def wire_payload_size(protocol, payload_size=PAYLOAD_SIZE):
+    """Payload bytes on the wire for frames that decode to `payload_size` bytes."""
+    packed = FRAMED_PROTOCOLS.get(protocol, (None, False, False))[2]
+    return payload_size // RAW_SAMPLE_SIZE * PACKED_SAMPLE_SIZE if packed else payload_size
+
+
+def _encode(payloads, marker, sequenced, first_seq):
+    payloads = np.asarray(payloads, dtype=np.uint8)
+    n, payload_size = payloads.shape
+    marker_len = len(marker)
+    header, trailer = (SEQ_SIZE, CRC_SIZE) if sequenced else (0, 0)
+    frames = np.empty((n, marker_len + header + payload_size + trailer), dtype=np.uint8)
+    frames[:, :marker_len] = np.frombuffer(marker, dtype=np.uint8)
+    frames[:, marker_len + header:marker_len + header + payload_size] = payloads
+    if sequenced:
+        seq = (np.arange(n) + first_seq) & 0xFFFF
+        frames[:, marker_len] = seq & 0xFF
+        frames[:, marker_len + 1] = seq >> 8
+        crc = crc16_rows(frames[:, marker_len:-CRC_SIZE])
+        frames[:, -2] = crc & 0xFF
+        frames[:, -1] = crc >> 8
+    return frames.tobytes()
+
+
+def encode_sequenced_frames(payloads, first_seq=0):
+    """Reference encoder for the sequenced protocol.
+
+    `payloads` is a (frames, PAYLOAD_SIZE) uint8 array. Returns the wire bytes.
+    """
+    return _encode(payloads, SEQ_SOF_MARKER, True, first_seq)
+
+
+def encode_frames(samples, protocol, samples_per_frame=PAYLOAD_SIZE // RAW_SAMPLE_SIZE, first_seq=0):
+    """Reference encoder for every framed protocol.
+
+    `samples` are int32 24-bit samples, a whole number of frames' worth.
+    Returns the wire bytes.
+    """
+    marker, sequenced, packed = FRAMED_PROTOCOLS[protocol]
+    samples = np.ascontiguousarray(samples, dtype='<i4')
+    if packed:
+        payloads = pack_int24(samples).reshape(-1, samples_per_frame * PACKED_SAMPLE_SIZE)
+    else:
+        payloads = samples.view(np.uint8).reshape(-1, samples_per_frame * RAW_SAMPLE_SIZE)
+    return _encode(payloads, marker, sequenced, first_seq)
+
+
+def detect_protocol(data, payload_size=PAYLOAD_SIZE):
+    """Looks for a run of correctly spaced markers of any framed protocol.
+
+    Returns one of FRAMED_PROTOCOLS, or None if none is certain yet.
+    """
+    for protocol, (marker, sequenced, _) in FRAMED_PROTOCOLS.items():
+        body_size = wire_payload_size(protocol, payload_size)
+        if sequenced:
+            body_size += SEQ_SIZE + CRC_SIZE
+        frame_size = len(marker) + body_size
+        idx = data.find(marker)
+        while idx >= 0 and idx + DETECT_CONFIRMATIONS * frame_size + len(marker) <= len(data):
+            if all(data[idx + k * frame_size:idx + k * frame_size + len(marker)] == marker
+                   for k in range(1, DETECT_CONFIRMATIONS + 1)):
+                return protocol
+            idx = data.find(marker, idx + 1)
+    return None
+
+
+class FrameDecoder:
+    """Turns the serial byte stream into validated payload blocks.
+
+    Speaks the bare SOF protocol, the sequenced protocol and their packed
+    variants (and can detect which one the device sends). PROTOCOL_RAW passes
+    unframed 4-byte samples through as (samples, 4) rows. For the sequenced
+    protocols, frames with a bad CRC are discarded and counted as corrupt,
+    sequence numbers that never arrived at all are counted as lost, and
+    every missing frame of either kind is replaced (and counted as
+    concealed) by a payload of silence so later samples stay at the right position in
+    time. Packed payloads are widened to 4 bytes per sample, so whatever the
+    protocol, the output is (frames, payload_size) rows for `decode_samples`.
+    """
+
+    def __init__(self, protocol=PROTOCOL_AUTO, payload_size=PAYLOAD_SIZE, read_size=READ_SIZE,
+                 max_concealed_frames=MAX_CONCEALED_FRAMES):
+        self.payload_size = payload_size
+        self.read_size = read_size
+        self.max_concealed_frames = max_concealed_frames
+        self.protocol = None
+        self.sync = None
+        self.sequenced = False
+        self.packed = False
+        self.wire_payload_size = payload_size
+        self._pending = bytearray()
+        self._expected_seq = None
+        self._corrupt_pending = 0   # Corrupt frames since the last valid one
+
+        # --- Statistics ---
+        self.valid_frames = 0
+        self.corrupt_frames = 0
+        self.lost_frames = 0
+        self.concealed_frames = 0
+        self.discontinuities = 0
+
+        if protocol != PROTOCOL_AUTO:
+            self._start(protocol)
+
+    def _start(self, protocol):
+        self.protocol = protocol
+        if protocol == PROTOCOL_RAW:
+            self.sync = RawSampleSync(self.read_size)
+            return
+        marker, self.sequenced, self.packed = FRAMED_PROTOCOLS[protocol]
+        self.wire_payload_size = wire_payload_size(protocol, self.payload_size)
+        body_size = self.wire_payload_size
+        if self.sequenced:
+            body_size += SEQ_SIZE + CRC_SIZE
+        self.sync = FrameSync(self.read_size, marker, body_size,
+                              body_check=crc_ok if self.sequenced else None)
+
+    @property
+    def frame_size(self):
+        if self.sync is None:
+            return len(SOF_MARKER) + self.payload_size
+        return self.sync.frame_size
+
+    @property
+    def bytes_in(self):
+        """Bytes taken from the port (or fed) so far."""
+        return self.sync.bytes_in if self.sync is not None else len(self._pending)
+
+    def read_from(self, port, size=None):
+        """Reads from `port` and returns validated (frames, payload) uint8 rows."""
+        if self.sync is None:
+            buf = bytearray(size or self.read_size)
+            n = port.readinto(buf) or 0
+            return self.feed(memoryview(buf)[:n])
+        return self._validate(self.sync.read_from(port, size))
+
+    def feed(self, data):
+        """Pushes a bytes-like object through the decoder."""
+        if self.sync is None:
+            self._pending += memoryview(data).cast('B')
+            protocol = detect_protocol(self._pending, self.payload_size)
+            if protocol is None:
+                if len(self._pending) < DETECT_LIMIT:
+                    return np.empty((0, self.payload_size), dtype=np.uint8)
+                protocol = PROTOCOL_BARE
+            self._start(protocol)
+            data, self._pending = bytes(self._pending), bytearray()
+        return self._validate(self.sync.feed(data))
+
+    def flush(self):
+        """End of input: returns the frames still held back. Input too short
+        to detect the protocol from is decoded as the bare protocol."""
+        if self.sync is None:
+            if not self._pending:
+                return np.empty((0, self.payload_size), dtype=np.uint8)
+            self._start(detect_protocol(self._pending, self.payload_size) or PROTOCOL_BARE)
+            data, self._pending = bytes(self._pending), bytearray()
+            first = self._validate(self.sync.feed(data))
+            last = self._validate(self.sync.flush())
+            return np.concatenate((first, last)) if len(first) else last
+        return self._validate(self.sync.flush())
+
+    def _validate(self, bodies):
+        if not self.sequenced or len(bodies) == 0:
+            self.valid_frames += len(bodies)
+            return self._widen(bodies) if self.packed else bodies
+        return self._widen(self._check_sequence(bodies)) if self.packed else self._check_sequence(bodies)
+
+    def _widen(self, payloads):
+        """Packed 3-byte payloads to sign-extended 4-byte rows."""
+        samples = unpack_int24(np.ascontiguousarray(payloads).reshape(-1))
+        return samples.view(np.uint8).reshape(len(payloads), self.payload_size)
+
+    def _check_sequence(self, bodies):
+        payload_size = self.wire_payload_size
+
+        intact = crc_ok(bodies)
+        # Corrupt frames that arrived in front of each valid one: they fill
+        # part of the sequence gap it shows, and are not lost as well.
+        corrupt_before = None
+        if not intact.all():
+            self.corrupt_frames += int(np.count_nonzero(~intact))
+            valid = np.flatnonzero(intact)
+            if len(valid) == 0:
+                self._corrupt_pending += len(intact)
+                return np.empty((0, payload_size), dtype=np.uint8)
+            corrupt_before = np.empty(len(valid), dtype=np.int64)
+            corrupt_before[0] = valid[0] + self._corrupt_pending
+            corrupt_before[1:] = np.diff(valid) - 1
+            self._corrupt_pending = len(intact) - 1 - int(valid[-1])
+            bodies = bodies[intact]
+        elif self._corrupt_pending:
+            corrupt_before = np.zeros(len(bodies), dtype=np.int64)
+            corrupt_before[0] = self._corrupt_pending
+            self._corrupt_pending = 0
+        self.valid_frames += len(bodies)
+
+        # Number of frames missing in front of each received frame.
+        seq = bodies[:, 0].astype(np.int64) | (bodies[:, 1].astype(np.int64) << 8)
+        gaps = np.empty(len(seq), dtype=np.int64)
+        gaps[0] = 0 if self._expected_seq is None else (seq[0] - self._expected_seq) & 0xFFFF
+        gaps[1:] = (np.diff(seq) - 1) & 0xFFFF
+        self._expected_seq = int(seq[-1] + 1) & 0xFFFF
+
+        restarts = gaps > self.max_concealed_frames
+        if restarts.any():
+            self.discontinuities += int(np.count_nonzero(restarts))
+            gaps[restarts] = 0
+        missing = int(gaps.sum())
+        payloads = bodies[:, SEQ_SIZE:SEQ_SIZE + payload_size]
+        if missing == 0:
+            return np.ascontiguousarray(payloads)
+
+        if corrupt_before is None:
+            self.lost_frames += missing
+        else:
+            self.lost_frames += int(np.maximum(gaps - corrupt_before, 0).sum())
+        self.concealed_frames += missing
+        out = np.zeros((len(bodies) + missing, payload_size), dtype=np.uint8)
+        out[np.arange(len(bodies)) + np.cumsum(gaps)] = payloads
+        return out
+
+    def stats(self):
+        s = self.sync.stats() if self.sync is not None else {}
+        s.update({
+            'protocol': self.protocol,
+            'valid_frames': self.valid_frames,
+            'corrupt_frames': self.corrupt_frames,
+            'lost_frames': self.lost_frames,
+            'concealed_frames': self.concealed_frames,
+            'discontinuities': self.discontinuities,
+        })
+        return s
+
+    def report(self):
+        if self.sync is None:
+            return "protocol not detected yet"
+        text = f"[{self.protocol}] {self.sync.report()}"
+        if self.sequenced:
+            text += (f", {self.corrupt_frames} corrupt, {self.lost_frames} lost, "
+                     f"{self.concealed_frames} concealed, {self.discontinuities} restarts")
+        return text
+
+
+# --- Benchmark ---
+
+def build_benchmark_stream(raw_bytes, seed=0):
+    """Builds a framed test stream from a capture.
+
+    `raw_audio_misaligned.bin` is itself a SOF-framed capture, so its frames
+    are reused as they are. Every so often we add a synthetic defect: junk
+    bytes between frames, a truncated frame, or a frame with a damaged marker.
+    Returns the stream and the number of intact frames it contains.
+    """
+    rng = np.random.default_rng(seed)
+    marker = SOF_MARKER
+    frame_size = len(marker) + PAYLOAD_SIZE
+
+    start = raw_bytes.find(marker)
+    payloads = []
+    while start >= 0 and start + frame_size <= len(raw_bytes):
+        payloads.append(raw_bytes[start + len(marker):start + frame_size])
+        start = raw_bytes.find(marker, start + frame_size)
+    if not payloads:
+        # Not a framed capture: cut the raw bytes into payloads instead.
+        n = len(raw_bytes) // PAYLOAD_SIZE
+        payloads = [raw_bytes[i * PAYLOAD_SIZE:(i + 1) * PAYLOAD_SIZE] for i in range(n)]
+
+    parts = []
+    intact = 0
+    for payload in payloads:
+        defect = rng.random()
+        if defect < 0.01:
+            parts.append(rng.integers(0, 256, int(rng.integers(1, 64)), dtype=np.uint8).tobytes())
+        if defect < 0.005:
+            parts.append(marker + payload[:int(rng.integers(1, PAYLOAD_SIZE))])
+            continue
+        if 0.995 < defect:
+            parts.append(b'\x00' + marker[1:] + payload)
+            continue
+        parts.append(marker + payload)
+        intact += 1
+    return b''.join(parts), intact
+
+
+def legacy_find_sof_rate(stream, limit=200000):
+    """Measures the old byte-at-a-time marker hunt, for comparison."""
+    import io
+    port = io.BytesIO(stream[:limit])
+    sync_bytes = bytearray(2)
+    frames = 0
+    start = time.perf_counter()
+    while True:
+        new_byte = port.read(1)
+        if not new_byte:
+            break
+        sync_bytes.pop(0); sync_bytes.append(new_byte[0])
+        if sync_bytes == SOF_MARKER:
+            if len(port.read(PAYLOAD_SIZE)) == PAYLOAD_SIZE:
+                frames += 1
+    elapsed = time.perf_counter() - start
+    return port.tell() / elapsed / 1e6, frames
+
+
+def run_benchmark(filename=BENCH_INPUT_FILENAME, repeats=BENCH_REPEATS):
+    """Replays a capture through FrameSync and reports the throughput."""
+    import io
+    try:
+        with open(filename, 'rb') as f:
+            raw_bytes = f.read()
+    except FileNotFoundError:
+        print(f"Error: The file '{filename}' was not found.")
+        return None
+
+    stream, intact = build_benchmark_stream(raw_bytes)
+    print(f"Benchmark stream: {len(stream)} bytes, {intact} intact frames.")
+
+    sync = FrameSync()
+    total_frames = 0
+    start = time.perf_counter()
+    for _ in range(repeats):
+        port = io.BytesIO(stream)
+        while True:
+            payloads = sync.read_from(port)
+            total_frames += len(payloads)
+            if port.tell() == len(stream) and len(payloads) == 0:
+                total_frames += len(sync.flush())
+                break
+    elapsed = time.perf_counter() - start
+
+    mb_per_s = len(stream) * repeats / elapsed / 1e6
+    print(f"FrameSync: {mb_per_s:.1f} MB/s, {total_frames / elapsed:.0f} frames/s "
+          f"({mb_per_s * 1e6 / 200000:.0f}x a 2 Mbaud link)")
+    print(f"  {sync.report()}")
+    print(f"  Recovered {total_frames} of {intact * repeats} intact frames.")
+
+    legacy_mb_per_s, _ = legacy_find_sof_rate(stream)
+    print(f"Byte-at-a-time reader: {legacy_mb_per_s:.2f} MB/s")
+    return {'mb_per_s': mb_per_s, 'frames': total_frames, 'resyncs': sync.resyncs}
+
+
+def run_sequenced_benchmark(frames=20000, seed=1):
+    """Pushes a damaged sequenced stream through FrameDecoder.
+
+    Some frames are dropped, some get a flipped bit; one flip in four is in
+    the marker, so that frame never arrives as a frame at all. The decoder has to report both and still
+    return exactly one payload per transmitted frame.
+    """
+    import io
+    rng = np.random.default_rng(seed)
+    payloads = rng.integers(0, 256, (frames, PAYLOAD_SIZE), dtype=np.uint8)
+    wire = np.frombuffer(encode_sequenced_frames(payloads), dtype=np.uint8)
+    frame_size = wire.size // frames
+    wire = wire.reshape(frames, frame_size).copy()
+
+    # Sanity check the vectorized CRC against the stdlib implementation.
+    for row in wire[:4]:
+        body = row[len(SEQ_SOF_MARKER):-CRC_SIZE].tobytes()
+        assert binascii.crc_hqx(body, CRC_INIT) == int(row[-2]) | (int(row[-1]) << 8)
+
+    defects = rng.random(frames)
+    dropped = (defects < 0.002)
+    dropped[0] = dropped[-1] = False  # Gaps at the very edges cannot be seen.
+    corrupt = (defects > 0.998)
+    marker_len = len(SEQ_SOF_MARKER)
+    for k, i in enumerate(np.flatnonzero(corrupt)):
+        low, high = (0, marker_len) if k % 4 == 0 else (marker_len, frame_size)
+        byte = int(rng.integers(low, high))
+        wire[i, byte] ^= 1 << int(rng.integers(0, 8))
+    stream = wire[~dropped].tobytes()
+
+    decoder = FrameDecoder(PROTOCOL_AUTO)
+    port = io.BytesIO(stream)
+    out = []
+    start = time.perf_counter()
+    while True:
+        block = decoder.read_from(port, READ_SIZE)
+        out.append(block)
+        if port.tell() == len(stream) and len(block) == 0:
+            out.append(decoder.flush())
+            break
+    elapsed = time.perf_counter() - start
+    received = sum(len(block) for block in out)
+
+    print(f"FrameDecoder ({decoder.protocol}): {len(stream) / elapsed / 1e6:.1f} MB/s, "
+          f"{received / elapsed:.0f} frames/s")
+    print(f"  {decoder.report()}")
+    print(f"  Sent {frames} frames ({int(dropped.sum())} dropped, {int(corrupt.sum())} corrupted), "
+          f"decoder returned {received}  {'ok' if received == frames else 'MISMATCH'}")
+    # A damaged frame is counted once: as corrupt, or as lost if the flip
+    # hit its marker and it never arrived as a frame at all.
+    hit_marker = sum(1 for i in np.flatnonzero(corrupt) if bytes(wire[i, :marker_len]) != SEQ_SOF_MARKER)
+    print(f"  {hit_marker} of the flips hit a marker")
+    counted = decoder.corrupt_frames + decoder.lost_frames
+    print(f"  Corrupt + lost = {counted}, damaged frames sent = {int(dropped.sum() + corrupt.sum())}"
+          f"  {'ok' if counted == int(dropped.sum() + corrupt.sum()) else 'MISMATCH'}")
+    return {'mb_per_s': len(stream) / elapsed / 1e6, 'frames': received}
+
+
+def run_packed_benchmark(megasamples=4, repeats=5, seed=2):
+    """Decode cost per megasample of the packed format against the 4-byte one.
+
+    Times the bare sample conversion (`decode_samples` on 4-byte rows against
+    `unpack_int24` on 3-byte ones) and the whole FrameDecoder path, and checks
+    that every protocol gives back exactly the samples that were encoded.
+    """
+    rng = np.random.default_rng(seed)
+    samples_per_frame = PAYLOAD_SIZE // RAW_SAMPLE_SIZE
+    count = megasamples * (1 << 20) // samples_per_frame * samples_per_frame
+    samples = rng.integers(-(1 << 23), 1 << 23, count).astype('<i4')
+    mega = count / 1e6
+
+    def best_of(fn):
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - start)
+        return min(times) / mega * 1000  # ms per megasample
+
+    wide = samples.view(np.uint8).copy()
+    packed = pack_int24(samples)
+    print(f"Sample conversion ({megasamples} Msamples, best of {repeats}):")
+    print(f"  <i4 + sign extension: {best_of(lambda: decode_samples(wide.copy())):6.2f} ms/Msample "
+          f"(includes a copy, as decode_samples works in place)")
+    print(f"  packed 24-bit:        {best_of(lambda: unpack_int24(packed)):6.2f} ms/Msample")
+
+    print("Full FrameDecoder path:")
+    for protocol in (PROTOCOL_BARE, PROTOCOL_PACKED, PROTOCOL_SEQ, PROTOCOL_SEQ_PACKED):
+        wire = encode_frames(samples, protocol, samples_per_frame)
+        decoder = FrameDecoder(PROTOCOL_AUTO)
+        decoded = decode_samples(np.concatenate((decoder.feed(wire), decoder.flush())))
+        assert np.array_equal(decoded, samples)
+        cost = best_of(lambda: decode_samples(FrameDecoder(protocol).feed(wire)))
+        print(f"  {protocol:10} {len(wire) / mega / 1e6:5.2f} MB/Msample on the wire, "
+              f"{cost:6.2f} ms/Msample to decode")
+
+
+if __name__ == "__main__":
+    run_benchmark(sys.argv[1] if len(sys.argv) > 1 else BENCH_INPUT_FILENAME)
+    run_sequenced_benchmark()
+    run_packed_benchmark()
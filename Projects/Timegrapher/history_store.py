@@ -0,0 +1,618 @@
+# history_store.py
+import argparse
+import glob
+import json
+import os
+import struct
+import tempfile
+import time
+import tracemalloc
+import zlib
+import numpy as np
+
+# --- Configuration ---
+METRICS = ('rate', 'beat_error', 'amplitude', 'level')
+# Bucket length and how many buckets of each tier are kept in memory:
+# an hour of seconds, two days of minutes, a month of hours.
+TIERS = ((1, 3600), (60, 2880), (3600, 720))
+QUERY_POINTS = 3000         # Most buckets a query returns (two days of minutes)
+
+# --- Persistence ---
+# A store is a directory of segment files. Closed buckets of every tier are
+# appended in CRC-checked batches; a crash loses at most the last
+# FLUSH_BUCKETS seconds and the buckets still open. A segment is never
+# written to again once the store is reopened, so a torn batch can only be
+# at the end of one, where reading stops.
+SEGMENT_MAGIC = b'TGHIST\x01'
+SEGMENT_PATTERN = 'segment-*.tgh'
+SEGMENT_BYTES = 16 << 20
+FLUSH_BUCKETS = 10          # Finest-tier buckets written per batch
+FSYNC = False               # Also survive power loss, at a disk sync per batch
+BATCH_MAGIC = b'HB'
+BATCH_HEADER = struct.Struct('<2sHI')  # magic, records, CRC-32 of the records
+VERSION = 1
+
+# --- Self-check Configuration ---
+SELFCHECK_HOURS = 40
+SELFCHECK_BPH = 28800
+SELFCHECK_QUERY_MS = 1.0    # Whole-run chart query budget (best of the repeats)
+SELFCHECK_QUERY_REPEATS = 5
+
+
+def record_dtype(metrics):
+    """One closed bucket of any tier, as it is kept and written."""
+    m = len(metrics)
+    return np.dtype([('tier', 'u1'), ('start', '<f8'), ('count', '<u4', m),
+                     ('min', '<f8', m), ('max', '<f8', m), ('sum', '<f8', m)])
+
+
+class Series:
+    """Buckets returned by a query, oldest first. `count`, `min`, `max` and
+    `mean` have a column per metric; min, max and mean are NaN where a
+    bucket saw none of that metric."""
+
+    def __init__(self, metrics, seconds, records):
+        self.metrics = list(metrics)
+        self.seconds = seconds
+        self.start = records['start']
+        self.count = records['count']
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.mean = np.where(self.count > 0, records['sum'] / self.count, np.nan)
+        self.min = np.where(self.count > 0, records['min'], np.nan)
+        self.max = np.where(self.count > 0, records['max'], np.nan)
+
+    def __len__(self):
+        return len(self.start)
+
+    def column(self, name):
+        """(start, min, max, mean) of one metric."""
+        i = self.metrics.index(name)
+        return self.start, self.min[:, i], self.max[:, i], self.mean[:, i]
+
+
+class HistoryStore:
+    """Bounded-memory, multi-resolution history of derived measurements.
+
+    `add(t, rate=..., amplitude=...)` takes one set of values at wall-clock
+    time `t` (seconds, as from time.time()); metrics not given are simply
+    not counted. Values go into the open bucket of the finest tier; when
+    a bucket closes it goes into its tier's fixed ring and, merged as
+    count, min, max and sum, into the open bucket of the next tier, so
+    every tier is an exact roll-up of the one below. Memory is the rings,
+    whatever the length of the run; everything is also on disk, in the
+    segment files of `directory`, for ranges the rings no longer hold.
+
+    Reopening a directory picks the history up again: the rings are
+    refilled from disk and the coarser tiers' open buckets rebuilt from
+    the finer buckets written after them. With `readonly`, nothing is
+    written, so another process can chart a run in progress.
+    """
+
+    def __init__(self, directory, metrics=METRICS, tiers=TIERS, readonly=False,
+                 fsync=FSYNC):
+        self.directory = directory
+        self.readonly = readonly
+        self.fsync = fsync
+        self.added = 0
+        self.lost = 0               # Values older than their tier's open bucket
+        self.batches = 0
+        self.bytes_written = 0
+        self._segments = []         # (filename, first start, last start), any tier
+        self._first = None          # Start of the earliest finest-tier bucket
+        self._f = None
+        existing = sorted(glob.glob(os.path.join(directory, SEGMENT_PATTERN)))
+        if existing:
+            header = _read_header(existing[-1])
+            metrics, tiers = header['metrics'], [tuple(t) for t in header['tiers']]
+        elif readonly:
+            raise FileNotFoundError(f"No history in '{directory}'")
+        self.metrics = tuple(metrics)
+        self.tiers = tuple(tuple(t) for t in tiers)
+        self._index = {name: i for i, name in enumerate(self.metrics)}
+        self._dtype = record_dtype(self.metrics)
+
+        m = len(self.metrics)
+        self._rings = [np.zeros(capacity, dtype=self._dtype) for _, capacity in self.tiers]
+        self._written = [0] * len(self.tiers)
+        self._overflowed = [False] * len(self.tiers)  # Older buckets only on disk
+        # Open buckets: the finest as plain lists (it takes every value),
+        # the coarser ones as one record each.
+        self._open_start = [None] * len(self.tiers)
+        self._open = [np.zeros(1, dtype=self._dtype)[0] for _ in self.tiers]
+        self._count, self._min, self._max, self._sum = [0] * m, [0.0] * m, [0.0] * m, [0.0] * m
+        self._pending = []
+        self._pending_finest = 0
+
+        if existing:
+            self._recover(existing)
+        if not readonly:
+            os.makedirs(directory, exist_ok=True)
+            self._number = (int(os.path.basename(existing[-1])[8:-4]) + 1) if existing else 1
+            self._open_segment()
+
+    # --- Segments ---
+
+    def _segment_name(self, number):
+        return os.path.join(self.directory, f"segment-{number:06d}.tgh")
+
+    def _open_segment(self):
+        if self._f is not None:
+            self._f.close()
+        filename = self._segment_name(self._number)
+        self._number += 1
+        header = json.dumps({'version': VERSION, 'metrics': list(self.metrics),
+                             'tiers': [list(t) for t in self.tiers],
+                             'created': time.time()}).encode()
+        self._f = open(filename, 'xb')
+        self._f.write(SEGMENT_MAGIC + struct.pack('<I', len(header)) + header)
+        self._segment_bytes = self._f.tell()
+        self._segments.append([filename, None, None])
+
+    def _write_batch(self):
+        if not self._pending or self.readonly:
+            self._pending.clear()
+            return
+        pending = np.concatenate(self._pending)
+        records = pending.tobytes()
+        self._f.write(BATCH_HEADER.pack(BATCH_MAGIC, len(self._pending), zlib.crc32(records)))
+        self._f.write(records)
+        self._f.flush()
+        if self.fsync:
+            os.fsync(self._f.fileno())
+        segment = self._segments[-1]
+        segment[1] = float(pending['start'].min()) if segment[1] is None else segment[1]
+        segment[2] = float(pending['start'].max())
+        self.batches += 1
+        self.bytes_written += BATCH_HEADER.size + len(records)
+        self._segment_bytes += BATCH_HEADER.size + len(records)
+        self._pending.clear()
+        self._pending_finest = 0
+        if self._segment_bytes >= SEGMENT_BYTES:
+            self._open_segment()
+
+    def _recover(self, filenames):
+        """Refills the rings from disk and rebuilds the open buckets of the
+        coarser tiers from the finer buckets closed after them."""
+        records = []
+        for filename in filenames:
+            part = _read_records(filename, self._dtype)
+            if len(part):
+                self._segments.append([filename, float(part['start'].min()),
+                                       float(part['start'].max())])
+                records.append(part)
+        if not records:
+            return
+        records = np.concatenate(records)
+        by_tier = [np.sort(records[records['tier'] == i], order='start', kind='stable')
+                   for i in range(len(self.tiers))]
+        if len(by_tier[0]):
+            self._first = float(by_tier[0]['start'][0])
+        for i, tier_records in enumerate(by_tier):
+            capacity = len(self._rings[i])
+            tail = tier_records[-capacity:]
+            self._rings[i][:len(tail)] = tail
+            self._written[i] = len(tail)
+            self._overflowed[i] = len(tier_records) > capacity
+        # Coarsest first, so buckets closed by the replay cascade into tiers
+        # whose own replay is already done.
+        for i in range(len(self.tiers) - 1, 0, -1):
+            seconds = self.tiers[i][0]
+            closed = by_tier[i]
+            after = closed['start'][-1] + seconds if len(closed) else -np.inf
+            finer = by_tier[i - 1]
+            for record in finer[finer['start'] >= after]:
+                self._roll(i, record)
+
+    # --- Adding values ---
+
+    def add(self, t, **values):
+        """One set of measurements at time `t`; None values are skipped."""
+        seconds = self.tiers[0][0]
+        start = self._open_start[0]
+        if start is None or t >= start + seconds:
+            if start is not None:
+                self._close_finest()
+            self._open_start[0] = t - t % seconds
+            if self._first is None:
+                self._first = self._open_start[0]
+        elif t < start:
+            self.lost += 1
+            return
+        count, low, high, total = self._count, self._min, self._max, self._sum
+        for name, value in values.items():
+            if value is None:
+                continue
+            i = self._index[name]
+            if count[i] == 0:
+                low[i] = high[i] = value
+            elif value < low[i]:
+                low[i] = value
+            elif value > high[i]:
+                high[i] = value
+            count[i] += 1
+            total[i] += value
+        self.added += 1
+
+    def _close_finest(self):
+        record = (0, self._open_start[0], self._count, self._min, self._max, self._sum)
+        self._store(0, record)
+        m = len(self.metrics)
+        self._count, self._min, self._max, self._sum = [0] * m, [0.0] * m, [0.0] * m, [0.0] * m
+        self._pending_finest += 1
+        if self._pending_finest >= FLUSH_BUCKETS:
+            self._write_batch()
+
+    def _store(self, tier, record):
+        """A closed bucket: into its ring, the next batch and the next tier."""
+        ring = self._rings[tier]
+        slot = self._written[tier] % len(ring)
+        ring[slot] = record
+        self._written[tier] += 1
+        self._overflowed[tier] |= self._written[tier] > len(ring)
+        self._pending.append(ring[slot:slot + 1].copy())
+        if tier + 1 < len(self.tiers):
+            self._roll(tier + 1, ring[slot])
+
+    def _roll(self, tier, record):
+        """Merges a closed bucket of the tier below into this tier's open one."""
+        seconds = self.tiers[tier][0]
+        start = self._open_start[tier]
+        if start is not None and record['start'] >= start + seconds:
+            self._close(tier)
+            start = None
+        if start is None:
+            start = self._open_start[tier] = record['start'] - record['start'] % seconds
+            self._open[tier]['count'] = 0
+            self._open[tier]['min'] = np.inf
+            self._open[tier]['max'] = -np.inf
+            self._open[tier]['sum'] = 0
+        bucket = self._open[tier]
+        seen = record['count'] > 0
+        bucket['count'] += record['count']
+        bucket['sum'] += record['sum']
+        bucket['min'] = np.where(seen, np.minimum(bucket['min'], record['min']), bucket['min'])
+        bucket['max'] = np.where(seen, np.maximum(bucket['max'], record['max']), bucket['max'])
+
+    def _close(self, tier):
+        bucket = self._open[tier]
+        empty = bucket['count'] == 0
+        self._store(tier, (tier, self._open_start[tier], bucket['count'],
+                           np.where(empty, 0, bucket['min']), np.where(empty, 0, bucket['max']),
+                           bucket['sum']))
+        self._open_start[tier] = None
+
+    def flush(self):
+        """Writes the buckets closed so far (the open ones stay open)."""
+        self._write_batch()
+
+    def close(self):
+        """Closes every open bucket and writes them out."""
+        if self.readonly:
+            return
+        if self._open_start[0] is not None:
+            self._close_finest()
+        for tier in range(1, len(self.tiers)):
+            if self._open_start[tier] is not None:
+                self._close(tier)
+        self._write_batch()
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # --- Queries ---
+
+    def _ring(self, tier):
+        """The tier's buckets still in memory, oldest first."""
+        ring, written = self._rings[tier], self._written[tier]
+        if written <= len(ring):
+            return ring[:written]
+        split = written % len(ring)
+        return np.concatenate((ring[split:], ring[:split]))
+
+    def _open_record(self, tier):
+        """The tier's open bucket as a record, if it holds anything."""
+        if self._open_start[tier] is None:
+            return None
+        record = np.zeros(1, dtype=self._dtype)
+        if tier == 0:
+            record[0] = (0, self._open_start[0], self._count, self._min, self._max, self._sum)
+        else:
+            bucket = self._open[tier]
+            empty = bucket['count'] == 0
+            record[0] = (tier, self._open_start[tier], bucket['count'],
+                         np.where(empty, 0, bucket['min']), np.where(empty, 0, bucket['max']),
+                         bucket['sum'])
+        return record
+
+    def _disk(self, tier, t0, t1):
+        """The tier's buckets in [t0, t1) from the segment files."""
+        parts = []
+        for filename, first, last in self._segments:
+            if first is None or last < t0 - self.tiers[tier][0] or first >= t1:
+                continue
+            records = _read_records(filename, self._dtype)
+            records = records[(records['tier'] == tier) & (records['start'] >= t0)
+                              & (records['start'] < t1)]
+            parts.append(records)
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=self._dtype)
+
+    def span(self):
+        """(first, last) time the history covers, or None if it is empty."""
+        if self._first is None:
+            return None
+        finest = self._ring(0)
+        last = max([s for s in (self._open_start[0],) if s is not None]
+                   + ([finest['start'][-1]] if len(finest) else []))
+        return self._first, last + self.tiers[0][0]
+
+    def query(self, t0=None, t1=None, tier=None, max_points=QUERY_POINTS):
+        """Buckets overlapping [t0, t1), from the finest tier that needs no
+        more than `max_points` of them (or `tier`, an index into TIERS).
+        Memory is used where the ring still reaches back far enough, the
+        segment files for the rest; the open bucket comes last. If even the
+        coarsest tier has too many buckets, neighbours are merged."""
+        span = self.span()
+        if span is None:
+            return Series(self.metrics, self.tiers[0][0], np.zeros(0, dtype=self._dtype))
+        t0 = span[0] if t0 is None else t0
+        t1 = span[1] if t1 is None else t1
+        if tier is None:
+            tier = next((i for i, (seconds, _) in enumerate(self.tiers)
+                         if (t1 - t0) / seconds <= max_points), len(self.tiers) - 1)
+        seconds = self.tiers[tier][0]
+        lo = t0 - t0 % seconds
+        memory = self._ring(tier)
+        memory = memory[(memory['start'] >= lo) & (memory['start'] < t1)]
+        parts = []
+        if self._overflowed[tier] and (not len(memory) or memory['start'][0] > lo):
+            parts.append(self._disk(tier, lo, memory['start'][0] if len(memory) else t1))
+        parts.append(memory)
+        open_record = self._open_record(tier)
+        if open_record is not None and lo <= open_record['start'][0] < t1:
+            parts.append(open_record)
+        records = np.concatenate(parts)
+        group = -(-len(records) // max_points) if max_points else 1
+        if group > 1:
+            records = _regroup(records, group)
+            seconds *= group
+        return Series(self.metrics, seconds, records)
+
+    def memory_bytes(self):
+        return sum(ring.nbytes for ring in self._rings)
+
+    def report(self):
+        span = self.span()
+        covered = f"{(span[1] - span[0]) / 3600:.1f} h" if span else "empty"
+        return (f"history {covered} in '{self.directory}': {self.added} values, "
+                f"{len(self._segments)} segments, {self.bytes_written / 1e6:.1f} MB written "
+                f"this run, {self.memory_bytes() / 1e6:.1f} MB in memory"
+                f"{f', {self.lost} out of order' if self.lost else ''}")
+
+
+def _read_header(filename):
+    with open(filename, 'rb') as f:
+        head = f.read(len(SEGMENT_MAGIC) + 4)
+        if head[:len(SEGMENT_MAGIC)] != SEGMENT_MAGIC:
+            raise ValueError(f"'{filename}' is not a history segment")
+        length, = struct.unpack('<I', head[len(SEGMENT_MAGIC):])
+        return json.loads(f.read(length))
+
+
+def _read_records(filename, dtype):
+    """Every whole, intact batch of a segment; stops at a torn one."""
+    with open(filename, 'rb') as f:
+        data = f.read()
+    length, = struct.unpack_from('<I', data, len(SEGMENT_MAGIC))
+    offset = len(SEGMENT_MAGIC) + 4 + length
+    parts = []
+    while offset + BATCH_HEADER.size <= len(data):
+        magic, count, crc = BATCH_HEADER.unpack_from(data, offset)
+        start = offset + BATCH_HEADER.size
+        end = start + count * dtype.itemsize
+        if magic != BATCH_MAGIC or end > len(data) or zlib.crc32(data[start:end]) != crc:
+            break
+        parts.append(np.frombuffer(data, dtype=dtype, count=count, offset=start))
+        offset = end
+    return np.concatenate(parts) if parts else np.zeros(0, dtype=dtype)
+
+
+def _regroup(records, group):
+    """Merges each run of `group` records into one."""
+    edges = np.arange(0, len(records), group)
+    out = np.zeros(len(edges), dtype=records.dtype)
+    out['tier'] = records['tier'][edges]
+    out['start'] = records['start'][edges]
+    out['count'] = np.add.reduceat(records['count'], edges)
+    out['sum'] = np.add.reduceat(records['sum'], edges)
+    seen = records['count'] > 0
+    out['min'] = np.minimum.reduceat(np.where(seen, records['min'], np.inf), edges)
+    out['max'] = np.maximum.reduceat(np.where(seen, records['max'], -np.inf), edges)
+    empty = out['count'] == 0
+    out['min'][empty] = out['max'][empty] = 0
+    return out
+
+
+# --- Charting ---
+
+def plot_history(directory, filename=None, t0=None, t1=None):
+    """Every metric over the whole run (or [t0, t1]): the mean per bucket
+    and the band between its min and max."""
+    import matplotlib.pyplot as plt
+    store = HistoryStore(directory, readonly=True)
+    started = time.perf_counter()
+    series = store.query(t0, t1)
+    elapsed = time.perf_counter() - started
+    fig, axes = plt.subplots(len(series.metrics), 1, sharex=True,
+                             figsize=(10, 2.2 * len(series.metrics)))
+    origin = series.start[0] if len(series) else 0.0
+    for ax, name in zip(np.atleast_1d(axes), series.metrics):
+        start, low, high, mean = series.column(name)
+        hours = (start - origin) / 3600
+        ax.fill_between(hours, low, high, step='post', alpha=0.3, linewidth=0)
+        ax.plot(hours, mean, drawstyle='steps-post', linewidth=0.8)
+        ax.set_ylabel(name)
+        ax.grid(True, alpha=0.3)
+    np.atleast_1d(axes)[-1].set_xlabel(
+        f"hours since {time.ctime(origin)} ({series.seconds:g} s per point)")
+    fig.tight_layout()
+    print(f"{len(series)} points of {series.seconds:g} s, queried in {elapsed * 1e3:.1f} ms")
+    if filename:
+        fig.savefig(filename)
+        print(f"Saved '{filename}'.")
+    else:
+        plt.show()
+
+
+def summarize(directory):
+    store = HistoryStore(directory, readonly=True)
+    span = store.span()
+    if span is None:
+        print("Empty history.")
+        return
+    print(f"{time.ctime(span[0])} to {time.ctime(span[1])} "
+          f"({(span[1] - span[0]) / 3600:.1f} h), tiers "
+          f"{', '.join(f'{s:g} s' for s, _ in store.tiers)}")
+    series = store.query(tier=len(store.tiers) - 1, max_points=0)
+    for i, name in enumerate(series.metrics):
+        count = int(series.count[:, i].sum())
+        if count == 0:
+            continue
+        mean = float(np.nansum(series.mean[:, i] * series.count[:, i]) / count)
+        print(f"  {name:12s} {count:9d} values, mean {mean:10.3f}, "
+              f"min {np.nanmin(series.min[:, i]):10.3f}, max {np.nanmax(series.max[:, i]):10.3f}")
+
+
+# --- Self-check ---
+
+def _simulated_run(hours, bph=SELFCHECK_BPH, start=1.7e9, seed=0):
+    """Beat times and values of a watch running down its power reserve:
+    amplitude falls and the rate drifts as the mainspring unwinds."""
+    rng = np.random.default_rng(seed)
+    period = 3600.0 / bph
+    t = start + np.arange(int(hours * 3600 / period)) * period
+    fraction = (t - start) / (hours * 3600)
+    amplitude = 300 - 120 * fraction ** 2 + rng.normal(0, 2, len(t))
+    rate = 3 + 15 * fraction ** 3 + rng.normal(0, 1, len(t))
+    beat_error = 0.4 + rng.normal(0, 0.02, len(t))
+    level = rng.uniform(1e5, 2e5, len(t))
+    return t, {'rate': rate, 'beat_error': beat_error, 'amplitude': amplitude, 'level': level}
+
+
+def _expected(t, values, seconds, metrics):
+    """Per-bucket count, min, max and sum computed directly from the raw values."""
+    keys = np.floor(t / seconds) * seconds
+    starts, edges = np.unique(keys, return_index=True)
+    columns = np.stack([values[name] for name in metrics], axis=1)
+    return (starts, np.add.reduceat(columns, edges), np.minimum.reduceat(columns, edges),
+            np.maximum.reduceat(columns, edges), np.diff(np.append(edges, len(t))))
+
+
+def run_selfcheck(hours=SELFCHECK_HOURS):
+    """A multi-day run into a store: the tiers must agree with aggregates
+    computed from the raw values, memory must not grow with the run, and a
+    crash with a torn write must lose no more than the last batch."""
+    ok = True
+    t, values = _simulated_run(hours)
+    times = t.tolist()
+    rate, beat_error, amplitude, level = (values[name].tolist() for name in METRICS)
+    with tempfile.TemporaryDirectory() as directory:
+        store = HistoryStore(directory)
+        crash_at = int(len(times) * 0.75)
+        traced_from = max(crash_at - int(3600 * SELFCHECK_BPH / 3600), 0)
+        started = time.perf_counter()
+        for i in range(traced_from):
+            store.add(times[i], rate=rate[i], beat_error=beat_error[i],
+                      amplitude=amplitude[i], level=level[i])
+        elapsed = time.perf_counter() - started
+        # What is still allocated after another hour has gone in: with
+        # fixed rings, only the batch not yet written.
+        tracemalloc.start()
+        for i in range(traced_from, crash_at):
+            store.add(times[i], rate=rate[i], beat_error=beat_error[i],
+                      amplitude=amplitude[i], level=level[i])
+        held = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        passed = held < 256 << 10
+        ok &= passed
+        print(f"  {crash_at} values ({times[crash_at - 1] - times[0]:.0f} s): "
+              f"{elapsed / max(traced_from, 1) * 1e6:.1f} us per add; {held / 1e3:.0f} kB "
+              f"still held from the last hour; rings {store.memory_bytes() / 1e6:.2f} MB  "
+              f"{'ok' if passed else 'FAIL'}")
+
+        # Crash: the process dies mid-write, leaving half a batch behind.
+        store._f.flush()
+        segment = store._segments[-1][0]
+        store._write_batch = lambda: None
+        torn = np.zeros(FLUSH_BUCKETS, dtype=store._dtype).tobytes()
+        with open(segment, 'ab') as f:
+            f.write(BATCH_HEADER.pack(BATCH_MAGIC, FLUSH_BUCKETS, zlib.crc32(torn)) + torn[:50])
+        store._f.close()
+        del store
+
+        store = HistoryStore(directory)
+        recovered = store.span()[1]
+        lost = int(np.sum((t[:crash_at] >= recovered)))
+        passed = lost <= (FLUSH_BUCKETS + 1) * SELFCHECK_BPH / 3600
+        ok &= passed
+        print(f"  crash with a torn batch: reopened up to {recovered - times[0]:.0f} s, "
+              f"{lost} values lost  {'ok' if passed else 'FAIL'}")
+        for i in range(crash_at, len(times)):
+            store.add(times[i], rate=rate[i], beat_error=beat_error[i],
+                      amplitude=amplitude[i], level=level[i])
+        store.close()
+
+        # Everything the store kept, against the same values straight from the arrays.
+        keep = (t < recovered) | (np.arange(len(t)) >= crash_at)
+        kept_t = t[keep]
+        kept = {name: v[keep] for name, v in values.items()}
+        store = HistoryStore(directory, readonly=True)
+        for tier, (seconds, _) in enumerate(store.tiers):
+            started = time.perf_counter()
+            series = store.query(tier=tier, max_points=0)
+            query_ms = (time.perf_counter() - started) * 1e3
+            starts, sums, lows, highs, counts = _expected(kept_t, kept, seconds, store.metrics)
+            passed = (len(series) == len(starts) and np.array_equal(series.start, starts)
+                      and np.array_equal(series.count[:, 0], counts)
+                      and np.allclose(series.mean, sums / counts[:, None], rtol=1e-12)
+                      and np.array_equal(series.min, lows) and np.array_equal(series.max, highs))
+            ok &= passed
+            print(f"  {seconds:5g} s tier: {len(series):6d} buckets match the raw values "
+                  f"(queried in {query_ms:.0f} ms)  {'ok' if passed else 'FAIL'}")
+        elapsed = float('inf')
+        for _ in range(SELFCHECK_QUERY_REPEATS):
+            started = time.perf_counter()
+            series = store.query()
+            elapsed = min(elapsed, (time.perf_counter() - started) * 1e3)
+        passed = len(series) <= QUERY_POINTS and elapsed < SELFCHECK_QUERY_MS
+        ok &= passed
+        print(f"  whole-run chart: {len(series)} points of {series.seconds:g} s in "
+              f"{elapsed:.1f} ms  {'ok' if passed else 'FAIL'}")
+        print(f"  {store.report()}")
+    print("PASS" if ok else "FAIL")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Multi-resolution history of rate, beat error, amplitude and level.")
+    parser.add_argument('directory', nargs='?', help="history directory to summarize or chart")
+    parser.add_argument('--plot', nargs='?', const='', metavar='FILE',
+                        help="chart the whole run (into FILE, if given)")
+    parser.add_argument('--selfcheck', action='store_true',
+                        help=f"simulate a {SELFCHECK_HOURS} h run with a crash and check the tiers")
+    parser.add_argument('--hours', type=float, default=SELFCHECK_HOURS)
+    args = parser.parse_args()
+    if args.selfcheck:
+        raise SystemExit(0 if run_selfcheck(args.hours) else 1)
+    if not args.directory:
+        parser.error("a history directory is required")
+    if args.plot is not None:
+        plot_history(args.directory, args.plot or None)
+    else:
+        summarize(args.directory)
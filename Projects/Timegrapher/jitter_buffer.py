@@ -0,0 +1,366 @@
+# jitter_buffer.py
+import argparse
+import math
+import time
+import numpy as np
+from sample_ring import SampleRing
+
+# --- Configuration ---
+SAMPLE_RATE = 32000
+MAX_FRAMES = 4096           # Callback block the buffers are sized for; larger ones grow them
+
+# --- Buffer Depth ---
+# Depth is counted after each callback has taken its block, so the margin
+# is the same whatever the block size. The depth aimed for starts at
+# TARGET_MS. An underrun raises it a step; a long stretch in which the
+# buffer never came near empty lowers it a step.
+TARGET_MS = 40.0
+MIN_TARGET_MS = 15.0
+MAX_TARGET_MS = 250.0
+TARGET_STEP_MS = 5.0
+RELAX_SECONDS = 60.0
+RELAX_CALLBACKS = 4000      # A long stretch is also this many callbacks: large blocks look rarely
+OVERFLOW_MS = 400.0         # Beyond target: jump back to target rather than resample
+
+# --- Rate Control ---
+# A PI loop on the smoothed depth sets the resampling ratio; its integral
+# settles at the clock difference, which is what `drift_ppm` reports.
+LEVEL_SMOOTHING_SECONDS = 0.5
+PROPORTIONAL = 0.05         # Ratio change per second of depth error (20 s to correct)
+INTEGRAL_SECONDS = 60.0
+INTEGRATE_WITHIN_MS = 20.0  # Larger errors are transients (stalls, bursts): not drift
+MAX_CORRECTION_PPM = 2000.0
+
+# --- Simulation Configuration ---
+SIM_MINUTES = 30
+SIM_DRIFT_PPM = 180.0
+SIM_CALLBACK_FRAMES = 256
+SIM_LARGE_FRAMES = 8192     # Block past MAX_FRAMES, to check the buffers grow
+SIM_LARGE_MINUTES = 5
+SIM_LATENCY_TOLERANCE_MS = 5.0  # Mean latency after settling against the target
+SIM_PACKET_SECONDS = 0.001  # USB serial adapters deliver about once per ms
+SIM_STALL_EVERY_SECONDS = 20.0
+SIM_STALL_SECONDS = 0.03
+SIM_SETTLE_SECONDS = 120.0
+
+
+class JitterBuffer:
+    """Playback from a SampleRing whose writer runs on a different clock.
+
+    The audio callback calls `fill`. The depth of the ring (plus the few
+    samples held here) left once the block is taken is smoothed and held
+    at a target by resampling the
+    stream very slightly faster or slower: output sample k is linearly
+    interpolated at input position phase + k * ratio, and the fractional
+    phase carries over to the next call. The ratio comes from a PI loop
+    on the depth error, so the steady correction is the measured drift
+    between the two clocks in ppm.
+
+    The target depth adapts: each underrun raises it, and it is lowered
+    again once the buffer has kept plenty in hand for a while. A burst
+    far beyond the target (after a stall on the link, say) is dropped
+    rather than played out slowly; so is anything beyond the target when
+    playback (re)starts. Nothing is allocated in `fill` unless a block is
+    larger than any before it (and `max_frames`): then the buffers grow.
+    """
+
+    def __init__(self, ring, sample_rate=SAMPLE_RATE, target_ms=TARGET_MS,
+                 min_target_ms=MIN_TARGET_MS, max_target_ms=MAX_TARGET_MS,
+                 max_frames=MAX_FRAMES):
+        self.ring = ring
+        self.sample_rate = sample_rate
+        self.target = target_ms * sample_rate / 1000
+        self.min_target = min_target_ms * sample_rate / 1000
+        self.max_target = max_target_ms * sample_rate / 1000
+        self.step = TARGET_STEP_MS * sample_rate / 1000
+        self.overflow = OVERFLOW_MS * sample_rate / 1000
+        self.max_correction = MAX_CORRECTION_PPM * 1e-6
+
+        self.max_frames = 0
+        self._history = np.zeros(0)     # Input not yet consumed
+        self._reserve(max_frames)
+        self._held = 0          # Samples in _history
+        self._phase = 0.0       # Position of the next output within _history
+
+        self.level = None       # Smoothed depth, samples
+        self.integral = 0.0
+        self.ratio = 1.0
+        self._settling_target = self.target  # Follows target as the loop would
+        self._low_water = math.inf
+        self._relax_left = RELAX_SECONDS
+        self._relax_callbacks = RELAX_CALLBACKS
+        self._started = False
+
+        self.callbacks = 0
+        self.frames_out = 0
+        self.underruns = 0
+        self.underrun_samples = 0
+        self.overflows = 0
+        self.dropped_samples = 0    # By overflows, and beyond the target at a (re)start
+        self.target_changes = 0
+        self.adjusted_samples = 0.0  # Net input consumed minus output produced
+        self.busy_seconds = 0.0
+        self.worst_seconds = 0.0
+
+    # --- Readings ---
+
+    @property
+    def depth(self):
+        """Samples waiting, in the ring and here."""
+        return self.ring.occupancy() + self._held - self._phase
+
+    @property
+    def next_sample(self):
+        """Stream position (samples into the ring since the start) of the
+        next sample `fill` will play."""
+        return self.ring.consumed - self._held + self._phase
+
+    @property
+    def latency_ms(self):
+        return self.depth * 1000 / self.sample_rate
+
+    @property
+    def target_ms(self):
+        return self.target * 1000 / self.sample_rate
+
+    @property
+    def drift_ppm(self):
+        """How much faster the writer's clock runs than the player's."""
+        return self.integral * 1e6
+
+    # --- Callback side ---
+
+    def _reserve(self, frames):
+        """Sizes the buffers for blocks of up to `frames`."""
+        capacity = int(frames * (1 + 2 * self.max_correction)) + 4
+        history = np.zeros(capacity)
+        history[:len(self._history)] = self._history
+        self._history = history
+        self._incoming = np.zeros(capacity, dtype=self.ring.dtype)
+        self._ramp = np.arange(frames, dtype=np.float64)
+        self._positions = np.zeros(frames)
+        self._index = np.zeros(frames, dtype=np.intp)
+        self._left = np.zeros(frames)
+        self._right = np.zeros(frames)
+        self.max_frames = frames
+
+    def fill(self, out):
+        """Fills `out` (a 1-D view of the output block) with the stream."""
+        start_time = time.perf_counter()
+        frames = len(out)
+        if frames > self.max_frames:
+            self._reserve(frames)
+        if not self._started:
+            # Wait for the target depth before starting, as after an underrun.
+            # A large block can overshoot it by most of a block: drop that,
+            # or it takes minutes of resampling to play away.
+            excess = self.depth - frames - self.target
+            if excess < 0:
+                out[:] = 0
+                return
+            self.dropped_samples += self.ring.skip(int(excess))
+            self._started = True
+            self.level = self.depth - frames
+            self._settling_target = self.target  # Starting at the target: no step
+        self._control(frames)
+
+        # Input needed for positions phase .. phase + (frames - 1) * ratio,
+        # plus the right-hand neighbour of the last one.
+        ratio = self.ratio
+        needed = int(self._phase + (frames - 1) * ratio) + 2
+        if needed > self._held:
+            got = self.ring.read_available(self._incoming[:needed - self._held])
+            self._history[self._held:self._held + got] = self._incoming[:got]
+            self._held += got
+
+        positions = self._positions[:frames]
+        np.multiply(self._ramp[:frames], ratio, out=positions)
+        positions += self._phase
+        playable = frames
+        if needed > self._held:
+            # Underrun: play what there is, then silence, and start again
+            # once the (raised) target depth has built up.
+            playable = max(0, min(frames, int(math.ceil((self._held - 1 - self._phase) / ratio))))
+            self.underruns += 1
+            self.underrun_samples += frames - playable
+            self._raise_target()
+            self._started = False
+
+        if playable:
+            index, left, right = self._index[:playable], self._left[:playable], self._right[:playable]
+            fraction = positions[:playable]
+            np.floor(fraction, out=left)
+            np.copyto(index, left, casting='unsafe')
+            fraction -= left
+            np.take(self._history, index, out=left)
+            index += 1
+            np.take(self._history, index, out=right)
+            right -= left
+            right *= fraction
+            left += right
+            np.rint(left, out=left)
+            np.copyto(out[:playable], left, casting='unsafe')
+        out[playable:] = 0
+
+        end = self._phase + playable * ratio
+        consumed = min(self._held, int(end))
+        self._phase = end - consumed if playable == frames else 0.0
+        self._history[:self._held - consumed] = self._history[consumed:self._held]
+        self._held -= consumed
+        self.adjusted_samples += playable * (ratio - 1)
+        self.frames_out += frames
+        self.callbacks += 1
+        elapsed = time.perf_counter() - start_time
+        self.busy_seconds += elapsed
+        self.worst_seconds = max(self.worst_seconds, elapsed)
+
+    def _control(self, frames):
+        depth = self.depth - frames
+        dt = frames / self.sample_rate
+        if depth > self.target + self.overflow:
+            dropped = self.ring.skip(int(depth - self.target))
+            self.overflows += 1
+            self.dropped_samples += dropped
+            depth -= dropped
+            self.level = depth
+        alpha = min(1.0, dt / LEVEL_SMOOTHING_SECONDS)
+        self.level += alpha * (depth - self.level)
+        error = (self.level - self.target) / self.sample_rate     # Seconds
+        # A target step is worked off by the proportional term in about
+        # 1 / PROPORTIONAL seconds. The integral sees the error against a
+        # target eased over the same time, so the step does not bend the
+        # drift estimate.
+        self._settling_target += min(1.0, PROPORTIONAL * dt) * (self.target - self._settling_target)
+        settled_error = (self.level - self._settling_target) / self.sample_rate
+        if abs(settled_error) < INTEGRATE_WITHIN_MS / 1000:
+            self.integral += PROPORTIONAL * settled_error * dt / INTEGRAL_SECONDS
+        self.integral = min(self.max_correction, max(-self.max_correction, self.integral))
+        correction = PROPORTIONAL * error + self.integral
+        self.ratio = 1.0 + min(self.max_correction, max(-self.max_correction, correction))
+
+        self._low_water = min(self._low_water, depth)
+        self._relax_left -= dt
+        self._relax_callbacks -= 1
+        if self._relax_left <= 0 and self._relax_callbacks <= 0:
+            # Never came within three steps of empty: one step less is safe.
+            if self._low_water > 3 * self.step and self.target - self.step >= self.min_target:
+                self.target -= self.step
+                self.target_changes += 1
+            self._low_water = math.inf
+            self._relax_left = RELAX_SECONDS
+            self._relax_callbacks = RELAX_CALLBACKS
+
+    def _raise_target(self):
+        if self.target + self.step <= self.max_target:
+            self.target += self.step
+            self.target_changes += 1
+        self._low_water = math.inf
+        self._relax_left = RELAX_SECONDS
+        self._relax_callbacks = RELAX_CALLBACKS
+
+    def report(self):
+        cost = self.busy_seconds / max(1, self.callbacks) * 1e6
+        return (f"latency {self.latency_ms:.1f} ms (target {self.target_ms:.0f}), "
+                f"drift {self.drift_ppm:+.1f} ppm, ratio {self.ratio:.6f}, corrections: "
+                f"{self.adjusted_samples:+.0f} samples resampled away, {self.target_changes} "
+                f"target changes, {self.overflows} overflows ({self.dropped_samples} samples dropped), "
+                f"{self.underruns} underruns ({self.underrun_samples} samples), "
+                f"{cost:.0f} us/callback (worst {self.worst_seconds * 1e6:.0f})")
+
+
+# --- Simulation ---
+
+def simulate(minutes=SIM_MINUTES, drift_ppm=SIM_DRIFT_PPM, frames=SIM_CALLBACK_FRAMES,
+             report_minutes=5, seed=0):
+    """Plays a ramp through a JitterBuffer in simulated time: the writer's
+    clock is `drift_ppm` fast, it delivers a packet a millisecond with
+    random lateness and now and then stalls; the callback runs on the
+    ideal clock. Returns (buffer, output discontinuities after settling,
+    latency samples after settling)."""
+    rng = np.random.default_rng(seed)
+    ring = SampleRing(65536)
+    buffer = JitterBuffer(ring)
+    writer_rate = SAMPLE_RATE * (1 + drift_ppm * 1e-6)
+    produced = 0
+    next_packet = 0.0
+    next_stall = SIM_STALL_EVERY_SECONDS
+    out = np.zeros(frames, dtype=np.int32)
+    ramp = np.arange(4096, dtype=np.int32)
+    previous = None
+    breaks = 0
+    latencies = []
+    duration = minutes * 60
+    next_report = report_minutes * 60
+    callback = 0
+    while True:
+        now = callback * frames / SAMPLE_RATE
+        if now >= duration:
+            break
+        # Everything the writer has delivered by now.
+        while next_packet <= now:
+            due = int(next_packet * writer_rate) - produced
+            if due > 0:
+                ring.write(ramp[:due] + produced)
+                produced += due
+            next_packet += SIM_PACKET_SECONDS + rng.exponential(0.0003)
+            if next_packet >= next_stall:
+                next_packet += SIM_STALL_SECONDS
+                next_stall += SIM_STALL_EVERY_SECONDS * rng.uniform(0.5, 1.5)
+        underruns = buffer.underruns
+        was_playing = buffer._started
+        buffer.fill(out)
+        callback += 1
+        if now >= SIM_SETTLE_SECONDS and was_playing:
+            latencies.append(buffer.latency_ms)
+            # A ramp resampled near 1:1 steps by 0, 1 or 2 after rounding.
+            steps = np.diff(out)
+            jumps = int(np.count_nonzero((steps < 0) | (steps > 2)))
+            if previous is not None and not 0 <= int(out[0]) - previous <= 2:
+                jumps += 1
+            if buffer.underruns == underruns:
+                breaks += jumps
+        previous = int(out[-1]) if was_playing and buffer._started else None
+        if now >= next_report:
+            next_report += report_minutes * 60
+            print(f"  {now / 60:4.0f} min: {buffer.report()}")
+    return buffer, breaks, np.array(latencies)
+
+
+def run_selfcheck(minutes=SIM_MINUTES):
+    """Simulates long sessions with fast and slow writer clocks."""
+    ok = True
+    for drift in (SIM_DRIFT_PPM, -SIM_DRIFT_PPM / 2):
+        print(f"Writer clock {drift:+.0f} ppm, {minutes} minutes:")
+        buffer, breaks, latencies = simulate(minutes, drift)
+        late_underruns = buffer.underruns
+        passed = (abs(buffer.drift_ppm - drift) < 5 and breaks == 0
+                  and abs(latencies.mean() - buffer.target_ms) < SIM_LATENCY_TOLERANCE_MS
+                  and latencies.std() < 10 and late_underruns <= 3)
+        ok &= passed
+        print(f"  drift measured {buffer.drift_ppm:+.1f} ppm; after settling latency "
+              f"{latencies.mean():.1f} +- {latencies.std():.1f} ms (max {latencies.max():.1f}), "
+              f"{breaks} discontinuities  {'ok' if passed else 'FAIL'}")
+    print(f"{SIM_LARGE_FRAMES}-frame callbacks, {SIM_LARGE_MINUTES} minutes:")
+    buffer, breaks, latencies = simulate(SIM_LARGE_MINUTES, SIM_DRIFT_PPM, SIM_LARGE_FRAMES)
+    passed = (buffer.max_frames == SIM_LARGE_FRAMES and breaks == 0
+              and abs(buffer.drift_ppm - SIM_DRIFT_PPM) < 5
+              and abs(latencies.mean() - buffer.target_ms) < SIM_LATENCY_TOLERANCE_MS
+              and buffer.overflows == 0 and buffer.underruns == 0)
+    ok &= passed
+    print(f"  drift measured {buffer.drift_ppm:+.1f} ppm; after settling latency "
+          f"{latencies.mean():.1f} +- {latencies.std():.1f} ms (target {buffer.target_ms:.0f}), "
+          f"{buffer.underruns} underruns, {breaks} discontinuities  {'ok' if passed else 'FAIL'}")
+    print("PASS" if ok else "FAIL")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drift-compensating playback buffer.")
+    parser.add_argument('--selfcheck', action='store_true',
+                        help="simulate long sessions with mismatched clocks")
+    parser.add_argument('--minutes', type=float, default=SIM_MINUTES,
+                        help="simulated session length")
+    args = parser.parse_args()
+    if args.selfcheck:
+        raise SystemExit(0 if run_selfcheck(args.minutes) else 1)
+    parser.print_help()
@@ -1,12 +1,24 @@
 # live_graph_and_player.py
-import serial
+import argparse
+import functools
 import numpy as np
 import sounddevice as sd
 import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation
 import queue
 import threading
+import time
 from collections import deque
+from framing import FrameDecoder, decode_samples, PROTOCOL_RAW
+from sample_ring import SampleRing
+from dsp import DSPChain, Gain
+from jitter_buffer import JitterBuffer, MAX_FRAMES
+from metrics import registry, LatencyProbe, MetricsReporter
+from analysis import run_analysis
+from beat_trace import BeatTrace
+from spectrogram import Spectrogram
+from strip_chart import FrameTimer, PaperStrip, SpectrogramView, TraceView, WaveformView
+from pipeline import Pipeline, RESULTS_QUEUE_SIZE
+from sources import open_source, is_decoded
 
 # --- Configuration ---
 SERIAL_PORT = '/dev/ttyUSB0'
@@ -15,137 +27,236 @@ SAMPLE_RATE = 32000
 CHANNELS = 1
 DTYPE = 'int32'
 BYTES_PER_SAMPLE = 4
+# 'serial' for the port above, or 'broker' to attach to a running broker.py
+SOURCE = 'serial'
+BROKER_BACKLOG_SECONDS = 0.25 # Enough history to fill the plot straight away
 
 # --- NEW: Amplification Factor ---
 # Adjust this value to change the playback volume.
 # 1.0 = no change, 2.0 = double the volume, 0.5 = half the volume.
 AMPLIFICATION_FACTOR = 5
 
+# --- Signal Conditioning ---
+# Stages every decoded block passes through before playback, plotting and
+# analysis see it (see dsp.parse_chain), e.g. adding ',gate=-60' to quiet
+# the hiss between beats. '' for none.
+DSP_CHAIN = 'dc,highpass=200'
+
 
 # --- Framing Protocol ---
-SOF_MARKER = b'\xAA\x55'
 PAYLOAD_SIZE = 512
+# 'bare' (SOF + payload), 'seq' (SOF + sequence number + payload + CRC),
+# their 3-bytes-per-sample variants 'packed' and 'seq-packed', or 'auto' to
+# detect which one the firmware sends.
+FRAME_PROTOCOL = 'auto'
+STATS_INTERVAL_SECONDS = 10 # How often the serial reader prints its framing stats
+METRICS_FILE = None         # If set, a JSON snapshot of the metrics is kept here
 
 # --- Plotting Configuration ---
 PLOT_WINDOW_SAMPLES = 8000 # 250ms window
+PLOT_INTERVAL_MS = 50
+
+# --- Buffer Configuration ---
+AUDIO_RING_CAPACITY = 32768 # ~1s of audio between the processor and the callback
+PLOT_RING_CAPACITY = 32768
+BEAT_RING_CAPACITY = 32768
+
+# --- Beat Detection ---
+BEAT_BLOCK_SAMPLES = 1024 # Up to 32 ms of audio per detector call
+BEAT_HISTORY = 64         # Recent beats kept for display
+LIFT_ANGLE = 52           # Degrees, for the amplitude; see the movement's data sheet
 
-# --- Thread-safe Queues ---
+# --- History ---
+# If set, rate, beat error, amplitude and level are kept here per beat for
+# the whole run, rolled up into seconds, minutes and hours (history_store.py
+# charts it, during the run or after).
+HISTORY_DIRECTORY = None
+
+# --- Thread-safe Queues and Rings ---
 serial_data_queue = queue.Queue()
-# These two queues will receive the same processed data chunks
-plot_chunk_queue = queue.Queue(maxsize=100)
-audio_chunk_queue = queue.Queue(maxsize=100)
+# The processor is the only writer of the rings; the audio callback, the
+# plot update and the analysis thread are their only readers. With --processes
+# these are replaced by shared-memory rings fed from the decode process, and
+# the analysis runs in a process of its own.
+audio_ring = SampleRing(AUDIO_RING_CAPACITY, dtype=DTYPE)
+plot_ring = SampleRing(PLOT_RING_CAPACITY, dtype=DTYPE)
+beat_ring = SampleRing(BEAT_RING_CAPACITY, dtype=DTYPE)
+plot_scratch = np.empty(PLOT_RING_CAPACITY, dtype=DTYPE)
+beat_events = deque(maxlen=BEAT_HISTORY)
+# What the analysis found (see analysis.BeatAnalysis), for the plot to apply
+# to the display copies below. With --processes, the pipeline's queue.
+analysis_results = queue.Queue(RESULTS_QUEUE_SIZE)
+# Averaged tick and tock waveforms and the waterfall of the last few seconds,
+# as drawn: only the plot update writes them.
+beat_trace = BeatTrace(SAMPLE_RATE)
+spectrogram = Spectrogram(SAMPLE_RATE)
+latest_reading = [None, None, None] # Rate s/day, beat error ms, amplitude deg
+
+# --- Instrumentation ---
+# Each metric has a single writer; the reporter thread reads them all.
+read_sizes = registry.histogram('serial.read', unit='B')
+decode_times = registry.histogram('decode')
+queue_depths = registry.histogram('queue.serial', unit='')
+callback_times = registry.histogram('callback')
+underflows = registry.counter('audio.underflows')
+status_flags = registry.counter('audio.status')
+latency_probe = LatencyProbe(registry.histogram('latency'))
 
 stop_threads = False
 
 def serial_reader_thread():
-    """Reads framed data from serial and puts the raw payload into a queue."""
+    """Reads framed data from serial and puts blocks of validated payloads into a queue.
+
+    With the sequenced protocol, lost or corrupt frames come out as silence so
+    the sample clock never slips.
+    """
     global stop_threads
     print("Serial reader thread started.")
-    
-    def find_sof_marker(ser_port):
-        sync_bytes = bytearray(2)
-        while not stop_threads:
-            new_byte = ser_port.read(1)
-            if not new_byte: return False
-            sync_bytes.pop(0); sync_bytes.append(new_byte[0])
-            if sync_bytes == SOF_MARKER: return True
-        return False
+    last_report = time.monotonic()
 
     try:
-        with serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1) as ser:
+        with open_source(SOURCE, SERIAL_PORT, BAUD_RATE, backlog_seconds=BROKER_BACKLOG_SECONDS) as ser:
             ser.reset_input_buffer()
-            print(f"Listening on {SERIAL_PORT}...")
+            # The broker has already done the framing for us.
+            protocol = PROTOCOL_RAW if is_decoded(ser) else FRAME_PROTOCOL
+            decoder = FrameDecoder(protocol, payload_size=PAYLOAD_SIZE)
+            print(f"Listening on {SOURCE} ({SERIAL_PORT})...")
             while not stop_threads:
-                if find_sof_marker(ser):
-                    chunk = ser.read(PAYLOAD_SIZE)
-                    if len(chunk) == PAYLOAD_SIZE:
-                        serial_data_queue.put(chunk)
+                # Ask for whatever is waiting (at least one frame), so we block
+                # briefly when idle and read big blocks when we fall behind.
+                before = decoder.bytes_in
+                payloads = decoder.read_from(ser, max(ser.in_waiting, decoder.frame_size))
+                if decoder.bytes_in > before:
+                    read_sizes.record(decoder.bytes_in - before)
+                if len(payloads):
+                    serial_data_queue.put((time.monotonic(), payloads))
+
+                if time.monotonic() - last_report > STATS_INTERVAL_SECONDS:
+                    print(f"Serial: {decoder.report()}")
+                    last_report = time.monotonic()
+        print(f"Serial reader thread finished. {decoder.report()}")
     except Exception as e:
         print(f"Serial thread error: {e}")
-    print("Serial reader thread finished.")
 
 def data_processor_distributor_thread():
-    """Pulls raw data, processes it, and distributes it to the plot and audio queues."""
+    """Pulls raw data, processes it, and distributes it to the plot and audio rings."""
     global stop_threads
     print("Data processor thread started.")
+    dsp_chain = DSPChain(DSP_CHAIN, SAMPLE_RATE)
     while not stop_threads:
         try:
-            raw_chunk = serial_data_queue.get(timeout=1)
-            raw_samples = np.frombuffer(raw_chunk, dtype='<i4')
-            corrected_samples = (raw_samples << 8) >> 8
-            
-            # Put the same chunk of processed data into both queues
-            if not plot_chunk_queue.full():
-                plot_chunk_queue.put(corrected_samples)
-            if not audio_chunk_queue.full():
-                audio_chunk_queue.put(corrected_samples)
+            arrival, payloads = serial_data_queue.get(timeout=1)
+            queue_depths.record(serial_data_queue.qsize())
+            start = time.perf_counter()
+            corrected_samples = dsp_chain.process(decode_samples(payloads))
+            decode_times.record(time.perf_counter() - start)
+
+            # Hand the same chunk of processed data to the plot and the audio
+            latency_probe.stamp(audio_ring.written, arrival)
+            plot_ring.write(corrected_samples)
+            audio_ring.write(corrected_samples)
+            beat_ring.write(corrected_samples)
 
         except queue.Empty:
             continue
+    print(f"DSP: {dsp_chain.report()}")
     print("Data processor thread finished.")
 
-# --- NEW: A persistent buffer for the audio callback ---
-audio_buffer = np.array([], dtype=DTYPE)
+def analysis_thread():
+    """Runs the beat analysis on the beat ring (analysis.run_analysis): the
+    detector, rate and beat error, amplitude, averaged trace, spectrogram and
+    history. What it finds goes to the plot on `analysis_results`; the
+    readings are printed with their cost now and then."""
+    print("Analysis thread started.")
+    run_analysis(beat_ring, analysis_results, lambda: stop_threads, **analysis_options())
+    print("Analysis thread finished.")
 
-def audio_callback(outdata, frames, time, status):
+def analysis_options():
+    return {'sample_rate': SAMPLE_RATE, 'lift_angle': LIFT_ANGLE,
+            'history_directory': HISTORY_DIRECTORY, 'block_samples': BEAT_BLOCK_SAMPLES,
+            'stats_interval': STATS_INTERVAL_SECONDS}
+
+def audio_callback(outdata, frames, time_info, status):
     """
     The function called by the sounddevice stream to get more audio data.
     This version includes an amplification and clipping stage.
+    Everything happens in place in `outdata`, nothing is allocated here,
+    and nothing is printed: problems are counted for the metrics reporter.
     """
-    global audio_buffer
+    start = time.perf_counter()
     if status:
-        print(status)
-    
-    # Fill our persistent buffer with as much data as is needed
-    while len(audio_buffer) < frames:
-        try:
-            # Pull a new chunk from the queue and append it
-            audio_buffer = np.concatenate((audio_buffer, audio_chunk_queue.get_nowait()))
-        except queue.Empty:
-            # Not enough data; pad with silence and break
-            print("Audio buffer underrun!")
-            silence_needed = frames - len(audio_buffer)
-            samples_to_play = np.concatenate((audio_buffer, np.zeros(silence_needed, dtype=DTYPE)))
-            audio_buffer = np.array([], dtype=DTYPE) # Clear buffer
-            break # Exit the while loop
-    else:
-        # This block runs if the while loop completed without a break (i.e., we have enough data)
-        samples_to_play = audio_buffer[:frames]
-        # Keep the rest of the data for the next call
-        audio_buffer = audio_buffer[frames:]
+        if status.output_underflow:
+            underflows.add()
+        else:
+            status_flags.add()
+
+    # Play from the ring through the jitter buffer, which follows the Pico's
+    # clock; anything missing is filled with silence and counted.
+    latency_probe.measure(playback.next_sample, time.monotonic()
+                          + time_info.outputBufferDacTime - time_info.currentTime)
+    playback.fill(outdata[:, 0])
 
     # --- AMPLIFICATION AND CLIPPING STAGE ---
-    # 1. Multiply by the amplification factor. This converts the array to float.
-    amplified_samples = samples_to_play * AMPLIFICATION_FACTOR
-    
-    # 2. Clip the values to the valid 24-bit range to prevent distortion.
-    #    The microphone's true range is 24-bit, so we clip to that.
-    np.clip(amplified_samples, -2**23, 2**23 - 1, out=amplified_samples)
-    
-    # 3. Convert back to the required integer type for the sound card.
-    final_samples = amplified_samples.astype(DTYPE)
-    
-    # Assign the final, amplified samples to the output buffer
-    outdata[:] = final_samples.reshape(-1, 1)
+    # The volume chain's Gain stage multiplies by the amplification factor
+    # and clips to the microphone's true 24-bit range to prevent distortion.
+    outdata[:, 0] = volume.process(outdata[:, 0])
+    callback_times.record(time.perf_counter() - start)
 
 
 # --- Matplotlib Plotting Setup ---
-fig, ax = plt.subplots()
-plot_data = deque([0] * PLOT_WINDOW_SAMPLES, maxlen=PLOT_WINDOW_SAMPLES)
-line, = ax.plot(plot_data)
+# The moving parts are drawn by hand over saved backgrounds (blitting), so a
+# frame costs what changed rather than the whole figure.
+fig, (ax, trace_ax, strip_ax, spectrum_ax) = plt.subplots(4, 1, figsize=(8, 11))
 ax.set_ylim(-2**23, 2**23)
-ax.set_xlim(0, PLOT_WINDOW_SAMPLES)
 ax.set_title("Live Audio Stream")
+waveform_view = WaveformView(ax, PLOT_WINDOW_SAMPLES, dtype=DTYPE)
+# Beat-synchronous view: the averaged tick and tock, lined up on their onsets.
+trace_view = TraceView(trace_ax, beat_trace)
+paper_strip = PaperStrip(strip_ax)
+spectrogram_view = SpectrogramView(spectrum_ax, spectrogram)
+views = (waveform_view, trace_view, paper_strip, spectrogram_view)
+fig.tight_layout()
+frame_timer = FrameTimer()
+last_plot_report = time.monotonic()
 
-def update_plot(frame):
+def on_draw(event):
+    """A full redraw (first show, resize) wipes the hand-drawn parts; save
+    the fresh backgrounds so the views can draw over them again."""
+    for view in views:
+        view.capture(fig.canvas)
+
+fig.canvas.mpl_connect('draw_event', on_draw)
+
+def apply_analysis():
+    """Applies everything the analysis sent since the last frame."""
+    while True:
+        try:
+            kind, *data = analysis_results.get_nowait()
+        except queue.Empty:
+            return
+        if kind == 'beats':
+            beats, bph, reading = data
+            beat_events.extend(beats)
+            paper_strip.add(beats, bph)
+            latest_reading[:] = reading
+        elif kind == 'trace':
+            beat_trace.load(*data)
+        elif kind == 'spectrogram':
+            spectrogram.add_columns(data[0])
+
+def update_plot():
     """Updates the graph with new data."""
-    global plot_data
-    while not plot_chunk_queue.empty():
-        samples_chunk = plot_chunk_queue.get_nowait()
-        plot_data.extend(samples_chunk) # Append all new samples
-    
-    line.set_ydata(plot_data)
-    return line,
+    global last_plot_report
+    with frame_timer:
+        n = plot_ring.read_available(plot_scratch)
+        waveform_view.extend(plot_scratch[:n]) # Append all new samples
+        apply_analysis()
+        for view in views:
+            view.draw(fig.canvas)
+    now = time.monotonic()
+    if now - last_plot_report >= STATS_INTERVAL_SECONDS:
+        last_plot_report = now
+        print(f"Plot: {frame_timer.report()}")
 
 def on_close(event):
     """Handles the plot window being closed."""
@@ -154,13 +265,69 @@ def on_close(event):
     stop_threads = True
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Live audio graph and player.")
+    parser.add_argument('--processes', action='store_true',
+                        help="run serial ingest and decoding in their own processes")
+    parser.add_argument('--source', default=SOURCE,
+                        help="'serial', 'serial:/dev/...', 'broker' or 'broker:ADDRESS'")
+    parser.add_argument('--dsp', default=DSP_CHAIN,
+                        help="filter chain for the decoded samples, e.g. "
+                             "'dc,highpass=200,gate=-60' ('' for none)")
+    parser.add_argument('--metrics', metavar='FILE',
+                        help="keep a JSON snapshot of the metrics in FILE")
+    parser.add_argument('--history', metavar='DIR',
+                        help="keep the rate, beat error and amplitude history in DIR")
+    args = parser.parse_args()
+    SOURCE = args.source
+    DSP_CHAIN = args.dsp
+    METRICS_FILE = args.metrics
+    HISTORY_DIRECTORY = args.history
+
     fig.canvas.mpl_connect('close_event', on_close)
 
-    # Start the background threads for reading and processing
-    reader = threading.Thread(target=serial_reader_thread, daemon=True)
-    processor = threading.Thread(target=data_processor_distributor_thread, daemon=True)
-    reader.start()
-    processor.start()
+    pipeline = None
+    reader = processor = analyzer = None
+    if args.processes:
+        # Serial ingest, decoding and the beat analysis get their own
+        # interpreters; this process only draws the plot, applying what the
+        # analysis sends, and runs the audio callback.
+        protocol = PROTOCOL_RAW if SOURCE.startswith('broker') else FRAME_PROTOCOL
+        pipeline = Pipeline(functools.partial(open_source, SOURCE, SERIAL_PORT, BAUD_RATE,
+                                              backlog_seconds=BROKER_BACKLOG_SECONDS),
+                            protocol, PAYLOAD_SIZE, consumers=('playback', 'plot'),
+                            dsp=DSP_CHAIN, analysis=analysis_options())
+        pipeline.start()
+        pipeline.start_reporter(STATS_INTERVAL_SECONDS)
+        audio_ring = pipeline.rings['playback']
+        plot_ring = pipeline.rings['plot']
+        beat_ring = pipeline.rings['analysis']
+        analysis_results = pipeline.results
+    else:
+        # Start the background threads for reading, processing and analysis
+        reader = threading.Thread(target=serial_reader_thread, daemon=True)
+        processor = threading.Thread(target=data_processor_distributor_thread, daemon=True)
+        analyzer = threading.Thread(target=analysis_thread, daemon=True)
+        reader.start()
+        processor.start()
+        analyzer.start()
+
+    # The audio callback plays whichever ring is now the playback one.
+    playback = JitterBuffer(audio_ring, SAMPLE_RATE)
+    # Volume is a chain of its own after the jitter buffer, so plotting and
+    # analysis keep the unamplified signal. Run once at the largest block
+    # size, so its buffers are not grown inside the callback.
+    volume = DSPChain([Gain(AMPLIFICATION_FACTOR)], SAMPLE_RATE)
+    volume.process(np.zeros(MAX_FRAMES, dtype=np.int32))
+    for name, ring in (('audio', audio_ring), ('plot', plot_ring), ('beats', beat_ring)):
+        registry.gauge(f'ring.{name}', source=ring.occupancy)
+        registry.gauge(f'drops.{name}', source=lambda ring=ring: ring.overrun_samples)
+    registry.gauge('playback.latency', 'ms', source=lambda: round(playback.latency_ms, 1))
+    registry.gauge('playback.drift', 'ppm', source=lambda: round(playback.drift_ppm, 1))
+    registry.gauge('playback.underruns', source=lambda: playback.underruns)
+    for i, (name, unit) in enumerate((('rate', 's/day'), ('beat_error', 'ms'),
+                                      ('amplitude', 'deg'))):
+        registry.gauge(f'watch.{name}', unit, source=lambda i=i: latest_reading[i])
+    reporter = MetricsReporter(registry, STATS_INTERVAL_SECONDS, path=METRICS_FILE).start()
 
     # Give the buffers a moment to prime
     print("Priming buffers for 0.5 seconds...")
@@ -178,7 +345,9 @@ if __name__ == "__main__":
         print("Starting animation... Close the plot window to exit.")
         
         # Start the animation
-        ani = FuncAnimation(fig, update_plot, interval=50, blit=True)
+        timer = fig.canvas.new_timer(interval=PLOT_INTERVAL_MS)
+        timer.add_callback(update_plot)
+        timer.start()
         plt.show()
 
     except Exception as e:
@@ -189,6 +358,16 @@ if __name__ == "__main__":
             stream.stop()
             stream.close()
         stop_threads = True
-        reader.join(timeout=2)
-        processor.join(timeout=2)
+        reporter.stop()
+        reporter.emit()
+        print(f"Audio: {audio_ring.report()}")
+        print(f"Playback: {playback.report()}")
+        print(f"Plot: {frame_timer.report()}")
+        if pipeline is not None:
+            print(f"Pipeline: {pipeline.report()}")
+            pipeline.stop()
+        else:
+            reader.join(timeout=2)
+            processor.join(timeout=2)
+            analyzer.join(timeout=2)
         print("Program finished.")
\ No newline at end of file
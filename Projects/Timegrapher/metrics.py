@@ -0,0 +1,321 @@
+# metrics.py
+import argparse
+import bisect
+import json
+import os
+import threading
+import time
+import numpy as np
+
+# --- Configuration ---
+REPORT_INTERVAL_SECONDS = 10
+LATENCY_STAMPS = 1024       # Arrival stamps kept for the end-to-end latency probe
+
+# --- Histogram Buckets ---
+# Roughly logarithmic, 1-2-5 per decade: seconds from 1 us to 10 s, and
+# sizes/counts from 1 to 1M.
+SECONDS_BOUNDS = [m * 10.0 ** e for e in range(-6, 1) for m in (1, 2, 5)] + [10.0]
+COUNT_BOUNDS = [m * 10 ** e for e in range(0, 6) for m in (1, 2, 5)] + [10 ** 6]
+
+# --- Benchmark Configuration ---
+BENCH_RECORDS = 200000
+
+
+class Counter:
+    """A count that only goes up. One thread adds to it; any may read it.
+
+    `add` is a single integer store, so it is safe to call from the audio
+    callback; readers see the latest value or the one before.
+    """
+
+    kind = 'counter'
+
+    def __init__(self, name, unit=''):
+        self.name = name
+        self.unit = unit
+        self.value = 0
+
+    def add(self, n=1):
+        self.value += n
+
+    def read(self):
+        return self.value
+
+
+class Gauge:
+    """A level: either set by its writer, or read from `source` (a callable)
+    when a snapshot is taken, so sampling it costs the writer nothing."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, unit='', source=None):
+        self.name = name
+        self.unit = unit
+        self.source = source
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def read(self):
+        return self.source() if self.source is not None else self.value
+
+
+class Histogram:
+    """Distribution of a value over fixed buckets, for one writer.
+
+    `record` finds the bucket with a bisect and bumps three plain Python
+    numbers and one list slot: no locks, no numpy, well under a
+    microsecond, so it can time the audio callback from inside it. Readers
+    copy the counts; a snapshot taken mid-record is at most one sample off.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, unit='s', bounds=None):
+        self.name = name
+        self.unit = unit
+        self.bounds = list(bounds if bounds is not None else
+                           SECONDS_BOUNDS if unit == 's' else COUNT_BOUNDS)
+        self.counts = [0] * (len(self.bounds) + 1)  # Last bucket: above the top bound
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def read(self):
+        return {'count': self.count, 'sum': self.total, 'max': self.max,
+                'counts': list(self.counts)}
+
+    @staticmethod
+    def quantile(counts, bounds, q, maximum=None):
+        """Upper bound of the bucket holding quantile `q` of `counts`, capped
+        at `maximum` (the largest value recorded) when given."""
+        top = float('inf') if maximum is None else maximum
+        total = sum(counts)
+        if total == 0:
+            return 0.0
+        rank = q * total
+        seen = 0
+        for i, n in enumerate(counts):
+            seen += n
+            if seen >= rank:
+                return min(bounds[i], top) if i < len(bounds) else top
+        return top
+
+
+class LatencyProbe:
+    """End-to-end latency, from the moment samples arrive on the serial link
+    to the moment they reach the DAC.
+
+    The producer stamps each block it puts in the playback ring with
+    (index of its first sample in the stream, arrival time). The audio
+    callback passes the stream index of the first sample it is about to
+    play and when the DAC will play it; the latency is that minus the
+    arrival time of the block it came from. The stamps are a fixed array
+    written by one thread, read by the other.
+    """
+
+    def __init__(self, histogram, capacity=LATENCY_STAMPS):
+        self.histogram = histogram
+        self._index = np.full(capacity, np.iinfo(np.int64).max, dtype=np.int64)
+        self._time = np.zeros(capacity)
+        self._written = 0
+
+    def stamp(self, first_sample, arrival_time):
+        slot = self._written % len(self._index)
+        self._time[slot] = arrival_time
+        self._index[slot] = first_sample
+        self._written += 1
+
+    def measure(self, sample, dac_time):
+        if self._written == 0:
+            return
+        # Stamps are in stream order from the oldest slot round to the newest.
+        split = self._written % len(self._index)
+        older, newer = self._index[split:], self._index[:split]
+        if split and sample >= newer[0]:
+            i = int(np.searchsorted(newer, sample, side='right')) - 1
+        else:
+            i = split + int(np.searchsorted(older, sample, side='right')) - 1
+            if i < split:
+                return  # Older than anything still stamped
+        self.histogram.record(dac_time - self._time[i % len(self._index)])
+
+
+class Registry:
+    """The metrics of one process, by name, and their snapshots."""
+
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()  # Only for creating metrics, never on the hot path
+
+    def _get(self, cls, name, **kwargs):
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, **kwargs)
+            return metric
+
+    def counter(self, name, unit=''):
+        return self._get(Counter, name, unit=unit)
+
+    def gauge(self, name, unit='', source=None):
+        return self._get(Gauge, name, unit=unit, source=source)
+
+    def histogram(self, name, unit='s', bounds=None):
+        return self._get(Histogram, name, unit=unit, bounds=bounds)
+
+    def snapshot(self):
+        """Every metric's current value, as plain JSON-able data."""
+        metrics = {}
+        for name, metric in list(self.metrics.items()):
+            try:
+                value = metric.read()
+            except Exception:  # A gauge whose source has gone away
+                value = None
+            metrics[name] = {'kind': metric.kind, 'unit': metric.unit, 'value': value}
+            if metric.kind == 'histogram':
+                metrics[name]['bounds'] = metric.bounds
+        return {'time': time.time(), 'monotonic': time.monotonic(), 'metrics': metrics}
+
+
+def summarize(current, previous=None):
+    """One log line from two snapshots: counters as rates over the interval,
+    gauges as they are, histograms as mean/p99 of what was recorded in the
+    interval and the largest value so far."""
+    seconds = current['monotonic'] - previous['monotonic'] if previous else None
+    parts = []
+    for name, entry in current['metrics'].items():
+        value = entry['value']
+        before = previous['metrics'].get(name, {}).get('value') if previous else None
+        unit = entry['unit']
+        if value is None:
+            continue
+        if entry['kind'] == 'counter':
+            text = f"{name} {value}"
+            if seconds and before is not None:
+                text += f" (+{(value - before) / seconds:.1f}/s)"
+        elif entry['kind'] == 'gauge':
+            text = f"{name} {value:g}{unit}" if isinstance(value, (int, float)) else f"{name} {value}"
+        else:
+            counts = value['counts']
+            count, total = value['count'], value['sum']
+            if before is not None:
+                counts = [a - b for a, b in zip(counts, before['counts'])]
+                count, total = count - before['count'], total - before['sum']
+            if count == 0:
+                continue
+            p99 = Histogram.quantile(counts, entry['bounds'], 0.99, value['max'])
+            scale, shown = (1e6, 'us') if unit == 's' else (1, unit)
+            text = (f"{name} {total / count * scale:.0f}/{p99 * scale:.0f}/"
+                    f"{value['max'] * scale:.0f}{shown}")
+        parts.append(text)
+    return ", ".join(parts)
+
+
+class MetricsReporter:
+    """Background thread that snapshots a registry every `interval` seconds,
+    prints a one-line summary and, given `path`, replaces that file with
+    the snapshot as JSON (written aside and renamed, so a reader never
+    sees half of one)."""
+
+    def __init__(self, registry, interval=REPORT_INTERVAL_SECONDS, path=None, prefix="Metrics"):
+        self.registry = registry
+        self.interval = interval
+        self.path = path
+        self.prefix = prefix
+        self.last = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.last = self.registry.snapshot()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.emit()
+
+    def emit(self):
+        snapshot = self.registry.snapshot()
+        print(f"{self.prefix}: {summarize(snapshot, self.last)}")
+        if self.path:
+            temporary = f"{self.path}.tmp"
+            with open(temporary, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(temporary, self.path)
+        self.last = snapshot
+        return snapshot
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+
+
+# One registry per process, shared by its modules.
+registry = Registry()
+
+
+# --- Benchmark ---
+
+def run_benchmark(records=BENCH_RECORDS):
+    """Cost of the hot-path operations, against a print() for comparison."""
+    import io
+    import contextlib
+    local = Registry()
+    counter = local.counter('bench.counter')
+    histogram = local.histogram('bench.seconds')
+    intervals = local.histogram('bench.interval')
+    probe = LatencyProbe(local.histogram('bench.latency'))
+    for i in range(LATENCY_STAMPS):
+        probe.stamp(i * 512, i * 0.016)
+    values = np.random.default_rng(0).exponential(1e-4, records).tolist()
+
+    def timed(label, action):
+        start = time.perf_counter()
+        for value in values:
+            action(value)
+        cost = (time.perf_counter() - start) / records * 1e9
+        print(f"  {label}: {cost:.0f} ns")
+
+    timed("counter.add", lambda value: counter.add())
+    timed("histogram.record", histogram.record)
+    timed("latency probe", lambda value: probe.measure(300000, 9.45))
+
+    def time_and_record(value):
+        started = time.perf_counter()
+        intervals.record(time.perf_counter() - started)
+
+    timed("perf_counter() pair + record", time_and_record)
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for _ in range(records // 10):
+            print('Output underflow!')
+    print(f"  print() to a buffer, for comparison: "
+          f"{(time.perf_counter() - start) / (records // 10) * 1e9:.0f} ns "
+          "(a terminal is far slower, and can block)")
+    print(f"  {summarize(local.snapshot())}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Real-time-safe counters and histograms.")
+    parser.add_argument('--bench', action='store_true', help="time the hot-path operations")
+    parser.add_argument('--show', metavar='FILE', help="summarize a JSON snapshot")
+    args = parser.parse_args()
+    if args.bench:
+        run_benchmark()
+    elif args.show:
+        with open(args.show) as f:
+            print(summarize(json.load(f)))
+    else:
+        parser.print_help()
@@ -0,0 +1,457 @@
+# multi_station.py
+import argparse
+import asyncio
+import concurrent.futures
+import fcntl
+import io
+import multiprocessing
+import os
+import struct
+import termios
+import time
+import tty
+import numpy as np
+from amplitude import AmplitudeMeter, LIFT_ANGLE
+from beat_detector import BeatDetector
+from framing import FrameDecoder, decode_samples, PAYLOAD_SIZE
+from rate_estimator import RateEstimator
+
+# --- Configuration ---
+BAUD_RATE = 2000000
+SAMPLE_RATE = 32000
+FRAME_PROTOCOL = 'auto'     # See live_graph.py; each station detects its own
+JOBS = os.cpu_count() or 1  # Analysis worker processes
+STATS_INTERVAL_SECONDS = 10
+
+# --- Reading ---
+# Each port is read from the event loop whenever it has data; the bytes are
+# gathered until there are FEED_BYTES (or the port goes quiet) and then
+# deframed in one go, which keeps the per-wakeup cost down.
+READ_BUFFER_BYTES = 1 << 18
+FEED_BYTES = 4096
+
+# --- Analysis ---
+ANALYSIS_BLOCK_SAMPLES = 8192  # ~0.25 s of audio per job sent to a worker
+MAX_BLOCKS_IN_FLIGHT = 32      # Per station; beyond this, blocks skip analysis (and are counted)
+
+# --- Self-check Configuration ---
+SELFCHECK_STATIONS = 8
+SELFCHECK_SECONDS = 10
+HEAD_FORMAT = 'seq'            # Sequence numbers, so every lost frame is counted
+SELFCHECK_RATES = (-6.0, -3.5, -1.0, 0.0, 2.0, 4.5, 7.0, 9.5)  # s/day, one per head
+SELFCHECK_BPH = (18000, 21600, 25200, 28800, 28800, 36000, 21600, 28800)
+
+
+# --- Analysis, in the worker processes ---
+# Every station is pinned to one single-process executor, so its jobs run in
+# order, in a process that keeps the station's detector and estimators.
+
+_analyzers = {}
+
+
+class StationAnalyzer:
+    """Beat detection, rate and amplitude for one station."""
+
+    def __init__(self, sample_rate=SAMPLE_RATE, lift_angle=LIFT_ANGLE):
+        self.detector = BeatDetector(sample_rate)
+        self.estimator = None
+        self.meter = AmplitudeMeter(lift_angle=lift_angle, sample_rate=sample_rate)
+        self.busy_seconds = 0.0
+
+    def process(self, samples):
+        """Consumes a block; returns the latest readings."""
+        start = time.perf_counter()
+        beats = self.detector.process(samples)
+        bph = self.detector.bph
+        if bph and (self.estimator is None or self.estimator.bph != bph):
+            self.estimator = RateEstimator(bph)
+        if self.estimator is not None:
+            self.estimator.extend(b.time for b in beats)
+        self.meter.bph = bph
+        self.meter.process(samples, beats)
+        self.busy_seconds += time.perf_counter() - start
+        reading = self.estimator.window() if self.estimator is not None else None
+        return {
+            'bph': bph,
+            'beats': self.detector.beats,
+            'rate': reading.rate if reading else None,
+            'beat_error': reading.beat_error if reading else None,
+            'amplitude': self.meter.amplitude,
+            'busy_seconds': self.busy_seconds,
+        }
+
+
+def analyze_block(station, samples, sample_rate=SAMPLE_RATE, lift_angle=LIFT_ANGLE):
+    analyzer = _analyzers.get(station)
+    if analyzer is None:
+        analyzer = _analyzers[station] = StationAnalyzer(sample_rate, lift_angle)
+    return analyzer.process(samples)
+
+
+# --- Stations, in the event loop ---
+
+def open_port(path, baud_rate=BAUD_RATE):
+    """Opens a serial port (or pseudo-terminal) for non-blocking reads.
+    Returns (file object, fd); the file object keeps the port open."""
+    try:
+        import serial
+    except ImportError:
+        serial = None
+    if serial is not None:
+        port = serial.Serial(path, baud_rate, timeout=0)
+        fd = port.fileno()
+    else:
+        fd = os.open(path, os.O_RDONLY | os.O_NOCTTY | os.O_NONBLOCK)
+        tty.setraw(fd)
+        port = io.FileIO(fd, 'rb', closefd=True)
+    os.set_blocking(fd, False)
+    return port, fd
+
+
+def _waiting(fd):
+    """Bytes the kernel holds for a port."""
+    return struct.unpack('i', fcntl.ioctl(fd, termios.FIONREAD, b'\0\0\0\0'))[0]
+
+
+class Station:
+    """One timegrapher head: its port, framing and decode state, the block
+    being gathered for analysis and its counters. Everything here runs on
+    the event loop thread; analysis runs in `worker`."""
+
+    def __init__(self, name, path, worker, baud_rate=BAUD_RATE, protocol=FRAME_PROTOCOL,
+                 lift_angle=LIFT_ANGLE):
+        self.name = name
+        self.path = path
+        self.worker = worker
+        self.baud_rate = baud_rate
+        self.lift_angle = lift_angle
+        self.decoder = FrameDecoder(protocol, payload_size=PAYLOAD_SIZE)
+        self.port = self.fd = self._file = None
+        self._loop = None
+        self._buf = bytearray(READ_BUFFER_BYTES)
+        self._view = memoryview(self._buf)
+        self._fill = 0
+        self._block = np.empty(ANALYSIS_BLOCK_SAMPLES, dtype=np.int32)
+        self._block_fill = 0
+        self.in_flight = 0
+        self.closed = False
+        self.done = asyncio.Event()  # Set when the port closes
+
+        # --- Statistics ---
+        self.bytes_in = 0
+        self.samples = 0
+        self.wakeups = 0
+        self.max_waiting = 0        # Largest kernel backlog seen at a wakeup
+        self.analysis_drops = 0     # Blocks not analysed because the worker was behind
+        self.analysis_errors = 0
+        self.readings = {}
+        self._last = (time.monotonic(), 0, 0)
+
+    def open(self, loop):
+        self._loop = loop
+        self.port, self.fd = open_port(self.path, self.baud_rate)
+        self._file = io.FileIO(self.fd, 'rb', closefd=False)
+        loop.add_reader(self.fd, self._on_readable)
+
+    def close(self):
+        if self.fd is not None and not self.closed:
+            self._loop.remove_reader(self.fd)
+            self._flush()
+            self.port.close()
+        self.closed = True
+        self.done.set()
+
+    def _on_readable(self):
+        self.wakeups += 1
+        self.max_waiting = max(self.max_waiting, _waiting(self.fd))
+        while True:
+            try:
+                n = self._file.readinto(self._view[self._fill:])
+            except OSError as e:  # EIO: the device went away
+                print(f"{self.name}: port closed ({e.strerror})")
+                self.close()
+                return
+            # A tty with VMIN=0 (pyserial's timeout=0) returns 0 rather than
+            # EAGAIN when it is empty, so 0 is not end of file here.
+            if not n:
+                break
+            self._fill += n
+            self.bytes_in += n
+            if self._fill == len(self._buf):
+                self._flush()
+        if self._fill >= FEED_BYTES:
+            self._flush()
+
+    def _flush(self):
+        """Deframes and decodes what has been read, and hands full blocks to
+        the worker."""
+        if self._fill == 0:
+            return
+        payloads = self.decoder.feed(self._view[:self._fill])
+        self._fill = 0
+        if not len(payloads):
+            return
+        samples = decode_samples(payloads)
+        self.samples += len(samples)
+        pos = 0
+        while pos < len(samples):
+            n = min(len(samples) - pos, ANALYSIS_BLOCK_SAMPLES - self._block_fill)
+            self._block[self._block_fill:self._block_fill + n] = samples[pos:pos + n]
+            self._block_fill += n
+            pos += n
+            if self._block_fill == ANALYSIS_BLOCK_SAMPLES:
+                self._submit(self._block.copy())
+                self._block_fill = 0
+
+    def _submit(self, block):
+        if self.in_flight >= MAX_BLOCKS_IN_FLIGHT:
+            self.analysis_drops += 1
+            return
+        self.in_flight += 1
+        future = self._loop.run_in_executor(self.worker, analyze_block, self.name, block,
+                                            SAMPLE_RATE, self.lift_angle)
+        future.add_done_callback(self._on_analysed)
+
+    def _on_analysed(self, future):
+        self.in_flight -= 1
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            self.analysis_errors += 1
+            if self.analysis_errors == 1:
+                print(f"{self.name}: analysis failed: {future.exception()!r}")
+            return
+        self.readings = future.result()
+
+    def stats(self):
+        """Counters, with throughput since the previous call."""
+        now = time.monotonic()
+        then, bytes_then, samples_then = self._last
+        self._last = (now, self.bytes_in, self.samples)
+        elapsed = max(now - then, 1e-9)
+        s = self.decoder.stats()
+        return {
+            'bytes_in': self.bytes_in,
+            'bytes_per_second': (self.bytes_in - bytes_then) / elapsed,
+            'samples': self.samples,
+            'samples_per_second': (self.samples - samples_then) / elapsed,
+            'lost_frames': s.get('lost_frames', 0),
+            'corrupt_frames': s.get('corrupt_frames', 0),
+            'dropped_frames': s.get('dropped_frames', 0),
+            'resyncs': s.get('resyncs', 0),
+            'analysis_drops': self.analysis_drops,
+            'analysis_errors': self.analysis_errors,
+            'max_waiting': self.max_waiting,
+            'wakeups': self.wakeups,
+        }
+
+    def report(self):
+        s = self.stats()
+        r = self.readings
+        if r.get('rate') is not None:
+            reading = f"{r['bph']} bph {r['rate']:+.1f} s/day, beat error {r['beat_error']:.2f} ms"
+            if r.get('amplitude') is not None:
+                reading += f", {r['amplitude']:.0f} deg"
+        else:
+            reading = "settling"
+        return (f"{self.name}: {s['bytes_per_second'] / 1e3:.1f} kB/s, "
+                f"{s['samples_per_second']:.0f} samples/s; lost {s['lost_frames']}, "
+                f"corrupt {s['corrupt_frames']}, dropped {s['dropped_frames']} frames, "
+                f"{s['analysis_drops']} blocks unanalysed, backlog max "
+                f"{s['max_waiting'] / 1e3:.1f} kB; {reading}")
+
+
+class MultiStation:
+    """Services several heads from one asyncio event loop.
+
+    Every port is a non-blocking file descriptor with a reader callback, so
+    nothing sleeps or polls; each station keeps its own framing and decode
+    state. Analysis goes to `jobs` single-process executors, station i to
+    executor i % jobs.
+    """
+
+    def __init__(self, ports, jobs=JOBS, baud_rate=BAUD_RATE, protocol=FRAME_PROTOCOL,
+                 lift_angle=LIFT_ANGLE):
+        self.jobs = max(1, min(jobs, len(ports)))
+        self.workers = [concurrent.futures.ProcessPoolExecutor(max_workers=1)
+                        for _ in range(self.jobs)]
+        self.stations = [Station(name, path, self.workers[i % self.jobs], baud_rate,
+                                 protocol, lift_angle)
+                         for i, (name, path) in enumerate(ports)]
+
+    async def run(self, seconds=None, stats_interval=STATS_INTERVAL_SECONDS):
+        """Reads every station until `seconds` have passed (or for ever, or
+        until every port has closed); prints a report every `stats_interval`."""
+        loop = asyncio.get_running_loop()
+        # Start the workers first, so their start-up does not hold up the data.
+        await asyncio.gather(*(loop.run_in_executor(w, os.getpid) for w in self.workers))
+        for station in self.stations:
+            station.open(loop)
+        print(f"Reading {len(self.stations)} stations, analysis on {self.jobs} processes.")
+        start = loop.time()
+        next_report = start + stats_interval
+        # Wakes the loop below as soon as the last port closes.
+        all_closed = asyncio.ensure_future(asyncio.gather(*(s.done.wait() for s in self.stations)))
+        try:
+            while not all_closed.done():
+                now = loop.time()
+                if seconds is not None and now - start >= seconds:
+                    break
+                wait = next_report - now
+                if seconds is not None:
+                    wait = min(wait, start + seconds - now)
+                await asyncio.wait([all_closed], timeout=max(wait, 0))
+                if not all_closed.done() and loop.time() >= next_report:
+                    next_report += stats_interval
+                    self.print_report()
+        finally:
+            all_closed.cancel()
+            for station in self.stations:
+                station.close()
+            # Let the analysis already submitted finish.
+            while any(s.in_flight for s in self.stations):
+                await asyncio.sleep(0.01)
+
+    def print_report(self):
+        for station in self.stations:
+            print(f"  {station.report()}")
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.shutdown()
+
+
+def parse_ports(specs):
+    """'/dev/ttyUSB0' or 'bench1=/dev/ttyUSB0' -> (name, path)."""
+    ports = []
+    for i, spec in enumerate(specs):
+        name, _, path = spec.rpartition('=')
+        ports.append((name or f"head{i + 1}", path))
+    return ports
+
+
+# --- Self-check ---
+
+def _run_heads(connection, count, seconds, speed):
+    """Child process: `count` simulated heads, each a SyntheticSource served
+    on a pseudo-terminal by a PtyDevice, paced by its sample clock. The
+    devices never wait for the reader; what a pty cannot take is dropped
+    and counted, as a real UART's FIFO would overflow."""
+    from sources import PtyDevice, SyntheticSource
+    from synthetic_watch import WatchSignal
+    devices = []
+    for i in range(count):
+        watch = WatchSignal(bph=SELFCHECK_BPH[i % len(SELFCHECK_BPH)],
+                            rate_error=SELFCHECK_RATES[i % len(SELFCHECK_RATES)],
+                            beat_error=0.3, noise=0.03, seed=i)
+        devices.append(PtyDevice(SyntheticSource(watch, HEAD_FORMAT, speed=speed)))
+    connection.send([d.path for d in devices])
+    connection.recv()  # The reader is ready
+    for device in devices:
+        device.source.reset_input_buffer()  # Start the clock now, not at creation
+        device.start()
+    time.sleep(seconds)
+    for device in devices:
+        device.stop()
+    connection.send([{'path': d.path, 'sent': d.bytes_written, 'overrun': d.overrun_bytes}
+                     for d in devices])
+    connection.recv()  # The reader has drained the ports
+    for device in devices:
+        device.close()
+
+
+async def _selfcheck_run(runner, connection, seconds):
+    """Runs the stations until the heads have stopped and everything they
+    sent has been read."""
+    loop = asyncio.get_running_loop()
+    task = asyncio.ensure_future(runner.run())
+    await asyncio.sleep(0.2)
+    connection.send('ready')
+    sent = await loop.run_in_executor(None, connection.recv)
+    deadline = loop.time() + 5
+    while loop.time() < deadline and any(
+            s.bytes_in < h['sent'] for s, h in zip(runner.stations, sent)):
+        await asyncio.sleep(0.05)
+    for station in runner.stations:
+        station.close()
+    await task
+    connection.send('done')
+    return sent
+
+
+def run_selfcheck(stations=SELFCHECK_STATIONS, seconds=SELFCHECK_SECONDS, jobs=JOBS, speed=1.0):
+    """`stations` simulated heads on pseudo-terminals, each with its own
+    rate, serviced for `seconds`: every byte sent must be read, with no
+    frame lost and no block left unanalysed, and every station must read
+    its own watch's rate."""
+    parent, child = multiprocessing.Pipe()
+    heads = multiprocessing.Process(target=_run_heads, args=(child, stations, seconds, speed),
+                                    daemon=True)
+    heads.start()
+    paths = parent.recv()
+    runner = MultiStation([(f"head{i + 1}", path) for i, path in enumerate(paths)], jobs)
+    started = time.process_time()
+    sent = asyncio.run(_selfcheck_run(runner, parent, seconds))
+    cpu = time.process_time() - started
+    heads.join(timeout=5)
+    runner.print_report()
+    runner.shutdown()
+
+    ok = True
+    total = 0
+    for i, (station, head) in enumerate(zip(runner.stations, sent)):
+        s = station.stats()
+        r = station.readings
+        total += s['bytes_in']
+        rate = SELFCHECK_RATES[i % len(SELFCHECK_RATES)]
+        lossless = (head['overrun'] == 0 and s['bytes_in'] == head['sent']
+                    and s['lost_frames'] == 0 and s['corrupt_frames'] == 0
+                    and s['dropped_frames'] == 0 and s['analysis_drops'] == 0
+                    and s['analysis_errors'] == 0)
+        # The readings need a few seconds of beats; with time for them, they
+        # must be this station's watch and no other.
+        reading_ok = (seconds < 8 or speed != 1.0 or (
+            r.get('bph') == SELFCHECK_BPH[i % len(SELFCHECK_BPH)]
+            and r.get('rate') is not None and abs(r['rate'] - rate) < 1.5))
+        passed = lossless and reading_ok
+        ok &= passed
+        print(f"  {station.name}: sent {head['sent']} bytes ({head['overrun']} overrun), read "
+              f"{s['bytes_in']}, {s['lost_frames']} frames lost, {s['analysis_drops']} blocks "
+              f"unanalysed; made at {rate:+.1f} s/day  {'ok' if passed else 'FAIL'}")
+    print(f"  {stations} heads, {total / seconds / 1e6:.2f} MB/s in all for {seconds:g} s; "
+          f"event loop process used {cpu / seconds:.0%} of a core")
+    print("PASS" if ok else "FAIL")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Read and analyse several timegrapher heads from one process.")
+    parser.add_argument('ports', nargs='*', help="serial ports, optionally named: bench1=/dev/ttyUSB0")
+    parser.add_argument('--baud', type=int, default=BAUD_RATE)
+    parser.add_argument('--protocol', default=FRAME_PROTOCOL)
+    parser.add_argument('--jobs', type=int, default=JOBS, help="analysis worker processes")
+    parser.add_argument('--lift-angle', type=float, default=LIFT_ANGLE)
+    parser.add_argument('--seconds', type=float, help="stop after this long")
+    parser.add_argument('--interval', type=float, default=STATS_INTERVAL_SECONDS,
+                        help="seconds between reports")
+    parser.add_argument('--selfcheck', action='store_true',
+                        help="service simulated heads on pseudo-terminals and check for loss")
+    parser.add_argument('--stations', type=int, default=SELFCHECK_STATIONS)
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help="self-check heads send this many times faster than real time")
+    args = parser.parse_args()
+    if args.selfcheck:
+        raise SystemExit(0 if run_selfcheck(args.stations, args.seconds or SELFCHECK_SECONDS,
+                                            args.jobs, args.speed) else 1)
+    if not args.ports:
+        parser.error("at least one port is required")
+    runner = MultiStation(parse_ports(args.ports), args.jobs, args.baud, args.protocol,
+                          args.lift_angle)
+    try:
+        asyncio.run(runner.run(args.seconds, args.interval))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        runner.print_report()
+        runner.shutdown()
@@ -1,10 +1,14 @@
 # pc_audio_player_final.py
+import argparse
 import serial
 import sounddevice as sd
 import numpy as np
-import queue
 import threading
 import time
+from jitter_buffer import JitterBuffer
+from metrics import registry, MetricsReporter
+from sample_ring import SampleRing
+from sources import open_source
 
 # --- Configuration ---
 SERIAL_PORT = '/dev/ttyUSB0'
@@ -13,30 +17,46 @@ SAMPLE_RATE = 32000
 CHANNELS = 1
 DTYPE = 'int32'
 BYTES_PER_SAMPLE = 4
+# 'serial' for the port above, or 'broker' to listen through a running broker.py
+SOURCE = 'serial'
 
-# A large, thread-safe queue to act as our primary buffer
-audio_queue = queue.Queue(maxsize=400) # Increased size for a larger buffer
+# A large, preallocated ring to act as our primary buffer. The reader thread
+# is its only writer and the audio callback its only reader.
+RING_CAPACITY = 65536 # ~2s of audio
+audio_ring = SampleRing(RING_CAPACITY, dtype=DTYPE)
+# Plays the ring at the sound card's clock, resampling slightly to follow
+# the Pico's, so the buffer neither runs dry nor grows.
+playback = JitterBuffer(audio_ring, SAMPLE_RATE)
+
+# Counted in the callback, printed by a reporter thread: printing from the
+# callback itself would make the glitch worse.
+METRICS_INTERVAL_SECONDS = 10
+underflows = registry.counter('audio.underflows')
+callback_times = registry.histogram('callback')
+registry.gauge('ring.audio', source=audio_ring.occupancy)
+registry.gauge('playback.latency', 'ms', source=lambda: round(playback.latency_ms, 1))
+registry.gauge('playback.drift', 'ppm', source=lambda: round(playback.drift_ppm, 1))
 
 # A flag to signal the reader thread to stop
 stop_thread = False
 
 def serial_reader_thread():
     """
-    Reads data from serial port as fast as possible and puts it into a queue.
+    Reads data from serial port as fast as possible straight into the sample ring.
     This version is non-blocking and much more efficient.
     """
     global stop_thread
     print("Serial reader thread started.")
     try:
-        with serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1) as ser:
-            print(f"Listening on {SERIAL_PORT}...")
+        with open_source(SOURCE, SERIAL_PORT, BAUD_RATE) as ser:
+            print(f"Listening on {SOURCE} ({SERIAL_PORT})...")
             while not stop_thread:
                 # --- KEY IMPROVEMENT: NON-BLOCKING READ ---
                 # Check how many bytes are waiting in the serial input buffer
                 if ser.in_waiting > 0:
-                    # Read all available bytes
-                    data_chunk = ser.read(ser.in_waiting)
-                    audio_queue.put(data_chunk)
+                    # Read all available bytes straight into the ring,
+                    # sign-extended so the playback buffer can resample them.
+                    audio_ring.readinto_from(ser, ser.in_waiting)
                 else:
                     # Briefly sleep if no data is waiting, to prevent a busy-loop
                     time.sleep(0.001)
@@ -48,55 +68,32 @@ def serial_reader_thread():
     print("Serial reader thread finished.")
 
 
-def audio_callback(outdata, frames, time, status):
+def audio_callback(outdata, frames, time_info, status):
     """This function is called by sounddevice to get more audio data."""
+    start = time.perf_counter()
     if status.output_underflow:
-        print('Output underflow!')
-
-    required_bytes = frames * BYTES_PER_SAMPLE
-    buffer = b''
+        underflows.add()
 
-    # Pull data from the queue until we have enough for this callback
-    while len(buffer) < required_bytes:
-        try:
-            chunk = audio_queue.get_nowait()
-            buffer += chunk
-        except queue.Empty:
-            # Queue is empty, stop trying to fill the buffer
-            print("Warning: Queue empty, outputting some silence.")
-            break
-            
-    # --- THIS IS THE FIX ---
-    # Ensure the buffer length is a multiple of the sample size (4 bytes)
-    # This trims off any partial samples from the end of the buffer.
-    safe_length = (len(buffer) // BYTES_PER_SAMPLE) * BYTES_PER_SAMPLE
-    safe_buffer = buffer[:safe_length]
-    # ---------------------
-
-    # Convert the now-safe buffer to a NumPy array
-    audio_data = np.frombuffer(safe_buffer, dtype=DTYPE)
-    
-    len_available = len(audio_data)
-    len_needed = frames
-    
-    if len_available >= len_needed:
-        # We have enough, provide the requested number of frames
-        outdata[:] = audio_data[:len_needed].reshape(-1, 1)
-    else:
-        # Not enough data, provide what we have and pad the rest with silence
-        outdata.fill(0)
-        if len_available > 0:
-            outdata[:len_available] = audio_data.reshape(-1, 1)
+    # Play from the ring through the jitter buffer. Partial samples stay in
+    # the ring until their last byte arrives; if there is not enough data
+    # the rest is padded with silence and counted as an underrun.
+    playback.fill(outdata[:, 0])
+    callback_times.record(time.perf_counter() - start)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play the live audio stream.")
+    parser.add_argument('--source', default=SOURCE, help="'serial', 'serial:/dev/...', 'broker' or 'broker:ADDRESS'")
+    SOURCE = parser.parse_args().source
+
     reader = threading.Thread(target=serial_reader_thread)
     reader.daemon = True
     reader.start()
 
     print("Priming audio buffer for 0.5 seconds...")
     time.sleep(0.5)
-    print(f"Buffer has {audio_queue.qsize()} chunks. Starting audio stream.")
+    print(f"Buffer has {audio_ring.occupancy()} samples. Starting audio stream.")
 
+    reporter = MetricsReporter(registry, METRICS_INTERVAL_SECONDS).start()
     try:
         with sd.OutputStream(samplerate=SAMPLE_RATE, channels=CHANNELS, dtype=DTYPE, callback=audio_callback):
             print("Audio stream started. Press Enter to stop.")
@@ -107,4 +104,8 @@ if __name__ == "__main__":
     finally:
         print("Stopping stream...")
         stop_thread = True
-        reader.join(timeout=2)
\ No newline at end of file
+        reader.join(timeout=2)
+        reporter.stop()
+        reporter.emit()
+        print(f"Audio: {audio_ring.report()}")
+        print(f"Playback: {playback.report()}")
\ No newline at end of file
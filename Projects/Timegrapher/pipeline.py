@@ -0,0 +1,339 @@
+# pipeline.py
+import argparse
+import functools
+import multiprocessing as mp
+import sys
+import threading
+import time
+import numpy as np
+from analysis import run_analysis
+from framing import (FrameDecoder, decode_samples, encode_sequenced_frames,
+                     PAYLOAD_SIZE, PROTOCOL_AUTO)
+from dsp import DSPChain
+from sample_ring import SampleRing
+from sources import open_source
+
+# --- Configuration ---
+SERIAL_PORT = '/dev/ttyUSB0'
+BAUD_RATE = 2000000
+SAMPLE_RATE = 32000
+
+# --- Ring Sizes ---
+RAW_RING_BYTES = 1 << 21        # ~10s of wire data at 2 Mbaud
+SAMPLE_RING_CAPACITY = 1 << 19  # ~16s of samples at 32 kHz
+CONSUMERS = ('playback', 'plot')
+RESULTS_QUEUE_SIZE = 256        # Analysis messages waiting for the UI, ~4s of them
+
+# --- Stage Configuration ---
+INGEST_READ_SIZE = 16384
+DECODE_READ_SIZE = 16384
+IDLE_SLEEP_SECONDS = 0.001
+STATS_INTERVAL_SECONDS = 10
+
+# --- Self-test Configuration ---
+SELFTEST_DURATION_SECONDS = 6
+SELFTEST_STALL_SECONDS = 3
+
+
+# --- Stages ---
+# Each stage runs in its own process and only talks to the others through
+# shared-memory rings, so no stage can hold the GIL of another.
+
+def ingest_stage(open_port, raw_ring_name, stop_event):
+    """Serial ingest: reads the port straight into the raw byte ring."""
+    raw_ring = SampleRing.attach(raw_ring_name)
+    try:
+        with open_port() as port:
+            port.reset_input_buffer()
+            while not stop_event.is_set():
+                waiting = port.in_waiting
+                if waiting:
+                    raw_ring.readinto_from(port, min(waiting, INGEST_READ_SIZE), sign_extend=False)
+                else:
+                    time.sleep(IDLE_SLEEP_SECONDS)
+    except Exception as e:
+        print(f"Ingest process error: {e}")
+    finally:
+        raw_ring.close()
+
+
+def decode_stage(raw_ring_name, sample_ring_names, stop_event, protocol, payload_size, dsp=''):
+    """Decoding: frames the raw bytes, runs the samples through the DSP chain
+    (see dsp.parse_chain) and fans them out to every consumer ring."""
+    raw_ring = SampleRing.attach(raw_ring_name)
+    sample_rings = [SampleRing.attach(name) for name in sample_ring_names]
+    decoder = FrameDecoder(protocol, payload_size=payload_size)
+    chain = DSPChain(dsp)
+    scratch = np.empty(DECODE_READ_SIZE, dtype=np.uint8)
+    try:
+        while not stop_event.is_set():
+            n = raw_ring.read_available(scratch)
+            if n == 0:
+                time.sleep(IDLE_SLEEP_SECONDS)
+                continue
+            payloads = decoder.feed(scratch[:n])
+            if len(payloads):
+                samples = chain.process(decode_samples(payloads))
+                for ring in sample_rings:
+                    ring.write(samples)
+    except Exception as e:
+        print(f"Decode process error: {e}")
+    finally:
+        print(f"Decoder: {decoder.report()}")
+        if chain.stages:
+            print(f"DSP: {chain.report()}")
+        for ring in sample_rings:
+            ring.close()
+        raw_ring.close()
+
+
+def analysis_stage(sample_ring_name, results, stop_event, options):
+    """Beat analysis (analysis.run_analysis) on its own consumer ring; what
+    the display needs goes back on the `results` queue."""
+    ring = SampleRing.attach(sample_ring_name)
+    try:
+        run_analysis(ring, results, stop_event.is_set, **options)
+    except Exception as e:
+        print(f"Analysis process error: {e}")
+    finally:
+        # The UI may stop reading first; don't wait on it to exit.
+        results.cancel_join_thread()
+        ring.close()
+
+
+class Pipeline:
+    """Runs serial ingest and decoding in their own processes.
+
+    The calling process (UI and playback) gets one `SampleRing` per consumer
+    in `rings`, each backed by shared memory, and reads decoded int32 samples
+    from it directly; `dsp` names the filter chain they pass through on the
+    way (dsp.parse_chain, '' for none). Throughput and lag of every stage are derived from the
+    ring cursors, which all processes can see.
+
+    With `analysis` (analysis.run_analysis options, {} for the defaults),
+    beat analysis runs in a third process on an 'analysis' ring of its own,
+    and its messages arrive on the `results` queue.
+    """
+
+    def __init__(self, open_port=open_source, protocol=PROTOCOL_AUTO, payload_size=PAYLOAD_SIZE,
+                 consumers=CONSUMERS, raw_capacity=RAW_RING_BYTES,
+                 sample_capacity=SAMPLE_RING_CAPACITY, dsp='', analysis=None):
+        self.open_port = open_port
+        self.protocol = protocol
+        self.payload_size = payload_size
+        self.consumers = consumers
+        self.raw_capacity = raw_capacity
+        self.sample_capacity = sample_capacity
+        self.dsp = dsp
+        self.analysis = analysis
+        self.raw_ring = None
+        self.rings = {}
+        self.results = None
+        self._stop_event = None
+        self._processes = []
+        self._last_snapshot = None
+        self._reporter = None
+
+    def start(self):
+        self.raw_ring = SampleRing.create_shared(self.raw_capacity, dtype=np.uint8)
+        consumers = tuple(self.consumers) + (('analysis',) if self.analysis is not None else ())
+        self.rings = {name: SampleRing.create_shared(self.sample_capacity, dtype='int32')
+                      for name in consumers}
+        self._stop_event = mp.Event()
+        self._processes = [
+            mp.Process(target=ingest_stage, name='ingest', daemon=True,
+                       args=(self.open_port, self.raw_ring.name, self._stop_event)),
+            mp.Process(target=decode_stage, name='decode', daemon=True,
+                       args=(self.raw_ring.name, [ring.name for ring in self.rings.values()],
+                             self._stop_event, self.protocol, self.payload_size, self.dsp)),
+        ]
+        if self.analysis is not None:
+            self.results = mp.Queue(RESULTS_QUEUE_SIZE)
+            self._processes.append(
+                mp.Process(target=analysis_stage, name='analysis', daemon=True,
+                           args=(self.rings['analysis'].name, self.results, self._stop_event,
+                                 self.analysis)))
+        for process in self._processes:
+            process.start()
+        self._last_snapshot = (time.monotonic(), self._counters())
+        return self
+
+    def stop(self):
+        if self._stop_event is None:
+            return
+        self._stop_event.set()
+        for process in self._processes:
+            process.join(timeout=2)
+            if process.is_alive():
+                process.terminate()
+        for ring in self.rings.values():
+            ring.close()
+        self.raw_ring.close()
+        self._stop_event = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _counters(self):
+        counters = {'raw_written': self.raw_ring.written, 'raw_consumed': self.raw_ring.consumed}
+        for name, ring in self.rings.items():
+            counters[f'{name}_written'] = ring.written
+            counters[f'{name}_consumed'] = ring.consumed
+        return counters
+
+    def snapshot(self):
+        """Per-stage throughput since the last call, and current lag."""
+        now, counters = time.monotonic(), self._counters()
+        then, previous = self._last_snapshot
+        self._last_snapshot = (now, counters)
+        elapsed = max(now - then, 1e-9)
+
+        def rate(key):
+            return (counters[key] - previous[key]) / elapsed
+
+        stages = {
+            'ingest': {'bytes_per_s': rate('raw_written'), 'overruns': self.raw_ring.overruns},
+            'decode': {'bytes_per_s': rate('raw_consumed'),
+                       'lag_bytes': self.raw_ring.occupancy()},
+        }
+        for name, ring in self.rings.items():
+            stages['decode'][f'{name}_samples_per_s'] = rate(f'{name}_written')
+            stages[name] = {
+                'samples_per_s': rate(f'{name}_consumed'),
+                'lag_samples': ring.occupancy(),
+                'lag_seconds': ring.occupancy() / SAMPLE_RATE,
+                'overruns': ring.overruns,
+            }
+        return stages
+
+    def report(self):
+        stages = self.snapshot()
+        parts = [f"ingest {stages['ingest']['bytes_per_s'] / 1000:.1f} kB/s",
+                 f"decode {stages['decode']['bytes_per_s'] / 1000:.1f} kB/s "
+                 f"(lag {stages['decode']['lag_bytes']} B)"]
+        for name in self.rings:
+            stage = stages[name]
+            parts.append(f"{name} {stage['samples_per_s']:.0f} samples/s "
+                         f"(lag {stage['lag_seconds'] * 1000:.0f} ms, {stage['overruns']} overruns)")
+        return ", ".join(parts)
+
+    def start_reporter(self, interval=STATS_INTERVAL_SECONDS):
+        """Prints `report()` every `interval` seconds from a daemon thread."""
+        def run():
+            while self._stop_event is not None and not self._stop_event.wait(interval):
+                print(f"Pipeline: {self.report()}")
+        self._reporter = threading.Thread(target=run, daemon=True)
+        self._reporter.start()
+
+
+# --- Self-test ---
+
+class RampPort:
+    """Stand-in for the serial port that produces sequenced frames in real time.
+
+    Sample n carries the value n modulo 2**23, so the consumer can check that
+    nothing was lost or duplicated anywhere in the pipeline.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE, payload_size=PAYLOAD_SIZE):
+        self.samples_per_frame = payload_size // 4
+        self.frame_rate = sample_rate / self.samples_per_frame
+        self._pending = bytearray()
+        self._frames_sent = 0
+        self._start = time.monotonic()
+
+    def _generate(self):
+        due = int((time.monotonic() - self._start) * self.frame_rate) - self._frames_sent
+        if due > 0:
+            first = self._frames_sent * self.samples_per_frame
+            ramp = (np.arange(first, first + due * self.samples_per_frame) & 0x7FFFFF).astype('<i4')
+            payloads = ramp.view(np.uint8).reshape(due, -1)
+            self._pending += encode_sequenced_frames(payloads, first_seq=self._frames_sent)
+            self._frames_sent += due
+
+    @property
+    def in_waiting(self):
+        self._generate()
+        return len(self._pending)
+
+    def readinto(self, buf):
+        # Like a serial port with a timeout: wait for data rather than spin.
+        if not self._pending:
+            time.sleep(1 / self.frame_rate)
+            self._generate()
+        n = min(len(buf), len(self._pending))
+        buf[:n] = self._pending[:n]
+        del self._pending[:n]
+        return n
+
+    def __enter__(self):
+        return self
+
+    def reset_input_buffer(self):
+        self._pending.clear()
+
+    def __exit__(self, *exc):
+        pass
+
+
+def run_selftest(duration=SELFTEST_DURATION_SECONDS, stall=SELFTEST_STALL_SECONDS):
+    """Checks that no sample is lost at 32 kHz while the UI process stalls.
+
+    The UI side (this process) does not read at all for `stall` seconds, then
+    drains the playback ring and verifies the ramp is complete.
+    """
+    print(f"Self-test: {duration}s of 32 kHz ramp, UI stalled for the first {stall}s...")
+    received = []
+    with Pipeline(RampPort, consumers=('playback',)) as pipeline:
+        ring = pipeline.rings['playback']
+        time.sleep(stall)
+        print(f"  After stall: {pipeline.report()}")
+        scratch = np.empty(SAMPLE_RATE, dtype=np.int32)
+        end = time.monotonic() + duration - stall
+        while time.monotonic() < end:
+            n = ring.read_available(scratch)
+            if n:
+                received.append(scratch[:n].copy())
+            else:
+                time.sleep(0.01)
+        print(f"  At the end: {pipeline.report()}")
+        overruns = ring.overruns + pipeline.raw_ring.overruns
+
+    samples = np.concatenate(received) if received else np.empty(0, dtype=np.int32)
+    steps = np.diff(samples.astype(np.int64)) & 0x7FFFFF
+    gaps = int(np.count_nonzero(steps != 1))
+    expected = int(duration * SAMPLE_RATE)
+    ok = len(samples) > 0 and samples[0] == 0 and gaps == 0 and overruns == 0 \
+        and len(samples) > 0.9 * expected
+    print(f"  Received {len(samples)} samples (~{expected} produced), {gaps} discontinuities, "
+          f"{overruns} overruns.")
+    print("PASS" if ok else "FAIL")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multi-process serial/decode pipeline.")
+    parser.add_argument('--selftest', action='store_true',
+                        help="check that no samples are lost while the UI process stalls")
+    parser.add_argument('--duration', type=float, default=SELFTEST_DURATION_SECONDS)
+    parser.add_argument('--stall', type=float, default=SELFTEST_STALL_SECONDS)
+    args = parser.parse_args()
+
+    if args.selftest:
+        sys.exit(0 if run_selftest(args.duration, args.stall) else 1)
+
+    # Without --selftest, just run the pipeline against the serial port and
+    # print the stage statistics, discarding the samples.
+    with Pipeline(functools.partial(open_source, 'serial', SERIAL_PORT, BAUD_RATE)) as pipeline:
+        pipeline.start_reporter()
+        scratch = np.empty(SAMPLE_RATE, dtype=np.int32)
+        try:
+            while True:
+                for ring in pipeline.rings.values():
+                    ring.read_available(scratch)
+                time.sleep(0.1)
+        except KeyboardInterrupt:
+            pass
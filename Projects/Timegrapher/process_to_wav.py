@@ -1,69 +1,296 @@
 # process_and_align_final.py
-import wave
+import argparse
+import mmap
+import os
+import resource
+import struct
+import tempfile
+import time
 import numpy as np
+from alignment import Aligner
+from capture_format import CaptureReader, is_capture_file
+from framing import FrameDecoder, decode_samples, detect_protocol, DETECT_LIMIT, PAYLOAD_SIZE
 
 # --- Configuration ---
 INPUT_FILENAME = 'raw_audio_misaligned.bin'
 OUTPUT_FILENAME = 'final_audio_aligned.wav'
 AUDIO_FORMAT = {'rate': 32000, 'channels': 1, 'width': 4} # 4 bytes for 32-bit
 
-def process_and_align_file():
+# --- Streaming Configuration ---
+# Memory use is a few blocks, whatever the size of the capture.
+BLOCK_BYTES = 4 << 20
+RIFF_SIZE_LIMIT = 0xFFFFFFFF     # Above this the file is written as RF64
+
+# --- Benchmark Configuration ---
+BENCH_SIZES_MB = (64, 256)
+
+
+class StreamingWavWriter:
+    """Writes a PCM WAV file one block at a time.
+
+    The header reserves a JUNK chunk the size of an RF64 'ds64' chunk, so
+    when the data ends up larger than a RIFF file can describe (4 GB), the
+    header is rewritten as RF64 in place on `close` and nothing has to move.
+    Files under 4 GB are ordinary WAV files any reader can open.
+    """
+
+    _JUNK_SIZE = 28  # ds64: RIFF size, data size, sample count (8 bytes each), table length
+
+    def __init__(self, filename, rate, channels, width):
+        self.filename = filename
+        self.block_align = channels * width
+        self.data_bytes = 0
+        self._f = open(filename, 'wb')
+        fmt = struct.pack('<HHIIHH', 1, channels, rate, rate * self.block_align,
+                          self.block_align, width * 8)
+        self._f.write(b'RIFF' + struct.pack('<I', 0) + b'WAVE'
+                      + b'JUNK' + struct.pack('<I', self._JUNK_SIZE) + bytes(self._JUNK_SIZE)
+                      + b'fmt ' + struct.pack('<I', len(fmt)) + fmt
+                      + b'data' + struct.pack('<I', 0))
+        self._data_start = self._f.tell()
+
+    def write(self, samples):
+        """Appends little-endian samples (any contiguous array)."""
+        data = memoryview(np.ascontiguousarray(samples)).cast('B')
+        self._f.write(data)
+        self.data_bytes += len(data)
+
+    @property
+    def is_rf64(self):
+        return self._data_start - 8 + self.data_bytes > RIFF_SIZE_LIMIT
+
+    def close(self):
+        if self._f is None:
+            return
+        if self.data_bytes % 2:
+            self._f.write(b'\0')  # Chunks are word aligned
+        riff_size = self._f.tell() - 8
+        if self.is_rf64:
+            self._f.seek(0)
+            self._f.write(b'RF64' + struct.pack('<I', RIFF_SIZE_LIMIT) + b'WAVE'
+                          + b'ds64' + struct.pack('<IQQQI', self._JUNK_SIZE, riff_size,
+                                                  self.data_bytes,
+                                                  self.data_bytes // self.block_align, 0))
+            self._f.seek(self._data_start - 4)
+            self._f.write(struct.pack('<I', RIFF_SIZE_LIMIT))
+        else:
+            self._f.seek(4)
+            self._f.write(struct.pack('<I', riff_size))
+            self._f.seek(self._data_start - 4)
+            self._f.write(struct.pack('<I', self.data_bytes))
+        self._f.close()
+        self._f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _PageReleaser:
+    """Tells the kernel it can drop mapped input pages we are done with, so
+    resident memory stays flat on long files."""
+
+    def __init__(self, mm):
+        self.mm = mm
+        self.released = 0
+
+    def release_up_to(self, end):
+        end -= end % mmap.PAGESIZE
+        if end > self.released and hasattr(mmap, 'MADV_DONTNEED'):
+            self.mm.madvise(mmap.MADV_DONTNEED, self.released, end - self.released)
+            self.released = end
+
+
+def _convert_raw(mm, writer, progress, verbose=True):
+    """Unframed stream: aligned by the sign-extension check, block by block,
+    so a dropped byte only costs the sample it was in."""
+    aligner = Aligner(verbose=verbose)
+    releaser = _PageReleaser(mm)
+    # Released on the way out even on an error, or mm.close() would fail.
+    with memoryview(mm) as view:
+        for pos in range(0, len(mm), BLOCK_BYTES):
+            samples = aligner.feed(view[pos:pos + BLOCK_BYTES])
+            if len(samples):
+                writer.write(samples)
+            releaser.release_up_to(pos + BLOCK_BYTES)
+            progress(min(pos + BLOCK_BYTES, len(mm)))
+    writer.write(aligner.flush())
+    print(f"Alignment: {aligner.report()}")
+    return aligner.slips
+
+
+def _convert_framed(mm, protocol, writer, progress):
+    """SOF-framed stream: deframe block by block, then decode."""
+    decoder = FrameDecoder(protocol, payload_size=PAYLOAD_SIZE)
+    releaser = _PageReleaser(mm)
+    with memoryview(mm) as view:
+        for pos in range(0, len(mm), BLOCK_BYTES):
+            payloads = decoder.feed(view[pos:pos + BLOCK_BYTES])
+            if len(payloads):
+                writer.write(decode_samples(payloads))
+            releaser.release_up_to(pos + BLOCK_BYTES)
+            progress(min(pos + BLOCK_BYTES, len(mm)))
+    # The last frame has no marker after it to confirm it.
+    payloads = decoder.flush()
+    if len(payloads):
+        writer.write(decode_samples(payloads))
+    print(f"Deframing: {decoder.report()}")
+
+
+def convert_capture_file(input_filename, output_filename):
+    """Capture files (capture_format) are already decoded: just copy the
+    samples out chunk by chunk."""
+    start = time.perf_counter()
+    with CaptureReader(input_filename) as reader, \
+            StreamingWavWriter(output_filename, reader.sample_rate, AUDIO_FORMAT['channels'],
+                               AUDIO_FORMAT['width']) as writer:
+        for _, _, samples in reader.iter_chunks():
+            writer.write(samples)
+        print(f"Capture file: {reader.duration:.1f} s at {reader.sample_rate} Hz, "
+              f"recorded {time.ctime(reader.start_time)}")
+    elapsed = time.perf_counter() - start
+    stats = {
+        'input_bytes': os.path.getsize(input_filename),
+        'samples': writer.data_bytes // AUDIO_FORMAT['width'],
+        'seconds': elapsed,
+        'mb_per_s': writer.data_bytes / elapsed / 1e6,
+        'rf64': writer.is_rf64,
+        'slips': 0,
+    }
+    print(f"Saved {stats['samples']} samples to '{output_filename}' at {stats['mb_per_s']:.0f} MB/s.")
+    return stats
+
+
+def process_and_align_file(input_filename=INPUT_FILENAME, output_filename=OUTPUT_FILENAME,
+                           verbose=True):
     """Reads a misaligned raw binary file, finds the correct alignment,
-    corrects the audio data, and saves a clean WAV file."""
-    
-    print(f"Reading raw data from '{INPUT_FILENAME}'...")
+    corrects the audio data, and saves a clean WAV file.
+
+    The input is memory-mapped and converted in fixed-size blocks, so this
+    works on captures of any length in constant memory. Unframed captures
+    are re-aligned wherever a byte was dropped; captures in the SOF frame
+    format are deframed instead, and capture files (.tgc) are decoded.
+    Returns a stats dict, or None on error.
+    """
+    print(f"Reading raw data from '{input_filename}'...")
+    if is_capture_file(input_filename):
+        return convert_capture_file(input_filename, output_filename)
     try:
-        with open(INPUT_FILENAME, 'rb') as f:
-            raw_bytes = f.read()
+        f = open(input_filename, 'rb')
     except FileNotFoundError:
-        print(f"Error: The file '{INPUT_FILENAME}' was not found.")
-        return
+        print(f"Error: The file '{input_filename}' was not found.")
+        return None
 
-    if not raw_bytes:
-        print("Error: Raw data file is empty.")
-        return
+    with f:
+        if os.fstat(f.fileno()).st_size == 0:
+            print("Error: Raw data file is empty.")
+            return None
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(mmap, 'MADV_SEQUENTIAL'):
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+        total = len(mm)
 
-    best_alignment = None
-    lowest_energy = float('inf')
+        start = time.perf_counter()
+        last_report = [start]
 
-    print("Finding optimal alignment by testing all 4 byte offsets...")
-    for offset in range(4):
-        sliced_bytes = raw_bytes[offset:]
-        safe_length = (len(sliced_bytes) // AUDIO_FORMAT['width']) * AUDIO_FORMAT['width']
-        trimmed_bytes = sliced_bytes[:safe_length]
+        def progress(pos):
+            now = time.perf_counter()
+            if verbose and now - last_report[0] > 1.0:
+                last_report[0] = now
+                print(f"  {pos / total:6.1%} ({pos / (now - start) / 1e6:.0f} MB/s)")
 
-        if not trimmed_bytes:
-            continue
+        protocol = detect_protocol(mm[:DETECT_LIMIT])
+        slips = []
+        try:
+            with StreamingWavWriter(output_filename, AUDIO_FORMAT['rate'], AUDIO_FORMAT['channels'],
+                                    AUDIO_FORMAT['width']) as writer:
+                if protocol is not None:
+                    print(f"Input is SOF-framed ({protocol}); deframing instead of offset testing.")
+                    _convert_framed(mm, protocol, writer, progress)
+                else:
+                    print("Finding alignment from the sign extension of each sample...")
+                    slips = _convert_raw(mm, writer, progress, verbose)
+        except Exception as e:
+            print(f"Error saving WAV file: {e}")
+            return None
+        finally:
+            mm.close()
 
-        # --- THE CRITICAL FIX IS HERE ---
-        # The '<' tells NumPy to interpret the bytes as LITTLE-ENDIAN integers.
-        raw_samples = np.frombuffer(trimmed_bytes, dtype='<i4')
+    elapsed = time.perf_counter() - start
+    stats = {
+        'input_bytes': total,
+        'samples': writer.data_bytes // AUDIO_FORMAT['width'],
+        'seconds': elapsed,
+        'mb_per_s': total / elapsed / 1e6,
+        'rf64': writer.is_rf64,
+        'slips': len(slips),
+    }
+    print(f"Saved {stats['samples']} samples to '{output_filename}'"
+          f"{' (RF64)' if stats['rf64'] else ''} at {stats['mb_per_s']:.0f} MB/s"
+          f"{f', {len(slips)} slips corrected' if slips else ''}.")
+    return stats
 
-        # The sign extension logic remains the same and will now work correctly.
-        corrected_samples = (raw_samples << 8) >> 8
 
-        energy = np.sum(np.abs(corrected_samples))
-        print(f"  - Offset {offset}: Energy = {energy}")
+# --- Benchmark ---
 
-        if energy < lowest_energy:
-            lowest_energy = energy
-            best_alignment = corrected_samples
+def _peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # kB on Linux
 
-    if best_alignment is None:
-        print("Error: Could not determine best alignment. Is the input file valid?")
-        return
 
-    print(f"Optimal alignment found. Saving corrected audio to '{OUTPUT_FILENAME}'...")
-    try:
-        with wave.open(OUTPUT_FILENAME, 'wb') as wf:
-            wf.setnchannels(AUDIO_FORMAT['channels'])
-            wf.setsampwidth(AUDIO_FORMAT['width'])
-            wf.setframerate(AUDIO_FORMAT['rate'])
-            # The WAV format standard is also little-endian.
-            wf.writeframes(best_alignment.astype('<i4').tobytes())
-        print("WAV file saved successfully.")
-    except Exception as e:
-        print(f"Error saving WAV file: {e}")
+def _write_bench_input(filename, size_mb, framed):
+    """Builds a capture of `size_mb` from the repo's sample capture.
+
+    Framed inputs repeat its whole frames; raw inputs repeat its decoded
+    samples with a 3-byte misalignment. Written in pieces so building the
+    file does not itself cost memory.
+    """
+    with open(INPUT_FILENAME, 'rb') as f:
+        capture = f.read()
+    first = capture.find(b'\xAA\x55')
+    frame_size = 2 + PAYLOAD_SIZE
+    frames = capture[first:first + (len(capture) - first) // frame_size * frame_size]
+    if framed:
+        unit = frames
+    else:
+        payloads = np.frombuffer(frames, dtype=np.uint8).reshape(-1, frame_size)[:, 2:]
+        unit = decode_samples(payloads).astype('<i4').tobytes()
+    with open(filename, 'wb') as f:
+        f.write(capture[:first] if framed else b'\x00\x12\x34')
+        written = 0
+        while written < size_mb * 1e6:
+            f.write(unit)
+            written += len(unit)
+
+
+def run_benchmark(sizes_mb=BENCH_SIZES_MB):
+    """Converts growing synthetic captures and reports MB/s and peak memory.
+
+    Peak RSS only ever grows within a process, so if it stays put as the
+    input grows, memory use does not depend on the file length.
+    """
+    print(f"Peak RSS before: {_peak_rss_mb():.0f} MB")
+    with tempfile.TemporaryDirectory() as tmp:
+        src, dst = os.path.join(tmp, 'capture.bin'), os.path.join(tmp, 'out.wav')
+        for framed in (False, True):
+            for size_mb in sizes_mb:
+                _write_bench_input(src, size_mb, framed)
+                stats = process_and_align_file(src, dst, verbose=False)
+                kind = 'framed' if framed else 'raw'
+                print(f"  {kind:6} {size_mb:5} MB: {stats['mb_per_s']:6.0f} MB/s, "
+                      f"peak RSS {_peak_rss_mb():.0f} MB\n")
+
 
 if __name__ == "__main__":
-    process_and_align_file()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Convert a raw capture to an aligned WAV file.")
+    parser.add_argument('input', nargs='?', default=INPUT_FILENAME)
+    parser.add_argument('output', nargs='?', default=OUTPUT_FILENAME)
+    parser.add_argument('--bench', action='store_true',
+                        help="convert synthetic captures of growing size and report MB/s and memory")
+    args = parser.parse_args()
+
+    if args.bench:
+        run_benchmark()
+    else:
+        process_and_align_file(args.input, args.output)
@@ -0,0 +1,349 @@
+# rate_estimator.py
+import argparse
+import collections
+import math
+import time
+import wave
+import numpy as np
+from beat_detector import BeatDetector
+from capture_format import CaptureReader, is_capture_file
+from synthetic_watch import WatchSignal, STANDARD_BPH
+
+# --- Configuration ---
+WINDOW_BEATS = 600          # Sliding window, e.g. 75 s at 28800 bph
+MIN_FIT_BEATS = 8           # Beats needed (per scope) before giving a reading
+Z_95 = 1.96                 # Confidence intervals are 95%
+SECONDS_PER_DAY = 86400
+
+# --- Outlier Rejection ---
+# A beat further than this from the windowed fit is ignored; after
+# RESET_AFTER rejections in a row the watch has changed (moved, knocked, a
+# different watch) and the estimate starts over.
+OUTLIER_SIGMAS = 6.0
+OUTLIER_FLOOR_SECONDS = 0.0005
+RESET_AFTER = 8
+
+# --- File Analysis Configuration ---
+READ_BLOCK_SAMPLES = 32768
+REPORT_INTERVAL_SECONDS = 10
+
+# --- Self-check Configuration ---
+SELFCHECK_SECONDS = 120
+BENCH_BEATS = 1_000_000
+
+
+Reading = collections.namedtuple('Reading', 'rate rate_ci beat_error beat_error_ci beats seconds')
+Reading.__doc__ = """Rate in s/day (positive = gaining) and beat error in ms, each with
+the half-width of its 95% confidence interval, from `beats` beats over
+`seconds`."""
+
+
+class _RegressionSums:
+    """Running sums for a straight-line fit of y against x. Points can be
+    removed again, which is what makes a sliding window O(1)."""
+
+    def __init__(self):
+        self.n = 0
+        self.sx = self.sy = self.sxx = self.sxy = self.syy = 0.0
+
+    def add(self, x, y, sign=1):
+        self.n += sign
+        self.sx += sign * x
+        self.sy += sign * y
+        self.sxx += sign * x * x
+        self.sxy += sign * x * y
+        self.syy += sign * y * y
+
+    def centred(self):
+        """(mean x, mean y, Sxx, Sxy, Syy) about the means."""
+        mx, my = self.sx / self.n, self.sy / self.n
+        return (mx, my, self.sxx - self.sx * mx, self.sxy - self.sx * my,
+                self.syy - self.sy * my)
+
+
+class _TickTockFit:
+    """Tick and tock series fitted as two parallel lines.
+
+    Times are kept as residuals from the nominal beat period, so the sums
+    stay small over hours. The shared slope is the period error (the rate);
+    the gap between the two lines is the beat error.
+    """
+
+    def __init__(self):
+        self.series = (_RegressionSums(), _RegressionSums())  # Even (tick), odd (tock) beats
+
+    def add(self, k, residual, sign=1):
+        self.series[k % 2].add(k, residual, sign)
+
+    @property
+    def n(self):
+        return self.series[0].n + self.series[1].n
+
+    def solve(self):
+        """(slope, tick intercept, tock intercept, residual sigma, slope
+        std err, intercept gap std err), or None without enough beats."""
+        even, odd = self.series
+        if min(even.n, odd.n) < MIN_FIT_BEATS // 2:
+            return None
+        ex, ey, exx, exy, eyy = even.centred()
+        ox, oy, oxx, oxy, oyy = odd.centred()
+        sxx = exx + oxx
+        if sxx <= 0:
+            return None
+        slope = (exy + oxy) / sxx
+        sse = max(0.0, eyy + oyy - slope * (exy + oxy))
+        sigma = math.sqrt(sse / max(1, self.n - 3))
+        slope_se = sigma / math.sqrt(sxx)
+        gap_se = sigma * math.sqrt(1 / even.n + 1 / odd.n + (ox - ex) ** 2 / sxx)
+        return slope, ey - slope * ex, oy - slope * ox, sigma, slope_se, gap_se
+
+
+class RateEstimator:
+    """Rate (s/day) and beat error (ms) from a stream of beat times.
+
+    Each beat is an O(1) update to running regression sums, for the whole
+    session and for a sliding window of the last `window_beats` accepted
+    beats. Beats are numbered from the time since the previous one, so a
+    missed beat does not shift the tick/tock series.
+    """
+
+    def __init__(self, bph, window_beats=WINDOW_BEATS):
+        self.bph = bph
+        self.nominal_period = 3600.0 / bph
+        self.window_beats = window_beats
+        self.rejected = 0
+        self.resets = 0
+        self._start()
+
+    def _start(self):
+        self._session = _TickTockFit()
+        self._window = _TickTockFit()
+        self._recent = collections.deque()  # (k, residual) in the window
+        self._rebase_countdown = self.window_beats
+        self._origin = None
+        self._last = None                  # (k, time) of the last accepted beat
+        self._first_time = self._last_time = None
+        self._fit = None
+        self._consecutive_rejects = 0
+
+    def add(self, t):
+        """Adds a beat at time `t` (seconds). Returns False if it was rejected."""
+        if self._origin is None:
+            self._origin = t
+            self._first_time = t
+            self._accept(0, t)
+            return True
+
+        last_k, last_t = self._last
+        period = self.nominal_period + (self._fit[0] if self._fit else 0.0)
+        k = last_k + round((t - last_t) / period)
+        residual = t - self._origin - k * self.nominal_period
+        if self._fit is not None:
+            slope, tick, tock, sigma = self._fit[:4]
+            predicted = (tock if k % 2 else tick) + slope * k
+            if k <= last_k or abs(residual - predicted) > max(OUTLIER_FLOOR_SECONDS,
+                                                                  OUTLIER_SIGMAS * sigma):
+                self.rejected += 1
+                self._consecutive_rejects += 1
+                if self._consecutive_rejects >= RESET_AFTER:
+                    self.resets += 1
+                    self._start()
+                    self.add(t)
+                return False
+        elif k <= last_k:
+            self.rejected += 1
+            return False
+
+        self._consecutive_rejects = 0
+        self._accept(k, t)
+        return True
+
+    def _accept(self, k, t):
+        residual = t - self._origin - k * self.nominal_period
+        self._session.add(k, residual)
+        self._window.add(k, residual)
+        self._recent.append((k, residual))
+        if len(self._recent) > self.window_beats:
+            self._window.add(*self._recent.popleft(), sign=-1)
+            self._rebase_countdown -= 1
+            if self._rebase_countdown == 0:
+                # Adding and removing leaves rounding behind; start the window
+                # sums afresh now and then (amortised O(1) per beat).
+                self._window = _TickTockFit()
+                for point in self._recent:
+                    self._window.add(*point)
+                self._rebase_countdown = self.window_beats
+        self._last = (k, t)
+        self._last_time = t
+        self._fit = self._window.solve()
+
+    def extend(self, times):
+        for t in times:
+            self.add(t)
+
+    def _reading(self, fit, beats, seconds):
+        solved = fit.solve()
+        if solved is None:
+            return None
+        slope, tick, tock, _, slope_se, gap_se = solved
+        period = self.nominal_period + slope
+        rate = (self.nominal_period / period - 1) * SECONDS_PER_DAY
+        rate_ci = Z_95 * slope_se * SECONDS_PER_DAY * self.nominal_period / period ** 2
+        # Tick-to-tock minus tock-to-tick is twice the gap between the lines.
+        return Reading(rate, rate_ci, abs(tock - tick) * 1000, Z_95 * gap_se * 1000,
+                       beats, seconds)
+
+    def session(self):
+        """Reading over every accepted beat since the start (or last reset)."""
+        if self._origin is None:
+            return None
+        return self._reading(self._session, self._session.n, self._last_time - self._first_time)
+
+    def window(self):
+        """Reading over the last `window_beats` accepted beats."""
+        if not self._recent:
+            return None
+        first_k, _ = self._recent[0]
+        last_k, _ = self._recent[-1]
+        return self._reading(self._window, len(self._recent),
+                             (last_k - first_k) * self.nominal_period)
+
+    def report(self):
+        def describe(r):
+            if r is None:
+                return "settling"
+            return (f"{r.rate:+.1f} ±{r.rate_ci:.2f} s/day, beat error "
+                    f"{r.beat_error:.2f} ±{r.beat_error_ci:.3f} ms")
+        return (f"{self.bph} bph: now {describe(self.window())}; "
+                f"session {describe(self.session())} ({self._session.n} beats, "
+                f"{self.rejected} rejected, {self.resets} resets)")
+
+
+# --- Offline analysis ---
+
+def read_recording(filename, block=READ_BLOCK_SAMPLES):
+    """Yields (sample_rate, int32 block) from a WAV written by process_to_wav
+    or a capture file."""
+    if is_capture_file(filename):
+        with CaptureReader(filename) as reader:
+            for _, _, samples in reader.iter_chunks():
+                yield reader.sample_rate, samples
+        return
+    with wave.open(filename, 'rb') as w:
+        if w.getsampwidth() != 4 or w.getnchannels() != 1:
+            raise ValueError(f"'{filename}' is not a mono 32-bit WAV from process_to_wav.py")
+        while True:
+            data = w.readframes(block)
+            if not data:
+                break
+            yield w.getframerate(), np.frombuffer(data, dtype='<i4')
+
+
+def analyze_file(filename, bph=None, window_beats=WINDOW_BEATS,
+                 report_interval=REPORT_INTERVAL_SECONDS):
+    """Runs the beat detector and the estimator over a whole recording,
+    printing the running readings. Returns the estimator (None if no beat
+    rate was found)."""
+    detector = estimator = None
+    next_report = report_interval
+    for sample_rate, samples in read_recording(filename):
+        if detector is None:
+            detector = BeatDetector(sample_rate, bph=bph)
+        beats = detector.process(samples)
+        if detector.bph and (estimator is None or estimator.bph != detector.bph):
+            estimator = RateEstimator(detector.bph, window_beats)
+        if estimator is not None:
+            estimator.extend(b.time for b in beats)
+        seconds = detector.samples_seen / sample_rate
+        if estimator is not None and seconds >= next_report:
+            next_report += report_interval
+            print(f"  {seconds:7.0f} s  {estimator.report()}")
+    if estimator is None:
+        print("No beat rate found.")
+        return None
+    print(f"Detector: {detector.report()}")
+    print(f"Result: {estimator.report()}")
+    return estimator
+
+
+# --- Self-check ---
+
+def run_selfcheck(seconds=SELFCHECK_SECONDS):
+    """Checks the readings against synthetic watches with a known rate and
+    beat error, and that an update costs the same however long the run."""
+    ok = True
+    for bph, rate, beat_error in ((21600, 12.0, 0.8), (28800, -7.5, 0.3), (36000, 3.0, 1.5)):
+        watch = WatchSignal(bph=bph, rate_error=rate, beat_error=beat_error, noise=0.03, seed=bph)
+        detector = BeatDetector(bph=bph)
+        estimator = RateEstimator(bph)
+        count = int(seconds * watch.sample_rate)
+        for start in range(0, count, READ_BLOCK_SAMPLES):
+            beats = detector.process(watch.render(start, min(READ_BLOCK_SAMPLES, count - start)))
+            estimator.extend(b.time for b in beats)
+        r = estimator.session()
+        # Allow a little beyond the interval for the detector's own scatter.
+        passed = (abs(r.rate - rate) <= max(2 * r.rate_ci, 0.5)
+                  and abs(r.beat_error - beat_error) <= max(2 * r.beat_error_ci, 0.02))
+        ok &= passed
+        print(f"  {bph} bph, {rate:+.1f} s/day, {beat_error} ms: {estimator.report()}  "
+              f"{'ok' if passed else 'FAIL'}")
+
+    # Cost per beat on a long run of clean beat times, early and late. The
+    # times are printed; what is checked is the work done, counted as
+    # regression-sum updates, and that the state stays the window's size.
+    estimator = RateEstimator(28800)
+    period = 3600.0 / 28800 / (1 + 5.0 / SECONDS_PER_DAY)
+    k = np.arange(BENCH_BEATS)
+    times = (k * period + np.where(k % 2, 0.0005, 0.0)
+             + np.random.default_rng(0).normal(0, 10e-6, BENCH_BEATS)).tolist()
+    updates = [0]
+    add = _RegressionSums.add
+
+    def counted_add(sums, x, y, sign=1):
+        updates[0] += 1
+        add(sums, x, y, sign)
+
+    costs, per_beat, held = [], [], []
+    chunk = BENCH_BEATS // 4
+    _RegressionSums.add = counted_add
+    try:
+        for i in range(0, BENCH_BEATS, chunk):
+            updates[0] = 0
+            start = time.perf_counter()
+            estimator.extend(times[i:i + chunk])
+            costs.append((time.perf_counter() - start) / chunk * 1e6)
+            per_beat.append(updates[0] / chunk)
+            held.append(len(estimator._recent))
+    finally:
+        _RegressionSums.add = add
+    r = estimator.session()
+    hours = BENCH_BEATS * period / 3600
+    print(f"  {BENCH_BEATS} beats ({hours:.0f} h): {' / '.join(f'{c:.1f}' for c in costs)} us/beat "
+          f"by quarter; session {r.rate:+.3f} ±{r.rate_ci:.3f} s/day, "
+          f"{r.beat_error:.4f} ms")
+    # Each beat: add to session and window, drop one from the window, plus
+    # the amortised rebase (one more add per beat).
+    constant = max(per_beat) - min(per_beat) < 0.01 and max(held) == estimator.window_beats
+    ok &= abs(r.rate - 5.0) < 0.01 and constant
+    print(f"  sum updates per beat by quarter: {' / '.join(f'{u:.3f}' for u in per_beat)}, "
+          f"window holds {max(held)} beats  {'ok' if constant else 'FAIL'}")
+    print("PASS" if ok else "FAIL")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rate and beat error of a recorded watch.")
+    parser.add_argument('input', nargs='?',
+                        help="WAV from process_to_wav.py, or a capture file (.tgc)")
+    parser.add_argument('--bph', type=int, choices=STANDARD_BPH,
+                        help="beat rate, if not to be detected")
+    parser.add_argument('--window', type=int, default=WINDOW_BEATS,
+                        help="beats in the sliding window")
+    parser.add_argument('--selfcheck', action='store_true',
+                        help="check against synthetic watches and time the updates")
+    args = parser.parse_args()
+    if args.selfcheck:
+        raise SystemExit(0 if run_selfcheck() else 1)
+    if not args.input:
+        parser.error("an input file is required")
+    analyze_file(args.input, args.bph, args.window)
@@ -1,10 +1,15 @@
 # realtime_player.py
+import argparse
 import serial
 import sounddevice as sd
 import numpy as np
-import queue
 import threading
 import time
+from alignment import Aligner
+from jitter_buffer import JitterBuffer
+from metrics import registry, MetricsReporter
+from sample_ring import SampleRing
+from sources import open_source, is_decoded
 
 # --- Configuration ---
 SERIAL_PORT = '/dev/ttyUSB0'
@@ -13,30 +18,59 @@ SAMPLE_RATE = 32000
 CHANNELS = 1
 DTYPE = 'int32'
 BYTES_PER_SAMPLE = 4
+# 'serial' for the port above, or 'broker' to listen through a running broker.py
+SOURCE = 'serial'
 
-# A large, thread-safe queue to pass data between threads
-audio_queue = queue.Queue(maxsize=400)
-stop_thread = False
+# A large, preallocated ring to pass samples between threads. The reader
+# thread is its only writer and the audio callback its only reader.
+RING_CAPACITY = 65536 # ~2s of audio
+audio_ring = SampleRing(RING_CAPACITY, dtype=DTYPE)
+# Plays the ring at the sound card's clock, resampling slightly to follow
+# the Pico's, so the buffer neither runs dry nor grows.
+playback = JitterBuffer(audio_ring, SAMPLE_RATE)
+
+# Counted in the callback, printed by a reporter thread: printing from the
+# callback itself would make the glitch worse.
+METRICS_INTERVAL_SECONDS = 10
+underflows = registry.counter('audio.underflows')
+callback_times = registry.histogram('callback')
+registry.gauge('ring.audio', source=audio_ring.occupancy)
+registry.gauge('playback.latency', 'ms', source=lambda: round(playback.latency_ms, 1))
+registry.gauge('playback.drift', 'ppm', source=lambda: round(playback.drift_ppm, 1))
 
-# A persistent buffer for the audio callback to handle misaligned chunks
-callback_buffer = b''
+# The raw stream has no framing, so a dropped byte would shift every later
+# sample. The aligner re-locks within one block (16 ms) and logs the slip.
+ALIGN_BLOCK_SAMPLES = 512
+READ_SIZE = 16384
+aligner = Aligner(block_samples=ALIGN_BLOCK_SAMPLES)
+stop_thread = False
 
 def serial_reader_thread():
     """Reads raw data from the serial port as fast as possible."""
     global stop_thread
     print("Serial reader thread started.")
     try:
-        with serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1) as ser:
+        with open_source(SOURCE, SERIAL_PORT, BAUD_RATE) as ser:
             # --- Initial Flush ---
             # Discard any old data sitting in the buffers to start fresh.
             ser.reset_input_buffer()
             time.sleep(0.1)
-            print(f"Listening on {SERIAL_PORT}...")
+            print(f"Listening on {SOURCE} ({SERIAL_PORT})...")
             
+            decoded = is_decoded(ser)
+            buf = bytearray(READ_SIZE)
+            view = memoryview(buf)
             while not stop_thread:
                 if ser.in_waiting > 0:
-                    chunk = ser.read(ser.in_waiting)
-                    audio_queue.put(chunk)
+                    if decoded:
+                        # Already aligned and sign-extended by the broker:
+                        # read straight into the ring.
+                        audio_ring.readinto_from(ser, ser.in_waiting, sign_extend=False)
+                        continue
+                    # Alignment and the 24-bit sign extension happen here, so
+                    # the callback only ever sees clean samples.
+                    n = ser.readinto(view[:min(ser.in_waiting, READ_SIZE)])
+                    audio_ring.write(aligner.feed(view[:n]))
                 else:
                     time.sleep(0.001) # Prevent busy-looping
 
@@ -47,50 +81,27 @@ def serial_reader_thread():
     print("Serial reader thread finished.")
 
 
-def audio_callback(outdata, frames, time, status):
+def audio_callback(outdata, frames, time_info, status):
     """
     The core of the real-time processing.
-    Handles alignment, endianness, and sign-extension.
+    Samples split across reads, byte alignment, endianness and sign-extension
+    are already handled by the reader thread, so all that is left is to play
+    from the ring through the jitter buffer.
     """
-    global callback_buffer
+    start = time.perf_counter()
     if status.output_underflow:
-        print('Output underflow!')
-
-    # Pull all available data from the queue and append to our persistent buffer
-    while not audio_queue.empty():
-        callback_buffer += audio_queue.get_nowait()
+        underflows.add()
 
-    # Determine the largest chunk that is a multiple of our sample size
-    safe_length = (len(callback_buffer) // BYTES_PER_SAMPLE) * BYTES_PER_SAMPLE
-    
-    if safe_length == 0:
-        # Not enough data for even one full sample, output silence
-        outdata.fill(0)
-        print("Warning: Starving for data, outputting silence.")
-        return
-
-    # Slice the safe portion for processing
-    processing_chunk = callback_buffer[:safe_length]
-    # Keep the leftover bytes for the next callback
-    callback_buffer = callback_buffer[safe_length:]
-
-    # --- Perform the corrections on the aligned data ---
-    # 1. Interpret as little-endian 32-bit integers
-    raw_samples = np.frombuffer(processing_chunk, dtype='<i4')
-    # 2. Perform 24-bit sign extension
-    corrected_samples = (raw_samples << 8) >> 8
-    
     # --- Output to speaker ---
-    len_available = len(corrected_samples)
-    len_needed = frames
-    
-    if len_available >= len_needed:
-        outdata[:] = corrected_samples[:len_needed].reshape(-1, 1)
-    else:
-        outdata.fill(0)
-        outdata[:len_available] = corrected_samples.reshape(-1, 1)
+    # Missing samples are padded with silence and counted as underruns.
+    playback.fill(outdata[:, 0])
+    callback_times.record(time.perf_counter() - start)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play the live audio stream.")
+    parser.add_argument('--source', default=SOURCE, help="'serial', 'serial:/dev/...', 'broker' or 'broker:ADDRESS'")
+    SOURCE = parser.parse_args().source
+
     # Ensure the Pico is running the continuous streamer script.
     input("Press Enter to start listening...")
 
@@ -100,8 +111,9 @@ if __name__ == "__main__":
 
     print("Priming audio buffer for 0.5 seconds...")
     time.sleep(0.5)
-    print(f"Buffer has {audio_queue.qsize()} chunks. Starting audio stream.")
+    print(f"Buffer has {audio_ring.occupancy()} samples. Starting audio stream.")
 
+    reporter = MetricsReporter(registry, METRICS_INTERVAL_SECONDS).start()
     try:
         with sd.OutputStream(samplerate=SAMPLE_RATE, channels=CHANNELS, dtype=DTYPE, callback=audio_callback):
             print("Audio stream started. Press Enter to stop.")
@@ -111,4 +123,9 @@ if __name__ == "__main__":
     finally:
         print("Stopping stream...")
         stop_thread = True
-        reader.join(timeout=2)
\ No newline at end of file
+        reader.join(timeout=2)
+        reporter.stop()
+        reporter.emit()
+        print(f"Audio: {audio_ring.report()}")
+        print(f"Playback: {playback.report()}")
+        print(f"Alignment: {aligner.report()}")
\ No newline at end of file
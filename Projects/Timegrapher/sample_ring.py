@@ -0,0 +1,309 @@
+# sample_ring.py
+import numpy as np
+from multiprocessing import shared_memory
+
+# --- Configuration ---
+DTYPE = 'int32'
+DEFAULT_CAPACITY = 65536  # ~2 seconds at 32 kHz
+
+# --- Header Layout ---
+# Cursors and counters live in a small int64 array in front of the samples,
+# so a ring can sit in shared memory and be used from two processes.
+_WRITE, _READ, _PARTIAL = 0, 1, 2
+_OVERRUNS, _OVERRUN_SAMPLES, _UNDERRUNS, _UNDERRUN_SAMPLES, _PEAK = 3, 4, 5, 6, 7
+_CAPACITY, _DTYPE_CHAR = 8, 9
+_HEADER_SLOTS = 16
+_HEADER_BYTES = _HEADER_SLOTS * 8
+
+
+class SampleRing:
+    """Fixed-capacity single-producer/single-consumer ring of samples.
+
+    The producer (serial thread) either copies decoded samples in with
+    `write` or lets the port fill the ring directly with `readinto_from`.
+    The consumer (audio callback) copies straight out of it with `read_into`.
+    Nothing is allocated after construction.
+
+    Each side only ever moves its own cursor. Both cursors count samples
+    since the start and only grow, so occupancy is simply `write - read`.
+    A cursor is one aligned 8-byte store, and the producer stores the data
+    before it moves its cursor, which is all the synchronisation a single
+    producer and a single consumer need, across threads or processes. When
+    the ring is full, new data is dropped (the producer may not touch the
+    read cursor) and counted as an overrun.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, dtype=DTYPE, _memory=None):
+        dtype = np.dtype(dtype)
+        if _memory is None:
+            _memory = bytearray(_HEADER_BYTES + capacity * dtype.itemsize)
+        self._header = np.frombuffer(_memory, dtype=np.int64, count=_HEADER_SLOTS)
+        self._buf = np.frombuffer(_memory, dtype=dtype, count=capacity, offset=_HEADER_BYTES)
+        self._header[_CAPACITY] = capacity
+        self._header[_DTYPE_CHAR] = ord(dtype.char)
+
+        self.capacity = capacity
+        self.dtype = dtype
+        self._itemsize = dtype.itemsize
+        self._bytes = memoryview(self._buf.view(np.uint8))
+        self._scratch = memoryview(bytearray(4096))
+        self._shm = None
+        self._owner = False
+
+    # --- Shared Memory ---
+
+    @classmethod
+    def create_shared(cls, capacity=DEFAULT_CAPACITY, dtype=DTYPE, name=None):
+        """Creates a ring in a new shared memory block. Pass `ring.name` to
+        `attach` in the other process."""
+        size = _HEADER_BYTES + capacity * np.dtype(dtype).itemsize
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        shm.buf[:_HEADER_BYTES] = bytes(_HEADER_BYTES)
+        ring = cls(capacity, dtype, _memory=shm.buf)
+        ring._shm, ring._owner = shm, True
+        return ring
+
+    @classmethod
+    def attach(cls, name):
+        """Opens a ring created by `create_shared` in another process."""
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+        except TypeError:
+            shm = shared_memory.SharedMemory(name=name)
+        header = np.frombuffer(shm.buf, dtype=np.int64, count=_HEADER_SLOTS)
+        capacity, dtype = int(header[_CAPACITY]), np.dtype(chr(int(header[_DTYPE_CHAR])))
+        del header
+        ring = cls(capacity, dtype, _memory=shm.buf)
+        ring._shm = shm
+        return ring
+
+    @property
+    def name(self):
+        return self._shm.name if self._shm is not None else None
+
+    def close(self):
+        """Releases the shared memory (and removes it, in the creating process)."""
+        if self._shm is None:
+            return
+        self._header = self._buf = self._bytes = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+        self._shm = None
+
+    # --- Counters ---
+
+    @property
+    def overruns(self):
+        return int(self._header[_OVERRUNS])
+
+    @property
+    def overrun_samples(self):
+        return int(self._header[_OVERRUN_SAMPLES])
+
+    @property
+    def underruns(self):
+        return int(self._header[_UNDERRUNS])
+
+    @property
+    def underrun_samples(self):
+        return int(self._header[_UNDERRUN_SAMPLES])
+
+    @property
+    def peak_occupancy(self):
+        return int(self._header[_PEAK])
+
+    @property
+    def written(self):
+        """Samples published since the start."""
+        return int(self._header[_WRITE])
+
+    @property
+    def consumed(self):
+        """Samples read since the start."""
+        return int(self._header[_READ])
+
+    def occupancy(self):
+        """Samples waiting to be read."""
+        return int(self._header[_WRITE] - self._header[_READ])
+
+    def free(self):
+        return self.capacity - self.occupancy()
+
+    # --- Producer side ---
+
+    def _publish(self, count):
+        header = self._header
+        header[_WRITE] += count
+        occupancy = header[_WRITE] - header[_READ]
+        if occupancy > header[_PEAK]:
+            header[_PEAK] = occupancy
+
+    def _overrun(self, samples):
+        self._header[_OVERRUNS] += 1
+        self._header[_OVERRUN_SAMPLES] += samples
+
+    def write(self, samples):
+        """Copies `samples` into the ring. Returns how many were stored."""
+        count = min(len(samples), self.free())
+        if count < len(samples):
+            self._overrun(len(samples) - count)
+        if count == 0:
+            return 0
+
+        start = int(self._header[_WRITE]) % self.capacity
+        first = min(count, self.capacity - start)
+        self._buf[start:start + first] = samples[:first]
+        self._buf[:count - first] = samples[first:count]
+        self._publish(count)
+        return count
+
+    def readinto_from(self, port, max_bytes=None, sign_extend=True):
+        """Lets `port.readinto` write straight into the ring's storage.
+
+        Reads at most `max_bytes` and never past the end of the storage, so a
+        read may return less than what is waiting; just call again. A sample
+        split across two reads is completed on the next call. With
+        `sign_extend`, the new 24-in-32-bit samples are sign-extended in place
+        before they are published. Returns the number of bytes read.
+        """
+        header = self._header
+        partial = int(header[_PARTIAL])
+        free = self.free()
+        if free == 0:
+            # Nowhere to put it, but the port must still be drained.
+            view = self._scratch if max_bytes is None else self._scratch[:max_bytes]
+            n = port.readinto(view) or 0
+            if n:
+                self._overrun(n // self._itemsize)
+                # The incomplete sample is lost too, but stay in step with
+                # the byte stream so the next sample lands correctly.
+                header[_PARTIAL] = (partial + n) % self._itemsize
+            return n
+
+        start = int(header[_WRITE]) % self.capacity
+        contiguous = min(free, self.capacity - start)
+        first_byte = start * self._itemsize + partial
+        last_byte = (start + contiguous) * self._itemsize
+        if max_bytes is not None:
+            last_byte = min(last_byte, first_byte + max_bytes)
+        n = port.readinto(self._bytes[first_byte:last_byte]) or 0
+
+        total = partial + n
+        complete = total // self._itemsize
+        header[_PARTIAL] = total % self._itemsize
+        if complete:
+            if sign_extend:
+                fresh = self._buf[start:start + complete]
+                fresh <<= 8
+                fresh >>= 8
+            self._publish(complete)
+        return n
+
+    # --- Consumer side ---
+
+    def read_available(self, out):
+        """Copies up to `len(out)` waiting samples into `out`, without padding.
+
+        Returns the number of samples copied.
+        """
+        header = self._header
+        read = int(header[_READ])
+        count = min(len(out), int(header[_WRITE]) - read)
+        start = read % self.capacity
+        first = min(count, self.capacity - start)
+        out[:first] = self._buf[start:start + first]
+        out[first:count] = self._buf[:count - first]
+        header[_READ] = read + count
+        return count
+
+    def skip(self, count):
+        """Discards up to `count` waiting samples; returns how many."""
+        header = self._header
+        read = int(header[_READ])
+        count = min(count, int(header[_WRITE]) - read)
+        header[_READ] = read + count
+        return count
+
+    def read_into(self, out):
+        """Copies up to `len(out)` samples into `out` (any writable 1-D view).
+
+        Whatever cannot be filled is set to zero and counted as an underrun.
+        Returns the number of real samples copied.
+        """
+        count = self.read_available(out)
+        if count < len(out):
+            out[count:] = 0
+            self._header[_UNDERRUNS] += 1
+            self._header[_UNDERRUN_SAMPLES] += len(out) - count
+        return count
+
+    def stats(self):
+        return {
+            'capacity': self.capacity,
+            'written': self.written,
+            'consumed': self.consumed,
+            'occupancy': self.occupancy(),
+            'peak_occupancy': self.peak_occupancy,
+            'overruns': self.overruns,
+            'overrun_samples': self.overrun_samples,
+            'underruns': self.underruns,
+            'underrun_samples': self.underrun_samples,
+        }
+
+    def report(self):
+        s = self.stats()
+        return (f"ring {s['occupancy']}/{s['capacity']} samples (peak {s['peak_occupancy']}), "
+                f"{s['underruns']} underruns ({s['underrun_samples']} samples), "
+                f"{s['overruns']} overruns ({s['overrun_samples']} samples)")
+
+
+class HistoryRing:
+    """Keeps the most recent `capacity` samples, overwriting the oldest.
+
+    Unlike `SampleRing` this has no reader: it is a window onto the recent
+    past, for late joiners and scrolling views. Only one thread may write.
+    """
+
+    def __init__(self, capacity, dtype=DTYPE):
+        self.capacity = capacity
+        self._buf = np.zeros(capacity, dtype=dtype)
+        self.total = 0  # Samples ever written
+
+    def extend(self, samples):
+        n = len(samples)
+        if n >= self.capacity:
+            # Only the tail survives; lay it out so the oldest sample sits at
+            # total % capacity, like after any other write.
+            self.total += n
+            start = self.total % self.capacity
+            tail = samples[n - self.capacity:]
+            self._buf[start:] = tail[:self.capacity - start]
+            self._buf[:start] = tail[self.capacity - start:]
+            return
+        start = self.total % self.capacity
+        first = min(n, self.capacity - start)
+        self._buf[start:start + first] = samples[:first]
+        self._buf[:n - first] = samples[first:]
+        self.total += n
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    def latest(self, count, out=None):
+        """Returns (a copy of) the last `count` samples, oldest first."""
+        count = min(count, len(self))
+        if out is None:
+            out = np.empty(count, dtype=self._buf.dtype)
+        out = out[:count]
+        end = self.total % self.capacity
+        start = (end - count) % self.capacity
+        if count == 0:
+            return out
+        if start < end:
+            out[:] = self._buf[start:end]
+        else:
+            first = self.capacity - start
+            out[:first] = self._buf[start:]
+            out[first:] = self._buf[:end]
+        return out
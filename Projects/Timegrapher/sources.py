@@ -0,0 +1,440 @@
+# sources.py
+import argparse
+import fcntl
+import os
+import socket
+import struct
+import termios
+import threading
+import time
+import tty
+import numpy as np
+
+# --- Configuration ---
+SERIAL_PORT = '/dev/ttyUSB0'
+BAUD_RATE = 2000000
+BROKER_ADDRESS = '/tmp/timegrapher-broker.sock'
+READ_TIMEOUT_SECONDS = 1
+
+# --- Replay and Synthetic Sources ---
+BITS_PER_BYTE = 10  # 8N1: start bit + 8 data bits + stop bit
+PACE_QUANTUM_SECONDS = 0.001  # USB serial adapters deliver data about once per ms
+SYNTH_BLOCK_SAMPLES = 4096
+SYNTH_PAYLOAD_SIZE = 512
+
+# --- Broker Subscription ---
+POLICY_DROP_OLDEST = 'drop-oldest'
+POLICY_BLOCK = 'block'
+DEFAULT_BACKLOG_SECONDS = 0.0
+
+
+def parse_address(address):
+    """'/path/to.sock' -> Unix socket, 'host:port' -> TCP."""
+    if ':' in address and not address.startswith('/'):
+        host, port = address.rsplit(':', 1)
+        return socket.AF_INET, (host or '127.0.0.1', int(port))
+    return socket.AF_UNIX, address
+
+
+class BrokerSource:
+    """Subscribes to a running broker and looks like a serial port.
+
+    The broker has already framed and decoded the stream, so what arrives
+    here are aligned, sign-extended little-endian int32 samples (`decoded`
+    is True). Supports `read`, `readinto`, `in_waiting` and
+    `reset_input_buffer`, which is all the Timegrapher scripts use.
+    """
+
+    decoded = True
+
+    def __init__(self, address=BROKER_ADDRESS, policy=POLICY_DROP_OLDEST,
+                 backlog_seconds=DEFAULT_BACKLOG_SECONDS, timeout=READ_TIMEOUT_SECONDS):
+        family, addr = parse_address(address)
+        self.address = address
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.connect(addr)
+        self.sock.sendall(f"SUBSCRIBE {policy} {backlog_seconds}\n".encode())
+
+        # The broker answers with one line describing the stream.
+        header = bytearray()
+        while not header.endswith(b'\n'):
+            byte = self.sock.recv(1)
+            if not byte:
+                raise ConnectionError(f"Broker at {address} closed the connection")
+            header += byte
+        fields = dict(field.split('=', 1) for field in header.decode().split()[1:])
+        self.sample_rate = int(fields.get('rate', 0))
+        self.sample_format = fields.get('format', '<i4')
+        self.sock.settimeout(timeout)
+
+    @property
+    def in_waiting(self):
+        return struct.unpack('i', fcntl.ioctl(self.sock, termios.FIONREAD, b'\0\0\0\0'))[0]
+
+    def reset_input_buffer(self):
+        """Nothing to flush; the broker decides where a subscriber starts."""
+
+    def readinto(self, buf):
+        """Reads whatever has arrived (up to `len(buf)`), waiting up to the timeout."""
+        try:
+            return self.sock.recv_into(buf)
+        except socket.timeout:
+            return 0
+
+    def read(self, size):
+        """Reads exactly `size` bytes unless the timeout expires first."""
+        buf = bytearray(size)
+        view = memoryview(buf)
+        got = 0
+        while got < size:
+            n = self.readinto(view[got:])
+            if n == 0:
+                break
+            got += n
+        return bytes(buf[:got])
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PacedSource:
+    """Serial-port look-alike that produces bytes at a chosen pace.
+
+    `bytes_per_second` is the pace (e.g. BAUD_RATE / BITS_PER_BYTE for the
+    real link); None means as fast as the consumer reads. `readinto` waits
+    up to `timeout` for data, like `serial.Serial`. Subclasses implement
+    `_produce(n)`, returning the next n bytes (or fewer at the end).
+    """
+
+    decoded = False
+
+    def __init__(self, bytes_per_second=None, timeout=READ_TIMEOUT_SECONDS):
+        self.bytes_per_second = bytes_per_second
+        self.timeout = timeout
+        self.bytes_read = 0
+        self.exhausted = False
+        self._start = time.monotonic()
+
+    def _produce(self, n):
+        raise NotImplementedError
+
+    def _due(self):
+        """Bytes the link would have delivered by now but nobody read yet."""
+        if self.exhausted:
+            return 0
+        if self.bytes_per_second is None:
+            return 1 << 20
+        # Data arrives in whole quanta, as it does from a USB serial adapter.
+        quanta = (time.monotonic() - self._start) // PACE_QUANTUM_SECONDS
+        return int(quanta * PACE_QUANTUM_SECONDS * self.bytes_per_second) - self.bytes_read
+
+    @property
+    def in_waiting(self):
+        return max(self._due(), 0)
+
+    def lag_bytes(self):
+        """How far the consumer is behind the pace, for soak tests."""
+        return self.in_waiting if self.bytes_per_second is not None else 0
+
+    def reset_input_buffer(self):
+        """Drops whatever is waiting, like flushing a real port."""
+        due = self.in_waiting
+        if self.bytes_per_second is not None and due:
+            self._start += due / self.bytes_per_second
+
+    def readinto(self, buf):
+        deadline = time.monotonic() + (self.timeout or 0)
+        due = self._due()
+        while due <= 0 and not self.exhausted:
+            if time.monotonic() >= deadline:
+                return 0
+            time.sleep(PACE_QUANTUM_SECONDS)
+            due = self._due()
+        data = self._produce(min(len(buf), due))
+        n = len(data)
+        if n < min(len(buf), due):
+            self.exhausted = True
+        buf[:n] = data
+        self.bytes_read += n
+        return n
+
+    def read(self, size):
+        buf = bytearray(size)
+        n = self.readinto(buf)
+        return bytes(buf[:n])
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ReplaySource(PacedSource):
+    """Plays back a capture file (e.g. raw_audio_misaligned.bin) byte for byte."""
+
+    def __init__(self, filename, bytes_per_second=BAUD_RATE / BITS_PER_BYTE, loop=False,
+                 timeout=READ_TIMEOUT_SECONDS):
+        super().__init__(bytes_per_second, timeout)
+        self.filename = filename
+        self.loop = loop
+        self._data = np.memmap(filename, dtype=np.uint8, mode='r')
+        self._pos = 0
+
+    def _produce(self, n):
+        if self.loop:
+            out = bytearray()
+            while len(out) < n:
+                chunk = self._data[self._pos:self._pos + n - len(out)]
+                out += chunk.tobytes()
+                self._pos = (self._pos + len(chunk)) % len(self._data)
+            return out
+        chunk = self._data[self._pos:self._pos + n]
+        self._pos += len(chunk)
+        return chunk.tobytes()
+
+
+class SyntheticSource(PacedSource):
+    """Renders a synthetic watch signal in one of the device's wire formats.
+
+    `wire_format` is 'raw' (bare 4-byte samples), 'framed' (SOF frames),
+    'seq' (sequenced frames with CRC) or 'packed' / 'seq-packed' (the same
+    with 3-byte samples). `speed` is a multiple of real time (1.0 = the
+    sample clock), or None for as fast as possible.
+    """
+
+    # wire format: framing protocol
+    PROTOCOLS = {'framed': 'bare', 'seq': 'seq', 'packed': 'packed', 'seq-packed': 'seq-packed'}
+
+    def __init__(self, watch=None, wire_format='framed', speed=1.0, timeout=READ_TIMEOUT_SECONDS,
+                 payload_size=SYNTH_PAYLOAD_SIZE):
+        from framing import encode_frames
+        from synthetic_watch import WatchSignal
+        self.watch = watch or WatchSignal()
+        self.wire_format = wire_format
+        self.samples_per_frame = payload_size // 4
+        if wire_format == 'raw':
+            wire_bytes_per_sample = 4.0
+        else:
+            frame = encode_frames(np.zeros(self.samples_per_frame), self.PROTOCOLS[wire_format],
+                                  self.samples_per_frame)
+            wire_bytes_per_sample = len(frame) / self.samples_per_frame
+        rate = None if speed is None else self.watch.sample_rate * wire_bytes_per_sample * speed
+        super().__init__(rate, timeout)
+        self._pending = bytearray()
+        self._next_sample = 0
+        self._next_seq = 0
+
+    def _render_block(self):
+        from framing import encode_frames
+        samples = self.watch.render(self._next_sample, SYNTH_BLOCK_SAMPLES)
+        self._next_sample += len(samples)
+        if self.wire_format == 'raw':
+            self._pending += samples.astype('<i4').tobytes()
+            return
+        self._pending += encode_frames(samples, self.PROTOCOLS[self.wire_format],
+                                       self.samples_per_frame, first_seq=self._next_seq)
+        self._next_seq = (self._next_seq + len(samples) // self.samples_per_frame) & 0xFFFF
+
+    def _produce(self, n):
+        while len(self._pending) < n:
+            self._render_block()
+        data = bytes(self._pending[:n])
+        del self._pending[:n]
+        return data
+
+
+class PtyDevice:
+    """Serves any source on a pseudo-terminal, so unmodified scripts (and
+    pyserial) can open it like the real device: `--source serial:<path>`.
+
+    Like the device's UART, it never waits for the reader: what the pty
+    cannot take when the source produces it is dropped and counted in
+    `overrun_bytes`, so a reader that falls behind shows up as lost data.
+    """
+
+    def __init__(self, source, chunk_size=4096):
+        self.source = source
+        self.chunk_size = chunk_size
+        self.master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        os.set_blocking(self.master, False)
+        self.path = os.ttyname(self._slave)
+        self.bytes_written = 0
+        self.overrun_bytes = 0
+        self.overruns = 0       # Writes the pty refused all or part of
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        buf = bytearray(self.chunk_size)
+        view = memoryview(buf)
+        while not self._stop.is_set():
+            n = self.source.readinto(buf)
+            if n == 0:
+                if getattr(self.source, 'exhausted', False):
+                    break
+                continue
+            try:
+                written = os.write(self.master, view[:n])
+            except BlockingIOError:
+                written = 0
+            self.bytes_written += written
+            if written < n:
+                self.overruns += 1
+                self.overrun_bytes += n - written
+
+    def report(self):
+        return (f"{self.bytes_written} bytes written to {self.path}, {self.overrun_bytes} "
+                f"dropped in {self.overruns} overruns")
+
+    def stop(self):
+        """Stops writing; the pty stays open, so a reader can drain it."""
+        self._stop.set()
+        self._thread.join(timeout=2)
+
+    def close(self):
+        self.stop()
+        os.close(self.master)
+        os.close(self._slave)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _parse_options(arg):
+    """'file.bin,speed=max,loop=1' -> ('file.bin', {'speed': 'max', 'loop': '1'})."""
+    positional, options = None, {}
+    for part in filter(None, arg.split(',')):
+        if '=' in part:
+            key, value = part.split('=', 1)
+            options[key.strip()] = value.strip()
+        else:
+            positional = part
+    return positional, options
+
+
+def _speed(value):
+    return None if value in ('max', 'inf') else float(value)
+
+
+def open_source(spec='serial', serial_port=SERIAL_PORT, baud_rate=BAUD_RATE, timeout=READ_TIMEOUT_SECONDS,
+                policy=POLICY_DROP_OLDEST, backlog_seconds=DEFAULT_BACKLOG_SECONDS):
+    """Opens the data source named by `spec`.
+
+    'serial'                the serial port given by `serial_port`
+    'serial:/dev/X'         a specific serial port (or a PtyDevice path)
+    'broker'                the local broker at BROKER_ADDRESS
+    'broker:ADDRESS'        a broker at a Unix socket path or host:port
+    'replay:FILE[,speed=S][,loop=1]'
+                            a capture played back at S times the link rate
+                            (default 1 = true baud pacing, 'max' = unpaced)
+    'synth:[bph=N][,rate=S/D][,beat_error=MS][,amplitude=DEG][,noise=F]
+           [,format=raw|framed|seq|packed|seq-packed][,speed=S]'
+                            a synthetic watch, S times real time
+
+    Everything returned can be used like a `serial.Serial` (and as a context
+    manager). Sources whose `decoded` attribute is True deliver aligned
+    int32 samples instead of the device's raw byte stream.
+    """
+    kind, _, arg = spec.partition(':')
+    if kind == 'serial':
+        import serial
+        return serial.Serial(arg or serial_port, baud_rate, timeout=timeout)
+    if kind == 'broker':
+        return BrokerSource(arg or BROKER_ADDRESS, policy, backlog_seconds, timeout)
+    if kind == 'replay':
+        filename, options = _parse_options(arg)
+        speed = _speed(options.get('speed', '1'))
+        rate = None if speed is None else baud_rate / BITS_PER_BYTE * speed
+        return ReplaySource(filename, rate, loop=options.get('loop') == '1', timeout=timeout)
+    if kind == 'synth':
+        from synthetic_watch import WatchSignal
+        _, options = _parse_options(arg)
+        watch = WatchSignal(bph=int(options.get('bph', 28800)),
+                            rate_error=float(options.get('rate', 0.0)),
+                            beat_error=float(options.get('beat_error', 0.0)),
+                            amplitude=float(options.get('amplitude', 270.0)),
+                            noise=float(options.get('noise', 0.02)))
+        return SyntheticSource(watch, options.get('format', 'framed'),
+                               _speed(options.get('speed', '1')), timeout)
+    raise ValueError(f"Unknown source '{spec}'")
+
+
+def is_decoded(source):
+    """True if `source` delivers decoded samples rather than wire bytes."""
+    return getattr(source, 'decoded', False)
+
+
+# --- Soak Test ---
+
+def soak(spec, consume, seconds=5.0, max_lag_seconds=0.5):
+    """Runs `consume(source)` in a loop against a paced source.
+
+    Returns the consumer's achieved byte rate and whether it kept up, i.e.
+    never fell more than `max_lag_seconds` behind the source's pace (None
+    for an unpaced source, which cannot be fallen behind). Raise the
+    source's speed until it stops keeping up to find a consumer's limit.
+    """
+    with open_source(spec) as source:
+        start = time.monotonic()
+        worst_lag = 0
+        while time.monotonic() - start < seconds and not source.exhausted:
+            consume(source)
+            worst_lag = max(worst_lag, source.lag_bytes())
+        elapsed = time.monotonic() - start
+        rate = source.bytes_read / elapsed
+        pace = source.bytes_per_second
+        kept_up = None if pace is None else worst_lag <= max_lag_seconds * pace
+        return rate, kept_up
+
+
+def _soak_framing(seconds):
+    """Example soak: how fast can FrameDecoder follow a synthetic watch?"""
+    from framing import FrameDecoder
+    for speed in ('1', '10', '100', '1000', 'max'):
+        decoder = FrameDecoder()
+        rate, kept_up = soak(f'synth:format=seq,speed={speed}',
+                             lambda src: decoder.read_from(src, max(src.in_waiting, 1)),
+                             seconds=seconds)
+        verdict = '' if kept_up is None else 'kept up, ' if kept_up else 'FELL BEHIND, '
+        print(f"  speed {speed:>4}: {rate / 1e6:7.2f} MB/s, {verdict}{decoder.report()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hardware-free Timegrapher data sources.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    pty_parser = sub.add_parser('pty', help="serve a source on a pseudo-terminal")
+    pty_parser.add_argument('spec', help="e.g. replay:raw_audio_misaligned.bin or synth:bph=21600")
+    soak_parser = sub.add_parser('soak', help="find how fast the frame decoder can go")
+    soak_parser.add_argument('--seconds', type=float, default=2.0)
+    args = parser.parse_args()
+
+    if args.command == 'pty':
+        with PtyDevice(open_source(args.spec)) as device:
+            print(f"Serving {args.spec} on {device.path}. Use --source serial:{device.path}")
+            print("Press Ctrl-C to stop.")
+            try:
+                while True:
+                    time.sleep(1)
+            except KeyboardInterrupt:
+                print(f"\nStopped: {device.report()}.")
+    else:
+        print("Soak test: FrameDecoder against a synthetic sequenced stream")
+        _soak_framing(args.seconds)
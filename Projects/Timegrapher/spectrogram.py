@@ -0,0 +1,258 @@
+# spectrogram.py
+import argparse
+import os
+import time
+import numpy as np
+from rate_estimator import read_recording
+
+# --- Configuration ---
+SAMPLE_RATE = 32000
+FFT_SIZE = 1024             # 31 Hz bins, 32 ms windows
+HOP_SIZE = 256              # 75% overlap: a column every 8 ms
+HISTORY_COLUMNS = 1024      # Columns kept in the image ring (~8 s)
+FLOOR_DB = -140.0           # Quietest level shown, dB below full scale
+FULL_SCALE = 2**23
+
+# --- Self-check Configuration ---
+SELFCHECK_SECONDS = 60
+MAX_LEVEL_ERROR_DB = 0.5
+
+# --- Headless Tile Configuration ---
+TILE_COLUMNS = 1024
+TILE_COLORMAP = 'magma'
+TILE_COMPRESSION = 1         # zlib level for the PNGs
+READ_BLOCK_SAMPLES = 32768
+
+
+class Spectrogram:
+    """Streaming short-time Fourier transform into a fixed-size image ring.
+
+    Blocks of any size go in; every `hop` samples a Hann-windowed frame of
+    `fft_size` samples is transformed and its power (dB below full scale)
+    becomes one column of `image` (bins x columns), overwriting the oldest.
+    The samples a frame still needs are carried over between blocks, and
+    all the frames a block completes are transformed in one batch. The
+    window, its scaling and the working buffers are made once.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE, fft_size=FFT_SIZE, hop=HOP_SIZE,
+                 columns=HISTORY_COLUMNS, floor_db=FLOOR_DB):
+        self.sample_rate = sample_rate
+        self.fft_size = fft_size
+        self.hop = hop
+        self.floor_db = floor_db
+        self.bins = fft_size // 2 + 1
+        self.frequencies = np.fft.rfftfreq(fft_size, 1.0 / sample_rate)
+        self.window = np.hanning(fft_size).astype(np.float32)
+        # A full-scale sine peaks at (FULL_SCALE * sum(window) / 2)^2: 0 dB.
+        self._reference_db = 20 * np.log10(FULL_SCALE * self.window.sum() / 2)
+
+        self.image = np.full((self.bins, columns), floor_db, dtype=np.float32)
+        self.columns_written = 0  # Total, so the newest is at (columns_written - 1) % columns
+        self._carry = np.zeros(0, dtype=np.float32)
+        self._staging = np.zeros(0, dtype=np.float32)
+        self._power = np.zeros((0, self.bins), dtype=np.float32)
+        self.busy_seconds = 0.0
+        self.samples_seen = 0
+
+    @property
+    def columns(self):
+        return self.image.shape[1]
+
+    def _reserve(self, samples, frames):
+        # Working buffers grow to the largest block seen, then are reused.
+        if len(self._staging) < samples:
+            self._staging = np.zeros(samples, dtype=np.float32)
+        if len(self._power) < frames:
+            self._power = np.zeros((frames, self.bins), dtype=np.float32)
+
+    def process(self, samples):
+        """Consumes a block; returns the new columns (frames x bins, a view
+        valid until the next call)."""
+        start_time = time.perf_counter()
+        carried = len(self._carry)
+        total = carried + len(samples)
+        frames = 0 if total < self.fft_size else (total - self.fft_size) // self.hop + 1
+        self._reserve(total, frames)
+        staging = self._staging[:total]
+        staging[:carried] = self._carry
+        staging[carried:] = samples
+        self.samples_seen += len(samples)
+
+        power = self._power[:frames]
+        if frames:
+            windows = np.lib.stride_tricks.sliding_window_view(
+                staging, self.fft_size)[::self.hop][:frames]
+            spectrum = np.fft.rfft(windows * self.window, axis=1)
+            np.abs(spectrum, out=power)
+            np.maximum(power, 1e-30, out=power)
+            np.log10(power, out=power)
+            power *= 20
+            power -= self._reference_db
+            np.maximum(power, self.floor_db, out=power)
+            self.add_columns(power)
+        self._carry = staging[frames * self.hop:].copy()
+        self.busy_seconds += time.perf_counter() - start_time
+        return power
+
+    def add_columns(self, power):
+        """Writes columns (frames x bins) computed elsewhere, as a display
+        copy of a spectrogram in another process does."""
+        n = len(power)
+        start = self.columns_written % self.columns
+        if n >= self.columns:
+            power = power[n - self.columns:]
+            self.columns_written += n - self.columns
+            n = self.columns
+            start = self.columns_written % self.columns
+        first = min(n, self.columns - start)
+        self.image[:, start:start + first] = power[:first].T
+        self.image[:, :n - first] = power[first:].T
+        self.columns_written += n
+
+    def ordered(self, out=None):
+        """The image with the oldest column on the left (into `out`)."""
+        if out is None:
+            out = np.empty_like(self.image)
+        split = self.columns_written % self.columns
+        out[:, :self.columns - split] = self.image[:, split:]
+        out[:, self.columns - split:] = self.image[:, :split]
+        return out
+
+    @property
+    def seconds_per_column(self):
+        return self.hop / self.sample_rate
+
+    def report(self):
+        seconds = self.samples_seen / self.sample_rate
+        factor = seconds / self.busy_seconds if self.busy_seconds else 0.0
+        return (f"{self.columns_written} columns ({self.fft_size}-point FFT every "
+                f"{self.hop} samples), {factor:.0f}x real time")
+
+
+# --- Headless tiles ---
+
+def write_tiles(filename, directory, tile_columns=TILE_COLUMNS, fft_size=FFT_SIZE,
+                hop=HOP_SIZE, colormap=TILE_COLORMAP):
+    """Renders the spectrogram of a recording (WAV from process_to_wav.py or
+    a capture file) as PNG tiles of `tile_columns` columns each, low
+    frequencies at the bottom. Returns the tile filenames."""
+    import matplotlib
+    from PIL import Image
+
+    # Colour through a 256-entry lookup table and save with light
+    # compression: imsave's float colormapping and default zlib level cost
+    # more than the transforms do.
+    lut = (matplotlib.colormaps[colormap](np.linspace(0, 1, 256))[:, :3] * 255).astype(np.uint8)
+    scaled = np.empty((fft_size // 2 + 1, tile_columns), dtype=np.float32)
+    index = np.empty(scaled.shape, dtype=np.uint8)
+
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.splitext(os.path.basename(filename))[0]
+    spectrogram = None
+    tile = None
+    filled = 0
+    tiles = []
+    start = time.perf_counter()
+    render_seconds = 0.0
+
+    def save(image):
+        nonlocal render_seconds
+        t = time.perf_counter()
+        name = os.path.join(directory, f"{base}_{len(tiles):04d}.png")
+        width = image.shape[1]
+        np.multiply(image, -255.0 / spectrogram.floor_db, out=scaled[:, :width])
+        scaled[:, :width] += 255.0
+        np.clip(scaled[:, :width], 0, 255, out=scaled[:, :width])
+        np.copyto(index[:, :width], scaled[:, :width], casting='unsafe')
+        Image.fromarray(lut[index[::-1, :width]]).save(name, compress_level=TILE_COMPRESSION)
+        tiles.append(name)
+        render_seconds += time.perf_counter() - t
+
+    for sample_rate, samples in read_recording(filename, READ_BLOCK_SAMPLES):
+        if spectrogram is None:
+            # The ring only needs to hold one block's columns: tiles are
+            # assembled from what each call returns.
+            spectrogram = Spectrogram(sample_rate, fft_size, hop,
+                                      columns=READ_BLOCK_SAMPLES // hop + 1)
+            tile = np.empty((spectrogram.bins, tile_columns), dtype=np.float32)
+        columns = spectrogram.process(samples)
+        while len(columns):
+            n = min(len(columns), tile_columns - filled)
+            tile[:, filled:filled + n] = columns[:n].T
+            filled += n
+            columns = columns[n:]
+            if filled == tile_columns:
+                save(tile)
+                filled = 0
+    if filled:
+        save(tile[:, :filled])
+
+    elapsed = time.perf_counter() - start
+    seconds = spectrogram.samples_seen / spectrogram.sample_rate if spectrogram else 0.0
+    print(f"Wrote {len(tiles)} tiles ({tile_columns * spectrogram.seconds_per_column:.1f} s each) "
+          f"to '{directory}'.")
+    print(f"Spectrogram: {spectrogram.report()}; with reading and PNG writing "
+          f"{seconds / elapsed:.0f}x real time ({render_seconds:.1f} s of it writing PNGs).")
+    return tiles
+
+
+# --- Self-check ---
+
+def run_selfcheck(seconds=SELFCHECK_SECONDS):
+    """Checks levels and bins against a known tone, that ragged blocks give
+    the same columns as one long one, and the speed on a synthetic watch."""
+    from synthetic_watch import WatchSignal
+    ok = True
+
+    # A full-scale tone centred on a bin reads 0 dB in that bin.
+    spectrogram = Spectrogram()
+    frequency = spectrogram.frequencies[64]
+    t = np.arange(SAMPLE_RATE) / SAMPLE_RATE
+    tone = (FULL_SCALE * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+    columns = spectrogram.process(tone).copy()
+    level = columns[:, 64].mean()
+    passed = np.all(columns.argmax(axis=1) == 64) and abs(level) < MAX_LEVEL_ERROR_DB
+    ok &= passed
+    print(f"  full-scale {frequency:.0f} Hz tone: {level:+.2f} dB in bin 64  "
+          f"{'ok' if passed else 'FAIL'}")
+
+    # Ragged blocks == one block.
+    streamed = Spectrogram()
+    rng = np.random.default_rng(1)
+    pieces, position = [], 0
+    while position < len(tone):
+        size = int(rng.integers(1, 3000))
+        pieces.append(streamed.process(tone[position:position + size]).copy())
+        position += size
+    same = np.allclose(np.concatenate(pieces), columns, atol=1e-3)
+    ok &= same
+    print(f"  {len(pieces)} ragged blocks give the same columns as one: {same}")
+
+    watch = WatchSignal(bph=28800, noise=0.05)
+    spectrogram = Spectrogram()
+    count = int(seconds * SAMPLE_RATE)
+    for start in range(0, count, READ_BLOCK_SAMPLES):
+        spectrogram.process(watch.render(start, min(READ_BLOCK_SAMPLES, count - start)))
+    print(f"  {seconds} s of a synthetic watch: {spectrogram.report()}")
+    print("PASS" if ok else "FAIL")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Spectrogram of a recording, as image tiles.")
+    parser.add_argument('input', nargs='?',
+                        help="WAV from process_to_wav.py, or a capture file (.tgc)")
+    parser.add_argument('output', nargs='?', default='spectrogram',
+                        help="directory for the PNG tiles")
+    parser.add_argument('--fft', type=int, default=FFT_SIZE, help="FFT size (samples)")
+    parser.add_argument('--hop', type=int, default=HOP_SIZE, help="samples between columns")
+    parser.add_argument('--tile', type=int, default=TILE_COLUMNS, help="columns per tile")
+    parser.add_argument('--selfcheck', action='store_true',
+                        help="check levels and streaming against known signals")
+    args = parser.parse_args()
+    if args.selfcheck:
+        raise SystemExit(0 if run_selfcheck() else 1)
+    if not args.input:
+        parser.error("an input file is required")
+    write_tiles(args.input, args.output, args.tile, args.fft, args.hop)
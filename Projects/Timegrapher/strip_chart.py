@@ -0,0 +1,375 @@
+# strip_chart.py
+import argparse
+import time
+import numpy as np
+from sample_ring import HistoryRing
+
+# --- Paper Strip Configuration ---
+STRIP_SECONDS = 60          # Width of one sweep; the strip starts over after it
+PHASE_RANGE_MS = 20.0       # Beat phase shown, +-; points outside wrap round
+STRIP_MAX_BEATS_PER_SECOND = 10  # 36000 bph
+
+# --- Spectrogram View Configuration ---
+SPECTROGRAM_INTERVAL_SECONDS = 0.25  # Redraw at most this often
+
+# --- Benchmark Configuration ---
+BENCH_FRAMES = 200
+BENCH_SAMPLE_RATE = 32000
+BENCH_WINDOW_SAMPLES = 8000
+
+
+def minmax_decimate(samples, columns, out=None):
+    """Reduces `samples` to a min and a max per column, interleaved, so a line
+    through them draws the same picture as every sample would at that width.
+
+    Returns (x, y): x in sample positions (two per column), y the values.
+    Columns hold a whole number of samples, so there may be a few more
+    columns than asked for; `out` needs room for len(samples) values. If
+    there are fewer than two samples per column they are returned as is.
+    """
+    n = len(samples)
+    per_column = n // columns if columns else 0
+    if per_column < 2:
+        return np.arange(n), samples
+    columns = n // per_column
+    used = per_column * columns
+    blocks = samples[n - used:].reshape(columns, per_column)
+    if out is None:
+        out = np.empty(2 * columns, dtype=samples.dtype)
+    out = out[:2 * columns]
+    np.min(blocks, axis=1, out=out[0::2])
+    np.max(blocks, axis=1, out=out[1::2])
+    x = n - used + np.repeat(np.arange(columns) * per_column + per_column // 2, 2)
+    return x, out
+
+
+class FrameTimer:
+    """Times each frame of a display and keeps the mean and worst case."""
+
+    def __init__(self):
+        self.frames = 0
+        self.total = 0.0
+        self.worst = 0.0
+        self.last = 0.0
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.last = time.perf_counter() - self._start
+        self.frames += 1
+        self.total += self.last
+        self.worst = max(self.worst, self.last)
+
+    def report(self):
+        mean = self.total / self.frames * 1000 if self.frames else 0.0
+        return f"{self.frames} frames, {mean:.2f} ms/frame (worst {self.worst * 1000:.2f})"
+
+
+class _BlitView:
+    """An axes whose moving parts are drawn by hand over a saved background.
+
+    The artists are `animated`, so a full draw leaves them out; `capture`
+    (call it from the figure's draw_event) saves that clean background. The
+    saved region reaches a few pixels past the axes, for markers on the edge.
+    """
+
+    PAD_PIXELS = 4
+
+    def __init__(self, ax):
+        self.ax = ax
+        self.background = None
+
+    @property
+    def region(self):
+        return self.ax.bbox.padded(self.PAD_PIXELS)
+
+    def capture(self, canvas):
+        self.background = canvas.copy_from_bbox(self.region)
+
+    def _redraw(self, canvas, artists):
+        canvas.restore_region(self.background)
+        for artist in artists:
+            self.ax.draw_artist(artist)
+        canvas.blit(self.region)
+
+
+class WaveformView(_BlitView):
+    """Scrolling raw waveform, min/max decimated to the axes' pixel width
+    from a HistoryRing, so each frame costs the same whatever the window."""
+
+    def __init__(self, ax, window_samples, dtype='int32', **line_kwargs):
+        super().__init__(ax)
+        self.window_samples = window_samples
+        self.history = HistoryRing(window_samples, dtype=dtype)
+        self._window = np.zeros(window_samples, dtype=dtype)
+        self._decimated = np.empty(window_samples, dtype=dtype)
+        self.line, = ax.plot([], [], animated=True, **line_kwargs)
+        ax.set_xlim(0, window_samples)
+
+    def extend(self, samples):
+        self.history.extend(samples)
+
+    def draw(self, canvas):
+        if self.background is None:
+            return
+        count = len(self.history)
+        window = self.history.latest(count, out=self._window)
+        columns = max(1, int(self.ax.bbox.width))
+        x, y = minmax_decimate(window, columns, out=self._decimated)
+        self.line.set_data(x + (self.window_samples - count), y)
+        self._redraw(canvas, (self.line,))
+
+
+class TraceView(_BlitView):
+    """The averaged tick and tock (beat_trace.BeatTrace), redrawn only when
+    beats have been added to it."""
+
+    def __init__(self, ax, trace):
+        super().__init__(ax)
+        self.trace = trace
+        self._scratch = np.empty_like(trace.average)
+        self._version = -1
+        self.lines = [ax.plot(trace.time_ms, trace.average[side], animated=True, label=label)[0]
+                      for side, label in ((0, 'tick'), (1, 'tock'))]
+        ax.set_xlim(trace.time_ms[0], trace.time_ms[-1])
+        ax.set_ylim(-1.05, 1.05)
+        ax.set_xlabel("ms from onset")
+        ax.legend(handles=self.lines, loc='upper right')
+
+    def capture(self, canvas):
+        super().capture(canvas)
+        self._version = -1  # Everything was just wiped: draw again
+
+    def draw(self, canvas):
+        if self.background is None or self.trace.version == self._version:
+            return
+        self._version = self.trace.version
+        self.trace.normalized(out=self._scratch)
+        for line, row in zip(self.lines, self._scratch):
+            line.set_ydata(row)
+        self._redraw(canvas, self.lines)
+
+
+class SpectrogramView(_BlitView):
+    """Waterfall of a spectrogram.Spectrogram's image ring, oldest on the
+    left.
+
+    Drawing an image is by far the dearest part of a frame, so the ring is
+    max-pooled down to about DISPLAY_ROWS x DISPLAY_COLUMNS (a click stays
+    visible however narrow) and redrawn at most every `interval` seconds,
+    and only when columns have been added.
+    """
+
+    DISPLAY_ROWS = 128
+    DISPLAY_COLUMNS = 512
+
+    def __init__(self, ax, spectrogram, interval=SPECTROGRAM_INTERVAL_SECONDS, cmap='magma'):
+        super().__init__(ax)
+        self.spectrogram = spectrogram
+        self.interval = interval
+        self._scratch = np.empty_like(spectrogram.image)
+        bins = spectrogram.bins - 1  # The Nyquist bin is left off
+        self._row_factor = max(1, bins // self.DISPLAY_ROWS)
+        self._column_factor = max(1, spectrogram.columns // self.DISPLAY_COLUMNS)
+        self._display = np.empty((bins // self._row_factor,
+                                  spectrogram.columns // self._column_factor), dtype=np.float32)
+        self._written = -1
+        self._last = 0.0
+        span = spectrogram.columns * spectrogram.seconds_per_column
+        top = spectrogram.frequencies[len(self._display) * self._row_factor] / 1000
+        self.image = ax.imshow(self._display, origin='lower', aspect='auto', animated=True,
+                               interpolation='nearest', extent=(-span, 0, 0, top), cmap=cmap,
+                               vmin=spectrogram.floor_db, vmax=0.0)
+        ax.set_xlabel("s")
+        ax.set_ylabel("kHz")
+
+    def capture(self, canvas):
+        super().capture(canvas)
+        self._written = -1
+        self._last = 0.0
+
+    def draw(self, canvas):
+        if self.background is None or self.spectrogram.columns_written == self._written:
+            return
+        now = time.perf_counter()
+        if now - self._last < self.interval:
+            return
+        self._last = now
+        self._written = self.spectrogram.columns_written
+        image = self.spectrogram.ordered(out=self._scratch)
+        rows, columns = self._display.shape
+        image = image[:rows * self._row_factor, image.shape[1] - columns * self._column_factor:]
+        np.max(image.reshape(rows, self._row_factor, columns, self._column_factor),
+               axis=(1, 3), out=self._display)
+        self.image.set_data(self._display)
+        self._redraw(canvas, (self.image,))
+
+
+class PaperStrip(_BlitView):
+    """Timegrapher "paper strip": each beat's phase against time.
+
+    Phase is how far each beat is ahead of a grid of the nominal beat
+    period, so a watch on rate draws flat lines, a gaining one climbs, and
+    the gap between the tick and tock lines is twice the beat error. Points
+    leaving the +-PHASE_RANGE_MS band wrap round, like the paper does.
+
+    Drawing is incremental: each frame draws only the beats added since the
+    last one on top of the previous frame, and keeps the result as the new
+    background. A frame costs the same at the end of a sweep as at the
+    start; a new sweep begins from the clean background.
+    """
+
+    def __init__(self, ax, span_seconds=STRIP_SECONDS, phase_range_ms=PHASE_RANGE_MS):
+        super().__init__(ax)
+        self.span_seconds = span_seconds
+        self.phase_range_ms = phase_range_ms
+        self.bph = None
+        self._origin = None
+        self._sweep_start = None
+        # The current sweep's points (for redrawing after a resize): x, y, tock.
+        capacity = int(span_seconds * STRIP_MAX_BEATS_PER_SECOND) + 1
+        self._points = np.zeros((capacity, 3))
+        self._count = 0
+        self._drawn = 0
+        self._strip_background = None
+        self._new_sweep = False
+        self.markers = [ax.plot([], [], '.', markersize=3, animated=True, label=label)[0]
+                        for label in ('tick', 'tock')]
+        ax.set_xlim(0, span_seconds)
+        ax.set_ylim(-phase_range_ms, phase_range_ms)
+        ax.set_xlabel("s")
+        ax.set_ylabel("beat phase (ms)")
+        ax.legend(handles=self.markers, loc='upper right')
+
+    def add(self, beats, bph):
+        """Adds detected beats (beat_detector.Beat) for a watch at `bph`."""
+        if not bph or not beats:
+            return
+        if bph != self.bph:
+            self.bph = bph
+            self._origin = self._sweep_start = beats[0].time
+            self._start_sweep()
+        period = 3600.0 / bph
+        times = np.array([b.time for b in beats])
+        if times[-1] - self._sweep_start >= self.span_seconds:
+            self._sweep_start += (times[-1] - self._sweep_start) // self.span_seconds \
+                * self.span_seconds
+            times = times[times >= self._sweep_start]
+            beats = beats[len(beats) - len(times):]
+            self._start_sweep()
+        offset = times - self._origin
+        phase = (np.round(offset / period) * period - offset) * 1000
+        r = self.phase_range_ms
+        phase = (phase + r) % (2 * r) - r
+        n = min(len(times), len(self._points) - self._count)
+        rows = self._points[self._count:self._count + n]
+        rows[:, 0] = times[:n] - self._sweep_start
+        rows[:, 1] = phase[:n]
+        rows[:, 2] = [b.kind == 'tock' for b in beats[:n]]
+        self._count += n
+
+    def _start_sweep(self):
+        self._count = self._drawn = 0
+        self._new_sweep = True
+
+    def capture(self, canvas):
+        super().capture(canvas)
+        self._strip_background = self.background
+        self._drawn = 0  # Redraw the whole sweep so far over the clean background
+
+    def draw(self, canvas):
+        if self.background is None:
+            return
+        if self._new_sweep:
+            self._new_sweep = False
+            self._strip_background = self.background
+        if self._drawn == self._count:
+            return
+        new = self._points[self._drawn:self._count]
+        canvas.restore_region(self._strip_background)
+        for side, marker in enumerate(self.markers):
+            points = new[new[:, 2] == side]
+            marker.set_data(points[:, 0], points[:, 1])
+            self.ax.draw_artist(marker)
+        self._strip_background = canvas.copy_from_bbox(self.region)
+        canvas.blit(self.region)
+        self._drawn = self._count
+
+    @property
+    def points(self):
+        return self._count
+
+
+# --- Benchmark ---
+
+def run_benchmark(frames=BENCH_FRAMES):
+    """Renders a growing session off-screen and compares frame costs early
+    and late, against the deque-and-full-redraw plot this replaces."""
+    import collections
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from beat_detector import Beat
+    from synthetic_watch import WatchSignal
+
+    watch = WatchSignal(bph=28800, rate_error=5.0, beat_error=0.4, noise=0.05)
+    block = BENCH_SAMPLE_RATE // 20  # One frame of audio at 50 ms
+    beats_per_frame = 0.05 * 8       # 28800 bph
+
+    # The old way: a deque of ints turned into line data, full redraw.
+    fig, ax = plt.subplots()
+    data = collections.deque([0] * BENCH_WINDOW_SAMPLES, maxlen=BENCH_WINDOW_SAMPLES)
+    line, = ax.plot(data)
+    ax.set_ylim(-2**23, 2**23)
+    old = FrameTimer()
+    for frame in range(frames // 4):
+        with old:
+            data.extend(watch.render(frame * block, block).tolist())
+            line.set_ydata(data)
+            fig.canvas.draw()
+    plt.close(fig)
+
+    fig, (wave_ax, strip_ax) = plt.subplots(2, 1)
+    wave_ax.set_ylim(-2**23, 2**23)
+    wave = WaveformView(wave_ax, BENCH_WINDOW_SAMPLES)
+    strip = PaperStrip(strip_ax, span_seconds=frames * 0.05 * 2)
+    canvas = fig.canvas
+    canvas.mpl_connect('draw_event', lambda event: (wave.capture(canvas), strip.capture(canvas)))
+    canvas.draw()
+    quarters = []
+    timer = FrameTimer()
+    beat = 0
+    for frame in range(frames):
+        if frame % (frames // 4) == 0:
+            timer = FrameTimer()
+            quarters.append(timer)
+        with timer:
+            wave.extend(watch.render(frame * block, block))
+            new = []
+            while beat < (frame + 1) * beats_per_frame:
+                t = float(watch.beat_time(beat))
+                new.append(Beat(t * BENCH_SAMPLE_RATE, t, 1.0, 'tock' if beat % 2 else 'tick'))
+                beat += 1
+            strip.add(new, 28800)
+            wave.draw(canvas)
+            strip.draw(canvas)
+    plt.close(fig)
+    print(f"  deque + full redraw: {old.report()}")
+    for i, quarter in enumerate(quarters):
+        print(f"  blitted, quarter {i + 1}: {quarter.report()}")
+    print(f"  {strip.points} points on the strip at the end")
+    return old, quarters
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Strip chart and waveform views.")
+    parser.add_argument('--bench', action='store_true',
+                        help="time frames off-screen as a session grows")
+    args = parser.parse_args()
+    if args.bench:
+        run_benchmark()
+    else:
+        parser.print_help()
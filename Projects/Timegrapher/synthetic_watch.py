@@ -0,0 +1,101 @@
+# synthetic_watch.py
+import math
+import numpy as np
+
+# --- Configuration ---
+SAMPLE_RATE = 32000
+FULL_SCALE = 2**23 - 1
+STANDARD_BPH = (18000, 19800, 21600, 25200, 28800, 36000)
+
+# --- Tick Sound Model ---
+# Each beat is three short bursts: unlock, impulse and drop. The time from
+# unlock to drop is the time the balance needs to sweep the lift angle, which
+# is what amplitude measurement relies on.
+BURST_FREQUENCY_HZ = 5000
+BURST_DECAY_SECONDS = 0.0003
+BURST_LENGTH_SECONDS = 0.003
+UNLOCK_LEVEL = 0.45
+IMPULSE_LEVEL = 0.25
+DROP_LEVEL = 1.0
+PEAK_LEVEL = 0.25  # Fraction of full scale for the loudest burst
+
+
+class WatchSignal:
+    """Synthetic timegrapher microphone signal with known parameters.
+
+    `rate_error` is in seconds per day (positive = gaining), `beat_error` in
+    milliseconds, `amplitude` and `lift_angle` in degrees and `noise` as a
+    fraction of the tick peak. The signal is a pure function of the sample
+    index, so any block can be rendered on its own and blocks join up
+    exactly.
+    """
+
+    def __init__(self, bph=28800, rate_error=0.0, beat_error=0.0, amplitude=270.0,
+                 lift_angle=52.0, noise=0.02, sample_rate=SAMPLE_RATE, seed=0):
+        if not 18000 <= bph <= 36000:
+            raise ValueError("bph must be between 18000 and 36000")
+        self.bph = bph
+        self.rate_error = rate_error
+        self.beat_error = beat_error
+        self.amplitude = amplitude
+        self.lift_angle = lift_angle
+        self.noise = noise
+        self.sample_rate = sample_rate
+        self.seed = seed
+
+        nominal_beat = 3600.0 / bph
+        # A gaining watch beats slightly faster than nominal.
+        self.beat_period = nominal_beat / (1 + rate_error / 86400.0)
+        oscillation_period = 2 * self.beat_period
+        self.lift_seconds = oscillation_period / math.pi * math.asin(
+            min(1.0, lift_angle / (2 * amplitude)))
+
+    def beat_time(self, k):
+        """Time in seconds of the unlock of beat k (even = tick, odd = tock)."""
+        k = np.asarray(k)
+        # Tick-to-tock is longer than tock-to-tick by twice the beat error.
+        offset = np.where(k % 2 == 1, self.beat_error / 1000.0, 0.0)
+        return k * self.beat_period + offset
+
+    def beats_between(self, t0, t1):
+        """Indices of the beats whose sound overlaps [t0, t1)."""
+        first = max(0, int(math.floor((t0 - BURST_LENGTH_SECONDS - self.lift_seconds
+                                       - abs(self.beat_error) / 1000.0) / self.beat_period)))
+        last = int(math.ceil(t1 / self.beat_period)) + 1
+        k = np.arange(first, last)
+        return k[self.beat_time(k) < t1]
+
+    @staticmethod
+    def _burst_shape(t):
+        shape = np.exp(-t / BURST_DECAY_SECONDS) * np.sin(2 * np.pi * BURST_FREQUENCY_HZ * t)
+        return np.where((t >= 0) & (t < BURST_LENGTH_SECONDS), shape, 0.0)
+
+    def render(self, start, count):
+        """Returns samples [start, start + count) as int32 24-bit values."""
+        out = np.zeros(count, dtype=np.float64)
+        t0, t1 = start / self.sample_rate, (start + count) / self.sample_rate
+        burst_samples = int(math.ceil(BURST_LENGTH_SECONDS * self.sample_rate)) + 1
+        impulse_offset = self.lift_seconds * 0.4
+        for k in self.beats_between(t0, t1):
+            beat = float(self.beat_time(k))
+            for offset, level in ((0.0, UNLOCK_LEVEL), (impulse_offset, IMPULSE_LEVEL),
+                                  (self.lift_seconds, DROP_LEVEL)):
+                onset = (beat + offset) * self.sample_rate
+                first = int(math.ceil(onset))
+                lo, hi = max(first - start, 0), min(first + burst_samples - start, count)
+                if lo < hi:
+                    rel = (start + np.arange(lo, hi) - onset) / self.sample_rate
+                    out[lo:hi] += level * self._burst_shape(rel)
+
+        out *= PEAK_LEVEL * FULL_SCALE
+        if self.noise:
+            # Seeded per block of 4096 samples so the noise is reproducible.
+            block = 4096
+            first, last = start // block, (start + count - 1) // block
+            for b in range(first, last + 1):
+                rng = np.random.default_rng((self.seed, b))
+                noise = rng.standard_normal(block) * (self.noise * PEAK_LEVEL * FULL_SCALE)
+                lo, hi = max(start, b * block), min(start + count, (b + 1) * block)
+                out[lo - start:hi - start] += noise[lo - b * block:hi - b * block]
+        np.clip(out, -FULL_SCALE - 1, FULL_SCALE, out=out)
+        return out.astype(np.int32)